@@ -0,0 +1,339 @@
+"""
+Benchmark the ingest and query hot paths on synthetic PDFs.
+The embedding and LLM providers are replaced by deterministic local stand-ins, so the benchmark runs offline
+and only measures this application. Results are saved as JSON to compare runs over time.
+
+    python -m benchmarks.run_benchmarks --pages 200 --image-pages 20 --baseline benchmarks/results/previous.json
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import shutil
+import subprocess  # nosec
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+from benchmarks.synthetic import (
+    HashEmbeddings,
+    StandInLLM,
+    page_lines,
+    write_image_pdf,
+    write_text_pdf,
+)
+from py_executable_checklist.workflow import run_workflow as run_steps
+from rich import print
+from rich.table import Table
+
+from doc_search import workflow
+from doc_search.faiss_index import INDEX_TYPES, VECTOR_STORAGE
+from doc_search.instrumentation import instrumentation, run_workflow
+from doc_search.workflow import (
+    AskQuestion,
+    CombineAllText,
+    ConvertImagesToText,
+    ConvertPDFToImages,
+    CreateIndex,
+    ExtractTextLayer,
+    ImageMagickCommand,
+    LoadIndex,
+    LoadLLM,
+    VerifyInputFile,
+)
+
+RESULTS_DIR = Path(__file__).parent / "results"
+# Throughput of every stage is measured by the items it counts while running
+STAGE_ITEMS = {
+    "ExtractTextLayer": "pages",
+    "ConvertPDFToImages": "pages",
+    "ConvertImagesToText": "pages",
+    "CombineAllText": "chunks",
+    "CreateIndex": "chunks",
+}
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default=100, type=int, help="Pages of the synthetic PDF with a text layer")
+    parser.add_argument(
+        "--image-pages",
+        default=10,
+        type=int,
+        help="Pages of the synthetic image only PDF, which is skipped without ImageMagick and Tesseract",
+    )
+    parser.add_argument("--queries", default=200, type=int, help="Questions asked for every retrieval mode")
+    parser.add_argument("--index-loads", default=5, type=int, help="Number of times the index is loaded")
+    parser.add_argument("--index-type", default="flat", choices=INDEX_TYPES, help="FAISS index type")
+    parser.add_argument("--vector-storage", default="float32", choices=VECTOR_STORAGE, help="Type of stored vectors")
+    parser.add_argument("--workers", default=os.cpu_count() or 1, type=int, help="Workers for OCR")
+    parser.add_argument("--output", type=Path, help="Save results to this JSON file (default is in results dir)")
+    parser.add_argument("--baseline", type=Path, help="Compare with the results of a previous run")
+    return parser.parse_args()
+
+
+def benchmark_context(app_dir: Path, pdf_path: Path, index_type: str = "flat", workers: int = 1) -> dict[str, Any]:
+    return {
+        "input_pdf_path": pdf_path,
+        "app_dir": app_dir,
+        "start_page": 0,
+        "end_page": -1,
+        "force_ocr": False,
+        "workers": workers,
+        "embedding": "openai",
+        "embedding_batch_size": None,
+        "embedding_cache_size": 0,
+        "embedding_threads": 0,
+        "quantize_embeddings": False,
+        "chunk_size": None,
+        "chunk_overlap": 32,
+        "overwrite_index": True,
+        "index_type": index_type,
+        "nlist": 0,
+        "pq_m": 0,
+        "hnsw_m": 32,
+        "vector_storage": "float32",
+        "pca_dims": 0,
+        "index_report": False,
+        "checkpoint_chunks": 0,
+        "checkpoint_seconds": 0,
+        "nprobe": 8,
+        "ef_search": 64,
+        "llm": "openai",
+        "answer_cache_size": 0,
+        "answer_cache_ttl": 0,
+        "answer_cache_similarity": 0,
+        "context_tokens": None,
+        "retrieve_k": 10,
+        "min_similarity": 0,
+    }
+
+
+@contextmanager
+def offline_providers() -> Iterator[None]:
+    """
+    Replace the embedding and LLM providers by the local stand-ins while the benchmark runs
+    """
+    embeddings = HashEmbeddings()
+    original = workflow.embedding_from_selection, workflow.llm_from_selection
+    workflow.embedding_from_selection = lambda *_, **__: embeddings
+    workflow.llm_from_selection = lambda _: StandInLLM()  # type: ignore
+    try:
+        yield
+    finally:
+        workflow.embedding_from_selection, workflow.llm_from_selection = original
+
+
+def stage_results(records: list[dict]) -> dict[str, dict]:
+    stages = {}
+    for record in records:
+        result = {
+            "wall_seconds": record["wall_seconds"],
+            "cpu_seconds": record["cpu_seconds"] + record["children_cpu_seconds"],
+            "process_peak_rss_bytes": max(record["process_peak_rss_bytes"], record["children_peak_rss_bytes"]),
+        }
+        item = STAGE_ITEMS.get(record["step"])
+        if item:
+            items = record["counts"].get(item, 0)
+            result[item] = items
+            result[f"{item}_per_second"] = items / max(record["wall_seconds"], 1e-9)
+        stages[record["step"]] = result
+    return stages
+
+
+def ingest(context: dict, steps: list) -> dict[str, dict]:
+    instrumentation.reset()
+    run_workflow(context, steps)
+    return stage_results(instrumentation.report()["steps"])
+
+
+def ocr_tools_missing() -> str | None:
+    missing = [tool for tool in ["convert", "tesseract"] if shutil.which(tool) is None]
+    return f"{' and '.join(missing)} not found" if missing else None
+
+
+def questions_for(pages: int, count: int) -> list[tuple[str, int]]:
+    """
+    Questions with the page which answers them, alternating between an error code and plain words
+    """
+    questions = []
+    for i in range(count):
+        page = (i * 7919) % pages
+        if i % 2:
+            questions.append((f"Which page reported error code ERR-{page:05d}?", page))
+        else:
+            questions.append((f"What does the book say about {' '.join(page_lines(page)[0].split()[:6])}?", page))
+    return questions
+
+
+def latency_percentiles(latencies: list[float]) -> dict[str, float]:
+    milliseconds = np.array(latencies) * 1000
+    return {
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "mean_ms": float(milliseconds.mean()),
+    }
+
+
+def benchmark_index_load(context: dict, loads: int) -> dict[str, float]:
+    timings = []
+    for _ in range(max(loads, 1)):
+        started = time.perf_counter()
+        run_steps(context, [LoadIndex])
+        timings.append(time.perf_counter() - started)
+    return {"first_seconds": timings[0], "median_seconds": float(np.median(timings))}
+
+
+def benchmark_queries(context: dict, questions: list[tuple[str, int]], retrieval: str) -> dict[str, float]:
+    latencies = []
+    hits = 0
+    for question, page in questions:
+        query_context = {**context, "input_question": question, "retrieval": retrieval}
+        started = time.perf_counter()
+        run_steps(query_context, [AskQuestion])
+        latencies.append(time.perf_counter() - started)
+        hits += f"page {page + 1}" in query_context["sources"]
+    return {**latency_percentiles(latencies), "hit_rate": hits / len(questions), "queries": len(questions)}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(  # nosec
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    app_dir: Path,
+    pages: int = 100,
+    image_pages: int = 10,
+    queries: int = 200,
+    index_loads: int = 5,
+    index_type: str = "flat",
+    workers: int = 1,
+    vector_storage: str = "float32",
+) -> dict[str, Any]:
+    results: dict[str, Any] = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "pages": pages,
+            "image_pages": image_pages,
+            "queries": queries,
+            "index_type": index_type,
+            "vector_storage": vector_storage,
+            "workers": workers,
+        },
+    }
+    with offline_providers():
+        text_pdf = write_text_pdf(app_dir / "synthetic-text.pdf", pages)
+        context = {**benchmark_context(app_dir, text_pdf, index_type, workers), "vector_storage": vector_storage}
+        results["text_pdf"] = ingest(context, [VerifyInputFile, ExtractTextLayer, CombineAllText, CreateIndex])
+        results["index_bytes"] = context["index_path"].stat().st_size
+
+        skipped = ocr_tools_missing() if image_pages else "no image pages"
+        if not skipped:
+            image_pdf = write_image_pdf(app_dir / "synthetic-image.pdf", image_pages)
+            image_steps = [
+                VerifyInputFile,
+                ExtractTextLayer,
+                ImageMagickCommand,
+                ConvertPDFToImages,
+                ConvertImagesToText,
+            ]
+            results["image_pdf"] = ingest(benchmark_context(app_dir, image_pdf, index_type, workers), image_steps)
+        else:
+            results["image_pdf"] = {"skipped": skipped}
+
+        results["index_load"] = benchmark_index_load(context, index_loads)
+        run_steps(context, [LoadLLM])
+        questions = questions_for(pages, queries)
+        results["queries"] = {
+            retrieval: benchmark_queries(context, questions, retrieval) for retrieval in ["vector", "hybrid"]
+        }
+    return results
+
+
+def headline_metrics(results: dict[str, Any]) -> dict[str, float]:
+    metrics = {}
+    for pdf in ["text_pdf", "image_pdf"]:
+        for step, stage in results.get(pdf, {}).items():
+            if not isinstance(stage, dict):
+                continue
+            for key in ["pages_per_second", "chunks_per_second"]:
+                if key in stage:
+                    metrics[f"{step} {key.replace('_per_second', '/sec')}"] = stage[key]
+    if "index_bytes" in results:
+        metrics["index size (MB)"] = results["index_bytes"] / 1024 / 1024
+    metrics["index load (median s)"] = results["index_load"]["median_seconds"]
+    for retrieval, query in results["queries"].items():
+        metrics[f"{retrieval} query p50 (ms)"] = query["p50_ms"]
+        metrics[f"{retrieval} query p99 (ms)"] = query["p99_ms"]
+        metrics[f"{retrieval} hit rate"] = query["hit_rate"]
+    metrics["peak memory (MB)"] = (
+        max(
+            stage["process_peak_rss_bytes"]
+            for pdf in ["text_pdf", "image_pdf"]
+            for stage in results.get(pdf, {}).values()
+            if isinstance(stage, dict)
+        )
+        / 1024
+        / 1024
+    )
+    return metrics
+
+
+def print_results(results: dict[str, Any], baseline: dict[str, Any] | None = None) -> None:
+    metrics = headline_metrics(results)
+    baseline_metrics = headline_metrics(baseline) if baseline else {}
+    table = Table(title=f"Benchmark of {results['config']['pages']} pages")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    if baseline:
+        table.add_column("Baseline", justify="right")
+        table.add_column("Change", justify="right")
+    for name, value in metrics.items():
+        row = [name, f"{value:.3f}"]
+        if baseline:
+            previous = baseline_metrics.get(name)
+            row.append("-" if previous is None else f"{previous:.3f}")
+            row.append("-" if not previous else f"{(value - previous) / previous:+.1%}")
+        table.add_row(*row)
+    print(table)
+
+
+def main() -> None:  # pragma: no cover
+    args = parse_args()
+    output = args.output or RESULTS_DIR / f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with tempfile.TemporaryDirectory() as app_dir:
+        results = run_benchmarks(
+            Path(app_dir),
+            args.pages,
+            args.image_pages,
+            args.queries,
+            args.index_loads,
+            args.index_type,
+            args.workers,
+            args.vector_storage,
+        )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+    print_results(results, baseline)
+    print(f"[bold]Saved[/bold] results to {output}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
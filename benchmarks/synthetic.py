@@ -0,0 +1,132 @@
+"""
+Synthetic PDFs and deterministic offline stand-ins for the embedding and LLM providers
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import random
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+from PIL import Image, ImageDraw
+
+SYLLABLES = (
+    "ba be bi bo bu da de di do du ka ke ki ko ku la le li lo lu ma me mi mo mu na ne ni no nu ra re ri ro ru".split()
+)
+VOCABULARY_SIZE = 5000
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+
+
+@lru_cache(maxsize=None)
+def vocabulary(seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(VOCABULARY_SIZE)]
+
+
+def page_lines(page: int, seed: int = 42) -> list[str]:
+    """
+    Deterministic text of a page, with an error code on every page so keyword search has something to find.
+    Words are skewed towards the start of the vocabulary like in natural language.
+    """
+    rng = random.Random(seed * 100003 + page)
+    words = vocabulary(seed)
+    lines = [
+        " ".join(words[int(len(words) ** rng.random()) - 1] for _ in range(WORDS_PER_LINE))
+        for _ in range(LINES_PER_PAGE - 1)
+    ]
+    lines.insert(rng.randrange(len(lines)), f"error code ERR-{page:05d} was reported on page {page + 1}")
+    return lines
+
+
+def pdf_objects(objects: list[bytes]) -> bytes:
+    """
+    Assemble a PDF from its numbered objects, the first one being the catalog
+    """
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def write_text_pdf(path: Path, pages: int, seed: int = 42) -> Path:
+    """
+    PDF with a text layer on every page
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for page in range(pages):
+        text = b" T* ".join(b"(%s) Tj" % line.encode("ascii") for line in page_lines(page, seed))
+        stream = b"BT /F1 10 Tf 12 TL 40 800 Td " + text + b" ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_refs.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(page_refs), pages)
+    path.write_bytes(pdf_objects(objects))
+    return path
+
+
+def write_image_pdf(path: Path, pages: int, seed: int = 42) -> Path:
+    """
+    PDF where every page is a scanned image without a text layer, so it has to go through OCR
+    """
+    images = []
+    for page in range(pages):
+        image = Image.new("L", (1240, 1754), color=255)
+        draw = ImageDraw.Draw(image)
+        for i, line in enumerate(page_lines(page, seed)):
+            draw.text((80, 80 + i * 40), line, fill=0)
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=150)
+    return path
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for an embedding provider, hashing words into a fixed number of dimensions
+    so texts sharing words are close to each other
+    """
+
+    def __init__(self, dimension: int = 384) -> None:
+        self.dimension = dimension
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimension
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()  # nosec
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0 if digest[4] % 2 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+
+class StandInLLM(LLM):
+    """
+    Deterministic stand-in for an LLM provider, answering with the size of the prompt
+    """
+
+    @property
+    def _llm_type(self) -> str:
+        return "stand-in"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        return f"Answer based on {len(prompt.split())} words of context"
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
@@ -1,12 +1,17 @@
 import logging
 import os
+import threading
 import time
 import typing
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from functools import wraps
 
 import openai
 from dotenv import load_dotenv
-from rich.progress import track
+
+from doc_search.instrumentation import instrumentation
 
 load_dotenv()
 
@@ -33,8 +38,83 @@ def setup_logging(verbosity: int) -> None:
     logging.captureWarnings(capture=True)
 
 
+class RateLimitGate:
+    """
+    Rate limit back off shared between threads calling the same API, so that one rate limited call pauses all of them
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def wait(self) -> None:
+        while True:
+            with self.lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+class SharedWorkerPool:
+    """
+    Bound the page and embedding work running at the same time across all documents which are ingested together,
+    so that ingesting many documents at once doesn't start a full pool of workers per document.
+    Outside of bulk ingest each step is only bounded by its own number of workers.
+    """
+
+    def __init__(self) -> None:
+        self.slots: typing.Optional[threading.BoundedSemaphore] = None
+
+    @property
+    def active(self) -> bool:
+        return self.slots is not None
+
+    def limit(self, workers: typing.Optional[int]) -> None:
+        self.slots = threading.BoundedSemaphore(max(workers, 1)) if workers is not None else None
+
+    @contextmanager
+    def slot(self) -> typing.Iterator[None]:
+        slots = self.slots
+        if slots is None:
+            yield
+            return
+        with slots:
+            yield
+
+
+shared_pool = SharedWorkerPool()
+
+
+def retry_after(e: Exception) -> typing.Optional[float]:
+    """
+    Seconds to wait before trying again as asked by the Retry-After header of a rate limited response.
+    The header is either a number of seconds or a date.
+    """
+    headers = getattr(e, "headers", None) or {}
+    value = next((value for name, value in headers.items() if name.lower() == "retry-after"), None)
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
 def retry(
-    exceptions: typing.Type[openai.error.RateLimitError], tries: int = 4, delay: int = 3, back_off: int = 2
+    exceptions: typing.Type[openai.error.RateLimitError],
+    tries: int = 4,
+    delay: int = 3,
+    back_off: int = 2,
+    gate: typing.Optional[RateLimitGate] = None,
 ) -> typing.Callable:
     def deco_retry(f: typing.Any) -> typing.Callable:
         @wraps(f)
@@ -42,14 +122,25 @@ def retry(
             m_retries, m_delay = tries, delay
             while m_retries > 1:
                 try:
+                    if gate:
+                        gate.wait()
                     return f(*args, **kwargs)
                 except exceptions as e:
                     msg = f"🚨 {e} {os.linesep} "
                     logging.warning(msg)
-                    for _ in track(range(m_delay), description="⌛ Retrying in ..."):
-                        time.sleep(1)
+                    wait = retry_after(e)
+                    wait = m_delay if wait is None else wait
+                    logging.warning("⌛ Retrying in %.0f seconds", wait)
+                    instrumentation.count("retries")
+                    instrumentation.count("retry_wait_seconds", wait)
+                    if gate:
+                        gate.pause(wait)
+                    else:
+                        time.sleep(wait)
                     m_retries -= 1
                     m_delay *= back_off
+            if gate:
+                gate.wait()
             return f(*args, **kwargs)
 
         return f_retry  # true decorator
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Sequence
+
+import numpy as np
+
+
+def answer_namespace(*parts: Any) -> str:
+    """
+    Answers are only reused for the same index version, LLM and prompt template
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def normalise_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+class AnswerCache:
+    """
+    Persistent cache of answers keyed by a namespace and the question.
+    Questions can also match a cached question whose embedding is at least `similarity` similar.
+    Answers expire after ttl_seconds, and least recently used answers are evicted above max_entries.
+    """
+
+    def __init__(self, db_path: Path, max_entries: int, ttl_seconds: float) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path.as_posix(), check_same_thread=False)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS answers (
+                    namespace TEXT NOT NULL,
+                    question_hash TEXT NOT NULL,
+                    vector BLOB,
+                    answer TEXT NOT NULL,
+                    sources TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, question_hash)
+                )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+
+    @staticmethod
+    def question_hash(question: str) -> str:
+        return hashlib.sha256(normalise_question(question).encode("utf-8")).hexdigest()
+
+    def get(
+        self, namespace: str, question: str, vector: Sequence[float] | None = None, similarity: float = 0
+    ) -> dict | None:
+        expired_before = time.time() - self.ttl_seconds
+        with self.lock, self.db:
+            row = self.db.execute(
+                "SELECT rowid, answer, sources FROM answers WHERE namespace = ? AND question_hash = ? AND created > ?",
+                (namespace, self.question_hash(question), expired_before),
+            ).fetchone()
+            if row is None and vector is not None and similarity > 0:
+                row = self.most_similar(namespace, vector, similarity, expired_before)
+            if row is None:
+                return None
+            rowid, answer, sources = row
+            self.db.execute("UPDATE answers SET last_access = ? WHERE rowid = ?", (time.time(), rowid))
+        return {"output": answer, "sources": json.loads(sources)}
+
+    def most_similar(
+        self, namespace: str, vector: Sequence[float], similarity: float, expired_before: float
+    ) -> tuple | None:
+        rows = self.db.execute(
+            "SELECT rowid, answer, sources, vector FROM answers "
+            "WHERE namespace = ? AND created > ? AND vector IS NOT NULL",
+            (namespace, expired_before),
+        ).fetchall()
+        if not rows:
+            return None
+        query = np.asarray(vector, dtype=np.float32)
+        cached = np.stack([np.frombuffer(row[3], dtype=np.float32) for row in rows])
+        similarities = cached @ query / (np.linalg.norm(cached, axis=1) * np.linalg.norm(query) + 1e-10)
+        best = int(np.argmax(similarities))
+        if similarities[best] < similarity:
+            return None
+        logging.info("Found cached answer with %.3f similarity", similarities[best])
+        return tuple(rows[best][:3])
+
+    def put(
+        self, namespace: str, question: str, answer: str, sources: list[str], vector: Sequence[float] | None = None
+    ) -> None:
+        now = time.time()
+        blob = np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers (namespace, question_hash, vector, answer, sources, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, self.question_hash(question), blob, answer, json.dumps(sources), now, now),
+            )
+            self.evict()
+
+    def evict(self) -> None:
+        self.db.execute("DELETE FROM answers WHERE created <= ?", (time.time() - self.ttl_seconds,))
+        self.db.execute(
+            "DELETE FROM answers WHERE rowid IN (SELECT rowid FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
@@ -2,15 +2,23 @@
 Indexes a PDF file and generate OpenAI Embeddings.
 Also allow user to ask question using the command line interface or the web app.
 """
+import os
+import sys
 from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 from pathlib import Path
+from typing import Callable
 
-from py_executable_checklist.workflow import run_workflow
 from rich import print
 
 from doc_search import setup_logging
-from doc_search.web import run_web
+from doc_search.faiss_index import INDEX_TYPES, VECTOR_STORAGE
+from doc_search.ingest import run_ingest
+from doc_search.instrumentation import instrumentation, run_workflow
 from doc_search.workflow import (
+    batch_workflow_steps,
+    embedding_benchmark_workflow_steps,
+    library_inference_workflow_steps,
+    metrics_report_path,
     pre_process_workflow_steps,
     training_workflow_steps,
     workflow_steps,
@@ -19,26 +27,165 @@ from doc_search.workflow import (
 
 def parse_args() -> Namespace:
     parser = ArgumentParser(description=__doc__, formatter_class=RawDescriptionHelpFormatter)
-    parser.add_argument("-i", "--input-pdf-path", required=True, type=Path, help="Path to input PDF file")
+    parser.add_argument("-i", "--input-pdf-path", type=Path, help="Path to input PDF file")
     parser.add_argument("-d", "--app_dir", default=Path.home(), type=Path, help="Path to app directory")
     parser.add_argument(
         "-s", "--start-page", default=-1, type=int, help="Specify if you want to start from a specific page"
     )
     parser.add_argument("-e", "--end-page", default=-1, type=int, help="Specify if you want to end at a specific page")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        default=os.cpu_count() or 1,
+        type=int,
+        help="Number of pages to convert or scan in parallel",
+    )
     parser.add_argument(
         "-q", "--input-question", default="Can you provide a summary of the context?", help="Question to ask"
     )
+    parser.add_argument(
+        "--context-tokens",
+        type=int,
+        help="Maximum number of tokens of document chunks sent to the LLM (default depends on the LLM)",
+    )
+    parser.add_argument(
+        "--retrieval",
+        choices=["vector", "hybrid"],
+        default="vector",
+        help="Retrieve chunks by embedding similarity, or combined with keyword (BM25) search for codes and part numbers",
+    )
+    parser.add_argument("--retrieve-k", default=10, type=int, help="Number of candidate chunks to retrieve")
+    parser.add_argument(
+        "--min-similarity",
+        default=0,
+        type=float,
+        help="Skip chunks less similar to the question than this (0-1), by default all candidates are considered",
+    )
+    parser.add_argument(
+        "--answer-cache-size", default=1000, type=int, help="Number of answers to cache, use 0 to disable the cache"
+    )
+    parser.add_argument("--answer-cache-ttl", default=168, type=float, help="Hours before a cached answer expires")
+    parser.add_argument(
+        "--answer-cache-similarity",
+        default=0,
+        type=float,
+        help="Reuse the answer of a cached question at least this similar (0-1), by default only identical questions",
+    )
+    parser.add_argument(
+        "--questions-file", type=Path, help="Answer every question in this file, one per line, use - for stdin"
+    )
+    parser.add_argument(
+        "--answers-file", default=Path("-"), type=Path, help="Write batch answers as JSON lines, - for stdout"
+    )
+    parser.add_argument(
+        "--concurrency", default=8, type=int, help="Number of questions sent to the LLM at the same time in batch"
+    )
+    parser.add_argument("--stream", action="store_true", help="Print the answer as it is generated")
     parser.add_argument("-w", "--overwrite-index", action="store_true", help="Overwrite existing index")
     parser.add_argument("-t", "--train", action="store_true", help="Train and index the PDF file")
     parser.add_argument("-a", "--web-app", action="store_true", help="Start WebApp")
+    parser.add_argument(
+        "--web-workers", default=32, type=int, help="Number of questions the web app answers at the same time"
+    )
     parser.add_argument("-p", "--pre-process", action="store_true", help="Extract text from PDF file")
+    parser.add_argument(
+        "--force-ocr",
+        action="store_true",
+        help="Run OCR on every page even if the PDF already has a text layer",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Stream each page from image conversion straight into OCR instead of running the stages one after another",
+    )
+    parser.add_argument(
+        "--image-mode",
+        choices=["keep", "delete", "memory"],
+        default="keep",
+        help="What to do with page images in pipeline mode: keep them on disk, delete them after OCR or never write them",
+    )
     parser.add_argument(
         "-b",
         "--embedding",
-        choices=["openai", "huggingface", "huggingface-hub", "cohere"],
+        choices=["openai", "huggingface", "huggingface-hub", "cohere", "local"],
         default="openai",
         help="Embedding to use",
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="Number of tokens per chunk (default fits the context window of the embedding)",
+    )
+    parser.add_argument("--chunk-overlap", default=32, type=int, help="Number of tokens shared by adjacent chunks")
+    parser.add_argument(
+        "--embedding-batch-size",
+        type=int,
+        help="Number of chunks to embed per request (default depends on the embedding)",
+    )
+    parser.add_argument(
+        "--embedding-threads",
+        default=0,
+        type=int,
+        help="Number of threads used by the local embedding (default uses all cores)",
+    )
+    parser.add_argument(
+        "--quantize-embeddings",
+        action="store_true",
+        help="Quantize the local embedding model to int8 for faster indexing",
+    )
+    parser.add_argument(
+        "--embedding-benchmark",
+        action="store_true",
+        help="Compare speed and retrieval agreement of the local embedding with and without quantization",
+    )
+    parser.add_argument(
+        "--checkpoint-chunks",
+        default=1000,
+        type=int,
+        help="Save the partial index every this many embedded chunks, so an interrupted --train can resume",
+    )
+    parser.add_argument(
+        "--checkpoint-seconds",
+        default=300,
+        type=float,
+        help="Also save the partial index every this many seconds, use 0 for both to disable checkpoints",
+    )
+    parser.add_argument(
+        "--embedding-cache-size",
+        default=1024,
+        type=int,
+        help="Maximum size of the embedding cache in MB, use 0 to disable it",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default="flat",
+        help="FAISS index to build, approximate indexes search large libraries faster with less memory",
+    )
+    parser.add_argument("--nlist", default=0, type=int, help="Number of IVF clusters (default depends on chunk count)")
+    parser.add_argument(
+        "--pq-m", default=0, type=int, help="Number of IVF-PQ sub-quantizers (default depends on dimension)"
+    )
+    parser.add_argument("--hnsw-m", default=32, type=int, help="Number of neighbours per HNSW node")
+    parser.add_argument("--nprobe", default=8, type=int, help="Number of IVF clusters to visit per question")
+    parser.add_argument("--ef-search", default=64, type=int, help="HNSW search depth per question")
+    parser.add_argument(
+        "--vector-storage",
+        choices=VECTOR_STORAGE,
+        default="float32",
+        help="Store vectors as float16 or int8 in the index to keep more documents in memory, with a small recall loss",
+    )
+    parser.add_argument(
+        "--pca-dims",
+        default=0,
+        type=int,
+        help="Reduce vectors to this many dimensions with PCA fitted when the index is created (0 keeps all)",
+    )
+    parser.add_argument(
+        "--index-report",
+        action="store_true",
+        help="Report recall and latency of the index against exact search after creating it",
+    )
     parser.add_argument(
         "-l",
         "--llm",
@@ -47,6 +194,48 @@ def parse_args() -> Namespace:
         help="LLM to use",
     )
 
+    parser.add_argument(
+        "--library",
+        action="store_true",
+        help="Ask question across all indexed PDFs instead of a single one",
+    )
+    parser.add_argument(
+        "--max-loaded-indexes",
+        default=16,
+        type=int,
+        help="Maximum number of PDF indexes to keep loaded when asking questions across the library",
+    )
+    parser.add_argument(
+        "--ingest",
+        help="Train every PDF in a directory or matching a glob pattern, skipping PDFs which were already ingested",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep checking the --ingest directory or pattern for new PDFs",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        default=30,
+        type=float,
+        help="Seconds between checks for new PDFs when watching",
+    )
+    parser.add_argument(
+        "--ingest-concurrency",
+        default=4,
+        type=int,
+        help="Number of PDFs ingested at the same time, sharing --workers workers for their pages",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=Path,
+        help="Save timing and resource usage of every step as JSON (default is a new file in the metrics directory)",
+    )
+    parser.add_argument(
+        "--prometheus",
+        action="store_true",
+        help="Serve the metrics of the web app in Prometheus format at /metrics",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -55,23 +244,76 @@ def parse_args() -> Namespace:
         dest="verbose",
         help="Increase verbosity of logging output",
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    single_pdf_mode = args.web_app or args.train or args.pre_process or args.embedding_benchmark
+    if args.input_pdf_path is None and args.library and single_pdf_mode:
+        parser.error("--library only works when asking questions, the other modes need -i/--input-pdf-path")
+    if args.input_pdf_path is None and not args.library and not args.ingest:
+        parser.error("the following arguments are required: -i/--input-pdf-path")
+    return args
+
+
+def answer_printer(question: str) -> Callable[[str], None]:
+    """
+    Print the question followed by the tokens of the answer as they arrive
+    """
+    printed_question = False
+
+    def print_token(token: str) -> None:
+        nonlocal printed_question
+        if not printed_question:
+            print("[bold]Question: " + question + "[/bold]")
+            print("[blue]Answer: [/blue]", end="")
+            printed_question = True
+        # Tokens are written as is, so brackets in the answer aren't treated as markup
+        sys.stdout.write(token)
+        sys.stdout.flush()
+
+    return print_token
 
 
 def main() -> None:  # pragma: no cover
     args = parse_args()
     setup_logging(args.verbose)
+    try:
+        if args.ingest:
+            # Ingesting runs the training workflow for each PDF it finds
+            run_ingest(args.__dict__)
+        else:
+            run(args)
+    finally:
+        instrumentation.write_report(args.metrics_file or metrics_report_path(args.app_dir))
+
+
+def run(args: Namespace) -> None:  # pragma: no cover
     context = args.__dict__
     if args.web_app:
+        # Panel is only imported for the web app as it takes a while to load
+        from doc_search.web import run_web
+
         run_web(context)
+    elif args.embedding_benchmark:
+        run_workflow(context, embedding_benchmark_workflow_steps(args.pipeline))
     elif args.train:
-        run_workflow(context, training_workflow_steps())
+        run_workflow(context, training_workflow_steps(args.pipeline))
     elif args.pre_process:
-        run_workflow(context, pre_process_workflow_steps())
+        run_workflow(context, pre_process_workflow_steps(args.pipeline))
+    elif args.questions_file:
+        run_workflow(context, batch_workflow_steps(args.library))
     else:
-        run_workflow(context, workflow_steps())
-        print("[bold]Question: " + context["input_question"] + "[/bold]")
-        print("[blue]Answer: " + context["output"] + "[/blue]")
+        if args.stream:
+            context["on_token"] = answer_printer(args.input_question)
+        if args.library:
+            run_workflow(context, library_inference_workflow_steps())
+        else:
+            run_workflow(context, workflow_steps(args.pipeline))
+        if args.stream:
+            print()
+        else:
+            print("[bold]Question: " + context["input_question"] + "[/bold]")
+            print("[blue]Answer: " + context["output"] + "[/blue]")
+        if context["sources"]:
+            print("[dim]Sources: " + ", ".join(context["sources"]) + "[/dim]")
 
 
 if __name__ == "__main__":  # pragma: no cover
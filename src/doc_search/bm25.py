@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Hashable, Iterable, Sequence, TypeVar
+
+import numpy as np
+
+from doc_search.store import write_atomically
+
+BM25_FILE = "bm25.json"
+BM25_POSTINGS_FILE = "bm25.postings.npy"
+BM25_FREQUENCIES_FILE = "bm25.frequencies.npy"
+BM25_LENGTHS_FILE = "bm25.lengths.npy"
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Rank constant of reciprocal rank fusion, which dampens the weight of the top ranks
+RRF_K = 60
+
+# Words, numbers and codes like AB-1234, E.101 or 12/34
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+K = TypeVar("K", bound=Hashable)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower cased words, and codes both as a whole and split into their parts
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = re.split(r"[-./]", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def bm25_exists(index_dir: Path) -> bool:
+    return (index_dir / BM25_FILE).exists()
+
+
+def save_bm25_index(index_dir: Path, texts: Iterable[str]) -> None:
+    """
+    Save an inverted index of the texts, identified by their position, with the postings of every term stored together
+    """
+    postings: dict[str, list[tuple[int, int]]] = {}
+    lengths = []
+    for position, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths.append(len(tokens))
+        for term, frequency in Counter(tokens).items():
+            postings.setdefault(term, []).append((position, frequency))
+
+    terms = {}
+    documents: list[int] = []
+    frequencies: list[int] = []
+    for term in sorted(postings):
+        terms[term] = [len(documents), len(documents) + len(postings[term])]
+        documents.extend(position for position, _ in postings[term])
+        frequencies.extend(frequency for _, frequency in postings[term])
+
+    def write_array(values: Sequence[int]) -> Callable[[Path], None]:
+        def write(path: Path) -> None:
+            with open(path, "wb") as f:
+                np.save(f, np.array(values, dtype=np.int32))
+
+        return write
+
+    write_atomically(index_dir / BM25_POSTINGS_FILE, write_array(documents))
+    write_atomically(index_dir / BM25_FREQUENCIES_FILE, write_array(frequencies))
+    write_atomically(index_dir / BM25_LENGTHS_FILE, write_array(lengths))
+    meta = {
+        "count": len(lengths),
+        "average_length": sum(lengths) / len(lengths) if lengths else 0,
+        "terms": terms,
+    }
+    write_atomically(index_dir / BM25_FILE, lambda path: path.write_text(json.dumps(meta)))
+
+
+class Bm25Index:
+    """
+    BM25 search over the inverted index saved by save_bm25_index.
+    Nothing is read until the first search, and the postings are memory mapped.
+    """
+
+    def __init__(self, index_dir: Path) -> None:
+        self.index_dir = index_dir
+        self.lock = threading.Lock()
+        self.terms: dict[str, list[int]] | None = None
+
+    def load(self) -> dict[str, list[int]]:
+        with self.lock:
+            if self.terms is None:
+                meta = json.loads((self.index_dir / BM25_FILE).read_text())
+                self.count = meta["count"]
+                self.average_length = meta["average_length"] or 1
+                self.postings = np.load(self.index_dir / BM25_POSTINGS_FILE, mmap_mode="r")
+                self.frequencies = np.load(self.index_dir / BM25_FREQUENCIES_FILE, mmap_mode="r")
+                self.lengths = np.load(self.index_dir / BM25_LENGTHS_FILE, mmap_mode="r")
+                self.terms = meta["terms"]
+            return self.terms
+
+    def search(self, query: str, k: int = 4) -> list[tuple[int, float]]:
+        """
+        Positions and scores of the k best matching texts
+        """
+        terms = self.load()
+        matched_positions = []
+        matched_scores = []
+        for term in set(tokenize(query)):
+            if term not in terms:
+                continue
+            start, end = terms[term]
+            positions = np.asarray(self.postings[start:end])
+            frequencies = np.asarray(self.frequencies[start:end], dtype=np.float32)
+            idf = math.log(1 + (self.count - len(positions) + 0.5) / (len(positions) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[positions] / self.average_length)
+            matched_positions.append(positions)
+            matched_scores.append(idf * frequencies * (BM25_K1 + 1) / (frequencies + norm))
+        if not matched_positions:
+            return []
+
+        positions, inverse = np.unique(np.concatenate(matched_positions), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(matched_scores))
+        top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+        best = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(positions[i]), float(scores[i])) for i in best]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[K]], k: int = RRF_K) -> list[K]:
+    """
+    Combine rankings by the sum of 1 / (k + rank) of every item over the rankings it appears in
+    """
+    scores: dict[K, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0) + 1 / (k + rank)
+    return sorted(scores, key=lambda item: scores[item], reverse=True)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from doc_search.instrumentation import count
+
+# Tokens per chunk, so that a chunk fits the context window of the embedding model
+CHUNK_TOKENS = {
+    "openai": 512,
+    "huggingface": 382,
+    "huggingface-hub": 382,
+    "cohere": 512,
+    "local": 382,
+}
+HUGGINGFACE_TOKENIZER = "sentence-transformers/all-mpnet-base-v2"
+
+# Character offsets of every token in the text
+TokenOffsets = Callable[[str], "list[tuple[int, int]]"]
+
+
+def word_offsets(text: str) -> list[tuple[int, int]]:
+    return [match.span() for match in re.finditer(r"\S+", text)]
+
+
+def tiktoken_offsets() -> TokenOffsets:
+    import tiktoken  # type: ignore
+
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    def offsets(text: str) -> list[tuple[int, int]]:
+        tokens = encoding.encode(text)
+        _, starts = encoding.decode_with_offsets(tokens)
+        return list(zip(starts, starts[1:] + [len(text)]))
+
+    return offsets
+
+
+def huggingface_offsets() -> TokenOffsets:
+    from transformers import AutoTokenizer  # type: ignore
+
+    tokenizer = AutoTokenizer.from_pretrained(HUGGINGFACE_TOKENIZER)
+
+    def offsets(text: str) -> list[tuple[int, int]]:
+        encoded = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [(start, end) for start, end in encoded["offset_mapping"]]
+
+    return offsets
+
+
+@lru_cache(maxsize=None)
+def tokenizer_for(embedding: str) -> TokenOffsets:
+    """
+    Tokenizer of the embedding model, or words when it is not available
+    """
+    try:
+        if embedding == "openai":
+            return tiktoken_offsets()
+        if embedding in ["huggingface", "huggingface-hub", "local"]:
+            return huggingface_offsets()
+    except (ImportError, OSError) as e:
+        logging.warning("Unable to load tokenizer for %s embedding, counting words instead: %s", embedding, repr(e))
+    return word_offsets
+
+
+def chunk_tokens(embedding: str, chunk_size: int | None = None) -> int:
+    if chunk_size:
+        return chunk_size
+    return CHUNK_TOKENS.get(embedding, 512)
+
+
+def read_pages(page_files: Iterable[Path], page_number: Callable[[Path], int]) -> Iterator[tuple[int, str]]:
+    for page_file in page_files:
+        yield page_number(page_file), page_file.read_text()
+
+
+def chunk_pages(
+    pages: Iterable[tuple[int, str]], token_offsets: TokenOffsets, size: int, overlap: int
+) -> Iterator[tuple[str, dict]]:
+    """
+    Split every page into chunks of at most size tokens, overlapping the previous chunk by overlap tokens.
+    Chunks never span pages, so each chunk can be traced back to its page.
+    """
+    step = max(size - overlap, 1)
+    for page, text in pages:
+        offsets = token_offsets(text)
+        for start in range(0, len(offsets), step):
+            end = min(start + size, len(offsets))
+            first_char, last_char = offsets[start][0], offsets[end - 1][1]
+            chunk = text[first_char:last_char].strip()
+            if chunk:
+                count("tokens", end - start)
+                yield chunk, {"page": page}
+            if end == len(offsets):
+                break
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import logging
+from typing import Callable, Sequence
+
+from langchain.docstore.document import Document
+from langchain.llms.base import BaseLLM
+from langchain.llms.huggingface_pipeline import HuggingFacePipeline
+from langchain.llms.openai import OpenAI
+
+from doc_search.instrumentation import count
+
+# Tokens of context sent to the LLM, leaving room for the prompt template, the question and the answer
+CONTEXT_TOKENS = {
+    "openai": 3000,
+    "huggingface": 8192,
+}
+# Chunks sharing more of their words than this are treated as the same text, like overlapping chunks
+DUPLICATE_SIMILARITY = 0.8
+
+
+def context_tokens(llm: str, budget: int | None = None) -> int:
+    if budget:
+        return budget
+    return CONTEXT_TOKENS.get(llm, 3000)
+
+
+def token_counter(llm: BaseLLM) -> Callable[[str], int]:
+    if isinstance(llm, HuggingFacePipeline):
+        tokenizer = llm.pipeline.tokenizer
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False, verbose=False))
+    if isinstance(llm, OpenAI):
+        import tiktoken
+
+        # Built once, as every candidate chunk of every question is counted
+        try:
+            encoding = tiktoken.encoding_for_model(llm.model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("gpt2")
+        return lambda text: len(encoding.encode(text))
+    return llm.get_num_tokens
+
+
+def similarity_from_distance(distance: float) -> float:
+    """
+    Cosine similarity from the squared L2 distance returned by FAISS, assuming normalised embeddings
+    """
+    return 1 - distance / 2
+
+
+def word_set(text: str) -> set[str]:
+    return set(text.lower().split())
+
+
+def is_near_duplicate(words: set[str], packed_words: Sequence[set[str]]) -> bool:
+    for other in packed_words:
+        shared = len(words & other) / max(min(len(words), len(other)), 1)
+        if shared >= DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+def pack_context(
+    candidates: Sequence[tuple[Document, float | None]],
+    count_tokens: Callable[[str], int],
+    budget: int,
+    min_similarity: float = 0,
+) -> list[Document]:
+    """
+    Most relevant chunks which fit in the token budget.
+    Candidates are taken in order of relevance, skipping the ones less similar than min_similarity,
+    near duplicates of chunks already packed and chunks too large for the remaining budget.
+    Candidates without a distance, which were only found by keyword search, are never skipped as dissimilar.
+    """
+    packed: list[Document] = []
+    packed_words: list[set[str]] = []
+    used_tokens = 0
+    for document, distance in candidates:
+        if min_similarity and distance is not None and similarity_from_distance(distance) < min_similarity:
+            continue
+        words = word_set(document.page_content)
+        if is_near_duplicate(words, packed_words):
+            continue
+        tokens = count_tokens(document.page_content)
+        if used_tokens + tokens > budget:
+            continue
+        packed.append(document)
+        packed_words.append(words)
+        used_tokens += tokens
+
+    count("context_tokens", used_tokens)
+    logging.info("Packed %s of %s chunks in %s of %s tokens", len(packed), len(candidates), used_tokens, budget)
+    return packed
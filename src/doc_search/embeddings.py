@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+# Number of chunks sent to the embedding backend at once
+EMBEDDING_BATCH_SIZES = {
+    "openai": 100,
+    "huggingface": 32,
+    "huggingface-hub": 32,
+    "cohere": 96,
+    "local": 64,
+}
+# Stay below the default limit of host parameters in a single SQLite statement
+SQLITE_MAX_VARIABLES = 900
+
+
+def embedding_batch_size(embedding: str, batch_size: int | None = None) -> int:
+    if batch_size:
+        return batch_size
+    return EMBEDDING_BATCH_SIZES.get(embedding, 1)
+
+
+class AdaptiveBatchSize:
+    """
+    Number of chunks sent per embedding request, halved every time the provider rate limits a request
+    and grown back by a quarter of the maximum for every request which succeeds
+    """
+
+    def __init__(self, maximum: int) -> None:
+        self.maximum = max(maximum, 1)
+        self.size = self.maximum
+
+    def succeeded(self) -> None:
+        self.size = min(self.maximum, self.size + max(self.maximum // 4, 1))
+
+    def rate_limited(self) -> None:
+        self.size = max(self.size // 2, 1)
+
+
+class OpenAIBatchEmbeddings(OpenAIEmbeddings):
+    """
+    OpenAI embeddings which send all the texts in a single request instead of one request per text
+    """
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # replace newlines, which can negatively affect performance.
+        response = self.client.create(
+            input=[text.replace("\n", " ") for text in texts], engine=self.document_model_name
+        )
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    for attribute in ["model_name", "document_model_name", "repo_id", "model"]:
+        model_name = getattr(embeddings, attribute, None)
+        if model_name:
+            return str(model_name)
+    return type(embeddings).__name__
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of chunk embeddings keyed by a namespace (embedding backend and model) and the chunk hash.
+    Least recently used embeddings are evicted once the cache grows over max_bytes.
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int) -> None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path.as_posix(), check_same_thread=False)
+        with self.db:
+            self.db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                    namespace TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, text_hash)
+                )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, namespace: str, texts: Sequence[str]) -> dict[str, list[float]]:
+        hashes = list({self.text_hash(text) for text in texts})
+        found: dict[str, list[float]] = {}
+        with self.lock, self.db:
+            for start in range(0, len(hashes), SQLITE_MAX_VARIABLES):
+                end = start + SQLITE_MAX_VARIABLES
+                chunk = hashes[start:end]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE namespace = ? AND text_hash IN ({placeholders})",  # nosec
+                    [namespace, *chunk],
+                ).fetchall()
+                found.update(
+                    {text_hash: np.frombuffer(vector, dtype=np.float32).tolist() for text_hash, vector in rows}
+                )
+            self.db.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE namespace = ? AND text_hash = ?",
+                [(time.time(), namespace, text_hash) for text_hash in found],
+            )
+        return found
+
+    def put_many(self, namespace: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO embeddings (namespace, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [
+                    (namespace, self.text_hash(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for text, vector in zip(texts, vectors)
+                ],
+            )
+            self.evict()
+
+    def evict(self) -> None:
+        (total_bytes,) = self.db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        excess_bytes = total_bytes - self.max_bytes
+        evicted = []
+        for rowid, size in self.db.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_access"):
+            if excess_bytes <= 0:
+                break
+            evicted.append((rowid,))
+            excess_bytes -= size
+        self.db.executemany("DELETE FROM embeddings WHERE rowid = ?", evicted)
+        logging.info("Evicted %s embeddings from cache", len(evicted))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Only embed documents which are not already in the embedding cache
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, embedding: str) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = f"{embedding}:{embedding_model_name(embeddings)}"
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        cached = self.cache.get_many(self.namespace, texts)
+        missing = list(dict.fromkeys(text for text in texts if EmbeddingCache.text_hash(text) not in cached))
+        if missing:
+            vectors = self.embeddings.embed_documents(missing)
+            self.cache.put_many(self.namespace, missing, vectors)
+            cached.update({EmbeddingCache.text_hash(text): list(vector) for text, vector in zip(missing, vectors)})
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return [cached[EmbeddingCache.text_hash(text)] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import math
+import time
+from typing import Any
+
+import faiss  # type: ignore
+import numpy as np
+from rich import print
+from rich.table import Table
+
+INDEX_TYPES = ["flat", "ivf-flat", "ivf-pq", "hnsw"]
+VECTOR_STORAGE = ["float32", "float16", "int8"]
+SCALAR_QUANTIZERS = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+NPROBE_CHOICES = [1, 2, 4, 8, 16, 32, 64, 128]
+EF_SEARCH_CHOICES = [16, 32, 64, 128, 256, 512]
+
+
+def default_nlist(count: int) -> int:
+    return max(1, min(count, int(4 * math.sqrt(count))))
+
+
+def default_pq_m(dimension: int) -> int:
+    """
+    Largest number of sub-quantizers, which divides the dimension, with at least 4 dimensions per sub-quantizer
+    """
+    return max(m for m in range(1, dimension // 4 + 1) if dimension % m == 0) if dimension >= 4 else 1
+
+
+def index_description(index_type: str, storage: str = "float32", pca_dims: int = 0) -> str:
+    description = index_type if index_type == "ivf-pq" else f"{index_type} {storage}"
+    return f"{description} PCA {pca_dims}" if pca_dims else description
+
+
+def build_index(
+    index_type: str,
+    vectors: np.ndarray,
+    nlist: int = 0,
+    pq_m: int = 0,
+    hnsw_m: int = 32,
+    storage: str = "float32",
+    pca_dims: int = 0,
+) -> Any:
+    """
+    Build a FAISS index of the given type from the vectors, training it first if the index type needs it.
+    Vectors are stored as float16 or int8 instead of float32 (except by ivf-pq, which has its own compression),
+    after reducing them to pca_dims dimensions with PCA fitted on the vectors.
+    """
+    count, dimension = vectors.shape
+    pca = None
+    if 0 < pca_dims < dimension:
+        pca = faiss.PCAMatrix(dimension, pca_dims)
+        dimension = pca_dims
+    quantizer_type = SCALAR_QUANTIZERS.get(storage)
+
+    index: Any
+    if index_type == "hnsw":
+        if quantizer_type is None:
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        else:
+            # The generated signature names the quantizer class, but FAISS takes the quantizer type
+            index = faiss.IndexHNSWSQ(dimension, quantizer_type, hnsw_m)  # type: ignore[arg-type]
+    elif index_type in ["ivf-flat", "ivf-pq"]:
+        nlist = min(nlist or default_nlist(count), count)
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf-pq":
+            # 8 bits per code needs at least 256 training vectors
+            nbits = max(1, min(8, int(math.log2(count))))
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m or default_pq_m(dimension), nbits)
+        elif quantizer_type is None:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, quantizer_type)
+    elif quantizer_type is None:
+        index = faiss.IndexFlatL2(dimension)
+    else:
+        index = faiss.IndexScalarQuantizer(dimension, quantizer_type)
+
+    if pca is not None:
+        # Queries are reduced by the same PCA before searching the index
+        index = faiss.IndexPreTransform(pca, index)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def base_index(index: Any) -> Any:
+    """
+    Index searched after reducing the dimensions of the vectors, or the index itself without PCA
+    """
+    if isinstance(index, faiss.IndexPreTransform):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def index_bytes(index: Any) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def tune_index(index: Any, nprobe: int, ef_search: int) -> None:
+    """
+    Set the query time parameters trading recall for latency
+    """
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.nprobe = nprobe
+    if hasattr(base_index(index), "hnsw"):
+        base_index(index).hnsw.efSearch = ef_search
+
+
+def index_vectors(index: Any) -> np.ndarray:
+    return np.asarray(index.reconstruct_n(0, index.ntotal), dtype=np.float32)
+
+
+def recall_report(index: Any, vectors: np.ndarray, k: int = 10, queries: int = 200) -> list[dict]:
+    """
+    Measure recall@k and query latency of the index against exact search over the same vectors,
+    for every query time setting applicable to the index, along with its size per vector
+    """
+    k = min(k, len(vectors))
+    rng = np.random.default_rng(42)
+    query_vectors = vectors[rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)]
+    exact_index = faiss.IndexFlatL2(vectors.shape[1])
+    exact_index.add(vectors)
+    _, expected = exact_index.search(query_vectors, k)
+
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        settings = [{"nprobe": nprobe} for nprobe in NPROBE_CHOICES if nprobe <= ivf_index.nlist]
+    elif hasattr(base_index(index), "hnsw"):
+        settings = [{"ef_search": ef_search} for ef_search in EF_SEARCH_CHOICES]
+    else:
+        settings = [{}]
+
+    bytes_per_vector = index_bytes(index) / len(vectors)
+    report = []
+    for setting in settings:
+        tune_index(index, setting.get("nprobe", 1), setting.get("ef_search", 16))
+        started = time.perf_counter()
+        _, found = index.search(query_vectors, k)
+        elapsed = time.perf_counter() - started
+        recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found, expected)])
+        latency_ms = elapsed * 1000 / len(query_vectors)
+        report.append(
+            {**setting, "recall": float(recall), "latency_ms": latency_ms, "k": k, "bytes_per_vector": bytes_per_vector}
+        )
+    return report
+
+
+def print_recall_report(index_type: str, report: list[dict]) -> None:
+    table = Table(title=f"Recall vs latency of {index_type} index against exact float32 search")
+    table.add_column("Setting")
+    table.add_column(f"Recall@{report[0]['k']}", justify="right")
+    table.add_column("Latency per query (ms)", justify="right")
+    table.add_column("Bytes per vector", justify="right")
+    for row in report:
+        setting = ", ".join(f"{key}={row[key]}" for key in ["nprobe", "ef_search"] if key in row) or "all vectors"
+        table.add_row(setting, f"{row['recall']:.3f}", f"{row['latency_ms']:.3f}", f"{row['bytes_per_vector']:.0f}")
+    print(table)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from rich import print
+
+from doc_search import shared_pool
+from doc_search.instrumentation import run_workflow
+from doc_search.store import write_atomically
+from doc_search.workflow import (
+    ingest_state_path,
+    output_directory_for_pdf,
+    slugify_pdf_name,
+    training_workflow_steps,
+)
+
+# Files changed more recently than this may still be copied into the watched folder
+SETTLE_SECONDS = 10
+
+
+def content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_pdfs(source: str) -> list[Path]:
+    """
+    PDFs in a directory and its sub directories, or the PDFs matching a glob pattern
+    """
+    source_path = Path(source).expanduser()
+    if source_path.is_dir():
+        paths = [path for path in source_path.rglob("*") if path.suffix.lower() == ".pdf"]
+    else:
+        paths = [Path(path) for path in glob.glob(str(source_path), recursive=True)]
+    return sorted(path for path in paths if path.is_file())
+
+
+class IngestJobs:
+    """
+    Persistent state of the documents to ingest, keyed by the hash of their content,
+    so renamed copies are not processed again and a crashed run resumes with the documents it didn't finish.
+    The hash of every file is remembered with its size and modification time to avoid reading it on every scan.
+    """
+
+    def __init__(self, state_path: Path) -> None:
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.jobs: dict[str, dict] = {}
+        self.files: dict[str, list] = {}
+        if state_path.exists():
+            state = json.loads(state_path.read_text())
+            self.jobs = state["jobs"]
+            self.files = state["files"]
+        for job in self.jobs.values():
+            if job["status"] in ["running", "failed"]:
+                # Interrupted or failed in a previous run, pages which were already processed are skipped
+                job["status"] = "pending"
+
+    def file_hash(self, path: Path) -> str:
+        stat = path.stat()
+        known = self.files.get(str(path))
+        if known and known[:2] == [stat.st_size, stat.st_mtime]:
+            return str(known[2])
+        digest = content_hash(path)
+        self.files[str(path)] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def add(self, path: Path) -> bool:
+        """
+        Queue the document unless a document with the same content was already queued
+        """
+        digest = self.file_hash(path)
+        with self.lock:
+            job = self.jobs.get(digest)
+            if job is not None:
+                if job["path"] != str(path) and str(path) not in job["duplicates"]:
+                    logging.info("Skipping %s as it has the same content as %s", path, job["path"])
+                    job["duplicates"].append(str(path))
+                return False
+            self.jobs[digest] = {"path": str(path), "status": "pending", "duplicates": [], "error": None}
+        return True
+
+    def pending(self) -> list[str]:
+        with self.lock:
+            return [digest for digest, job in self.jobs.items() if job["status"] == "pending"]
+
+    def update(self, digest: str, status: str, error: str | None = None) -> None:
+        with self.lock:
+            self.jobs[digest].update(status=status, error=error, updated=time.time())
+        self.save()
+
+    def save(self) -> None:
+        # Documents finishing at the same time would otherwise write the same temporary file
+        with self.lock:
+            state = json.dumps({"jobs": self.jobs, "files": self.files}, indent=2)
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            write_atomically(self.state_path, lambda path: path.write_text(state))
+
+
+def settled(path: Path) -> bool:
+    return time.time() - path.stat().st_mtime >= SETTLE_SECONDS
+
+
+def document_copy(app_dir: Path, path: Path, digest: str) -> Path:
+    """
+    Copy of the PDF in an output directory named after the PDF and its content, so that PDFs with the same name
+    in different folders, or a PDF replaced by a new version, don't share their pages and index
+    """
+    name = f"{slugify_pdf_name(path)}-{digest[:12]}"
+    copy = output_directory_for_pdf(app_dir, Path(f"{name}.pdf")) / f"{name}.pdf"
+    if not copy.exists():
+        copy.parent.mkdir(parents=True, exist_ok=True)
+        write_atomically(copy, lambda temp_path: shutil.copyfile(path, temp_path))
+    return copy
+
+
+def ingest_document(context: dict, jobs: IngestJobs, digest: str) -> None:
+    path = Path(jobs.jobs[digest]["path"])
+    jobs.update(digest, "running")
+    try:
+        input_pdf_path = document_copy(context["app_dir"], path, digest)
+        run_workflow({**context, "input_pdf_path": input_pdf_path}, training_workflow_steps(context["pipeline"]))
+    except Exception as e:
+        logging.exception("🚨 Failed to ingest %s", path)
+        jobs.update(digest, "failed", str(e))
+        raise
+    jobs.update(digest, "done")
+
+
+def ingest_documents(context: dict, jobs: IngestJobs, pdf_paths: list[Path]) -> dict[str, int]:
+    """
+    Queue the new documents and ingest all pending ones, ingest_concurrency documents at a time
+    """
+    added = sum(jobs.add(path) for path in pdf_paths)
+    jobs.save()
+    pending = jobs.pending()
+    summary = {"found": len(pdf_paths), "added": added, "done": 0, "failed": 0}
+    if not pending:
+        return summary
+
+    print(f"[bold]Ingesting[/bold] {len(pending)} documents, {context['ingest_concurrency']} at a time")
+    with ThreadPoolExecutor(max_workers=max(context["ingest_concurrency"], 1)) as executor:
+        futures = {executor.submit(ingest_document, context, jobs, digest): digest for digest in pending}
+        for future in as_completed(futures):
+            path = jobs.jobs[futures[future]]["path"]
+            if future.exception() is None:
+                summary["done"] += 1
+                print(f"[bold]Ingested[/bold] {path} ({summary['done'] + summary['failed']}/{len(pending)})")
+            else:
+                summary["failed"] += 1
+                print(f"[red]Failed to ingest {path}: {future.exception()}[/red]")
+    return summary
+
+
+def run_ingest(context: dict) -> None:
+    """
+    Ingest every PDF of the source once, or keep checking the source for new PDFs when watching it.
+    Pages of all documents are converted, scanned and embedded on one pool of workers.
+    """
+    jobs = IngestJobs(ingest_state_path(context["app_dir"]))
+    shared_pool.limit(context["workers"])
+    try:
+        while True:
+            pdf_paths = find_pdfs(context["ingest"])
+            if context["watch"]:
+                pdf_paths = [path for path in pdf_paths if settled(path)]
+            summary = ingest_documents(context, jobs, pdf_paths)
+            if summary["done"] or summary["failed"] or not context["watch"]:
+                print(
+                    f"[bold]Ingest[/bold] found {summary['found']} PDFs, {summary['added']} new, "
+                    f"{summary['done']} ingested, {summary['failed']} failed"
+                )
+            if not context["watch"]:
+                return
+            time.sleep(context["watch_interval"])
+    finally:
+        shared_pool.limit(None)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+from py_executable_checklist import workflow as checklist
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows, where only times are measured
+    resource = None  # type: ignore
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+T = TypeVar("T")
+
+# Innermost step running in the current thread or asyncio task
+current_step: contextvars.ContextVar[dict | None] = contextvars.ContextVar("current_step", default=None)
+
+
+def resource_usage() -> dict:
+    usage = {
+        "wall": time.perf_counter(),
+        "cpu": time.process_time(),
+        "children_cpu": 0.0,
+        "peak_rss": 0,
+        "children_peak_rss": 0,
+    }
+    if resource is not None:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage["children_cpu"] = children.ru_utime + children.ru_stime
+        usage["peak_rss"] = own.ru_maxrss * RSS_UNIT
+        usage["children_peak_rss"] = children.ru_maxrss * RSS_UNIT
+    return usage
+
+
+class Instrumentation:
+    """
+    Timing and resource usage of every workflow step, with the items processed, external commands run
+    and time spent backing off from retries while the step was running.
+    Counts go to the innermost step running in the same thread, or in the thread which handed the work over
+    with in_current_step, so steps running at the same time in other threads don't get them.
+    The OS only tracks the peak memory of the whole process, so process_peak_rss_bytes is the peak since
+    the process started, and children_peak_rss_bytes the peak of the largest child process so far.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.steps: list[dict] = []
+        self.totals: dict[str, dict] = {}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.steps = []
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[dict]:
+        record: dict[str, Any] = {"step": name, "counts": {}, "commands": {}}
+        started = resource_usage()
+        token = current_step.set(record)
+        try:
+            yield record
+        finally:
+            current_step.reset(token)
+            finished = resource_usage()
+            record.update(
+                wall_seconds=finished["wall"] - started["wall"],
+                cpu_seconds=finished["cpu"] - started["cpu"],
+                children_cpu_seconds=finished["children_cpu"] - started["children_cpu"],
+                process_peak_rss_bytes=finished["peak_rss"],
+                children_peak_rss_bytes=finished["children_peak_rss"],
+            )
+            with self.lock:
+                self.steps.append(record)
+                self.add_to_totals(record)
+            logging.info("⏱️ %s took %.2f seconds", name, record["wall_seconds"])
+
+    def add_to_totals(self, record: dict) -> None:
+        totals = self.totals.setdefault(record["step"], {"runs": 0, "wall_seconds": 0.0, "counts": {}, "commands": {}})
+        totals["runs"] += 1
+        totals["wall_seconds"] += record["wall_seconds"]
+        for name, value in record["counts"].items():
+            totals["counts"][name] = totals["counts"].get(name, 0) + value
+        for name, command in record["commands"].items():
+            command_totals = totals["commands"].setdefault(name, {"runs": 0, "seconds": 0.0})
+            command_totals["runs"] += command["runs"]
+            command_totals["seconds"] += command["seconds"]
+
+    def count(self, name: str, value: float = 1) -> None:
+        record = current_step.get()
+        if record is None:
+            return
+        with self.lock:
+            record["counts"][name] = record["counts"].get(name, 0) + value
+
+    @contextmanager
+    def command(self, command: str) -> Iterator[None]:
+        name = Path(command.split()[0]).name if command.split() else command
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            record = current_step.get()
+            if record is not None:
+                with self.lock:
+                    totals = record["commands"].setdefault(name, {"runs": 0, "seconds": 0.0})
+                    totals["runs"] += 1
+                    totals["seconds"] += elapsed
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"pid": os.getpid(), "steps": list(self.steps)}
+
+    def write_report(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.report(), indent=2))
+        logging.info("Saved metrics of %s steps to %s", len(self.steps), path)
+
+    def prometheus_metrics(self) -> str:
+        """
+        Totals of all steps since the process started in the Prometheus text format
+        """
+        lines = [
+            "# TYPE dr_doc_search_step_runs_total counter",
+            "# TYPE dr_doc_search_step_seconds_total counter",
+            "# TYPE dr_doc_search_step_items_total counter",
+            "# TYPE dr_doc_search_command_runs_total counter",
+            "# TYPE dr_doc_search_command_seconds_total counter",
+        ]
+        with self.lock:
+            for step, totals in sorted(self.totals.items()):
+                lines.append(f'dr_doc_search_step_runs_total{{step="{step}"}} {totals["runs"]}')
+                lines.append(f'dr_doc_search_step_seconds_total{{step="{step}"}} {totals["wall_seconds"]}')
+                for item, value in sorted(totals["counts"].items()):
+                    lines.append(f'dr_doc_search_step_items_total{{step="{step}",item="{item}"}} {value}')
+                for command, command_totals in sorted(totals["commands"].items()):
+                    labels = f'step="{step}",command="{command}"'
+                    lines.append(f"dr_doc_search_command_runs_total{{{labels}}} {command_totals['runs']}")
+                    lines.append(f"dr_doc_search_command_seconds_total{{{labels}}} {command_totals['seconds']}")
+        return "\n".join(lines) + "\n"
+
+
+instrumentation = Instrumentation()
+
+
+def count(name: str, value: float = 1) -> None:
+    instrumentation.count(name, value)
+
+
+def timed_command(command: str) -> Any:
+    return instrumentation.command(command)
+
+
+def in_current_step(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Run func in the step of the calling thread, so the counts of work handed to worker threads go to that step
+    """
+    record = current_step.get()
+
+    def run(*args: Any, **kwargs: Any) -> T:
+        token = current_step.set(record)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            current_step.reset(token)
+
+    return run
+
+
+def run_workflow(context: dict, workflow_process: list) -> None:
+    """
+    Same as run_workflow of py_executable_checklist, measuring every step
+    """
+    for step in workflow_process:
+        with instrumentation.step(step.__name__):
+            checklist.run_workflow(context, [step])
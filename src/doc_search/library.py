@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import json
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+from langchain.vectorstores.faiss import FAISS
+
+from doc_search.bm25 import Bm25Index, bm25_exists
+from doc_search.faiss_index import tune_index
+from doc_search.store import STORE_FILE, MmapDocstore, load_store
+
+
+def library_index_paths(app_dir: Path) -> list[Path]:
+    """
+    Index of every PDF in the library which was created in the current store format
+    """
+    output_dir = app_dir / "OutputDir/dr-doc-search"
+    return sorted(store_file.parent / "docsearch.index" for store_file in output_dir.glob(f"*/index/{STORE_FILE}"))
+
+
+class LibrarySearch(VectorStore):
+    """
+    Search the indexes of all PDFs in the library at once.
+    The question is embedded once and searched in every index, loading at most max_loaded indexes at a time,
+    and the closest chunks across the library are returned with the PDF they came from.
+    """
+
+    def __init__(
+        self,
+        index_paths: Iterable[Path],
+        embeddings: Embeddings,
+        embedding: str,
+        max_loaded: int = 16,
+        nprobe: int = 8,
+        ef_search: int = 64,
+    ) -> None:
+        self.embeddings = embeddings
+        self.embedding_function = embeddings.embed_query
+        self.max_loaded = max(max_loaded, 1)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.loaded: OrderedDict[Path, FAISS] = OrderedDict()
+        self.lexical_indexes: dict[Path, Bm25Index] = {}
+        self.index_paths = []
+        for index_path in index_paths:
+            store = json.loads((index_path.parent / STORE_FILE).read_text())
+            if store["embedding"] == embedding:
+                self.index_paths.append(index_path)
+            else:
+                logging.warning("Skipping %s as it was indexed with %s embedding", index_path, store["embedding"])
+
+    @staticmethod
+    def source_from(index_path: Path) -> str:
+        return index_path.parent.parent.name
+
+    def shard(self, index_path: Path) -> FAISS:
+        if index_path in self.loaded:
+            self.loaded.move_to_end(index_path)
+            return self.loaded[index_path]
+
+        docsearch = load_store(index_path, self.embeddings)
+        tune_index(docsearch.index, self.nprobe, self.ef_search)
+        self.loaded[index_path] = docsearch
+        if len(self.loaded) > self.max_loaded:
+            self.loaded.popitem(last=False)
+        return docsearch
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[tuple[Document, float]]:
+        query_vectors = np.array([self.embeddings.embed_query(query)], dtype=np.float32)
+        return self.similarity_search_by_vectors(query_vectors, k)[0]
+
+    def search_order(self) -> list[tuple[int, Path]]:
+        """
+        Every index with its number, starting with the indexes which are already loaded,
+        so a search only loads the indexes which are not loaded and never evicts an index before searching it
+        """
+        numbers = {index_path: number for number, index_path in enumerate(self.index_paths)}
+        not_loaded = [index_path for index_path in self.index_paths if index_path not in self.loaded]
+        return [(numbers[index_path], index_path) for index_path in [*self.loaded, *not_loaded]]
+
+    def similarity_search_by_vectors(self, query_vectors: np.ndarray, k: int = 4) -> list[list[tuple[Document, float]]]:
+        """
+        Closest chunks across the library for every query, searching each index once for all the queries.
+        The closest chunks so far are read while their index is loaded, so no index is loaded again to read them.
+        """
+        closest: list[dict[tuple[float, int, int], Document]] = [{} for _ in query_vectors]
+        for number, index_path in self.search_order():
+            distances, positions = self.shard(index_path).index.search(query_vectors, k)
+            for query, (query_distances, query_positions) in enumerate(zip(distances, positions)):
+                candidates = [
+                    (float(distance), number, int(position))
+                    for distance, position in zip(query_distances, query_positions)
+                    if position != -1
+                ]
+                closest[query] = {
+                    candidate: (
+                        closest[query][candidate]
+                        if candidate in closest[query]
+                        else self.document(index_path, candidate[2])
+                    )
+                    for candidate in sorted([*closest[query], *candidates])[:k]
+                }
+        return [
+            [(document, distance) for (distance, _, _), document in query_closest.items()] for query_closest in closest
+        ]
+
+    def lexical_search(self, query: str, k: int = 4) -> list[tuple[Document, float]]:
+        """
+        Best BM25 matches across the library, skipping indexes created without an inverted index
+        """
+        matches: list[tuple[float, Path, int]] = []
+        for index_path in self.index_paths:
+            if not bm25_exists(index_path.parent):
+                continue
+            lexical_index = self.lexical_indexes.setdefault(index_path, Bm25Index(index_path.parent))
+            matches.extend((score, index_path, position) for position, score in lexical_index.search(query, k))
+        best = sorted(matches, key=lambda match: match[0], reverse=True)[:k]
+        return [(self.document(index_path, position), score) for score, index_path, position in best]
+
+    def document(self, index_path: Path, position: int) -> Document:
+        # Documents of indexes which are not loaded are read from their docstore without loading the index
+        docstore = self.loaded[index_path].docstore if index_path in self.loaded else MmapDocstore(index_path.parent)
+        document = docstore.search(str(position))
+        if not isinstance(document, Document):
+            raise ValueError(f"Could not find document {position} in {index_path}, got {document}")
+        metadata = {**document.metadata, "source": self.source_from(index_path)}
+        return Document(page_content=document.page_content, metadata=metadata)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None) -> List[str]:
+        raise NotImplementedError("Documents are added to the library by indexing a PDF")
+
+    @classmethod
+    def from_texts(
+        cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any
+    ) -> LibrarySearch:
+        raise NotImplementedError("Documents are added to the library by indexing a PDF")
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import time
+from typing import Any, List
+
+import faiss  # type: ignore
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from rich import print
+from rich.table import Table
+
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence transformer embeddings tuned for CPU inference.
+    Texts are embedded in batches of similar length, so short chunks are not padded to the longest chunk,
+    and the linear layers can be quantized to int8 for faster inference with slightly different vectors.
+    """
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_EMBEDDING_MODEL,
+        batch_size: int | None = None,
+        threads: int = 0,
+        quantize: bool = False,
+    ) -> None:
+        import torch
+        from sentence_transformers import SentenceTransformer  # type: ignore
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.model: Any = SentenceTransformer(model_name, device="cpu")
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        # Quantized vectors differ from the original ones, so they are cached separately
+        self.model_name = f"{model_name}:int8" if quantize else model_name
+        self.batch_size = batch_size or LOCAL_EMBEDDING_BATCH_SIZE
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors: list[list[float]] = [[] for _ in texts]
+        for start in range(0, len(order), self.batch_size):
+            end = start + self.batch_size
+            bucket = order[start:end]
+            encoded = self.model.encode(
+                [texts[i] for i in bucket], batch_size=len(bucket), show_progress_bar=False, convert_to_numpy=True
+            )
+            for i, vector in zip(bucket, encoded):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def retrieval_agreement(expected: np.ndarray, actual: np.ndarray, k: int = 10, queries: int = 100) -> float:
+    """
+    Share of the top k neighbours found with the actual vectors which are also found with the expected vectors
+    """
+    k = min(k, len(expected))
+    found = []
+    for vectors in [expected, actual]:
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        _, neighbours = index.search(vectors[:queries], k)
+        found.append(neighbours)
+    return float(np.mean([len(set(a) & set(e)) / k for e, a in zip(found[0], found[1])]))
+
+
+def benchmark_local_embeddings(
+    texts: list[str], model_name: str = LOCAL_EMBEDDING_MODEL, batch_size: int | None = None, threads: int = 0
+) -> list[dict]:
+    """
+    Throughput of the local embedding with and without quantization,
+    and how well retrieval with the quantized vectors agrees with the original ones
+    """
+    report = []
+    baseline = np.empty((0, 0), dtype=np.float32)
+    for quantize in [False, True]:
+        embeddings = LocalEmbeddings(model_name, batch_size, threads, quantize)
+        started = time.perf_counter()
+        vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+        elapsed = time.perf_counter() - started
+        if not quantize:
+            baseline = vectors
+        report.append(
+            {
+                "model": embeddings.model_name,
+                "chunks_per_second": len(texts) / elapsed if elapsed else 0.0,
+                "agreement": retrieval_agreement(baseline, vectors),
+            }
+        )
+    return report
+
+
+def print_embedding_benchmark(report: list[dict]) -> None:
+    table = Table(title="Local embedding throughput and retrieval agreement with the unquantized model")
+    table.add_column("Model")
+    table.add_column("Chunks per second", justify="right")
+    table.add_column("Top 10 agreement", justify="right")
+    for row in report:
+        table.add_row(row["model"], f"{row['chunks_per_second']:.1f}", f"{row['agreement']:.3f}")
+    print(table)
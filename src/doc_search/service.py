@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import logging
+import threading
+from pathlib import Path
+from typing import Callable
+
+from doc_search.instrumentation import run_workflow
+from doc_search.library import library_index_paths
+from doc_search.store import STORE_FILE
+from doc_search.workflow import (
+    AskQuestion,
+    LoadIndex,
+    LoadLibraryIndex,
+    LoadLLM,
+)
+
+
+class InferenceService:
+    """
+    Keep the index, embedding and LLM loaded between questions.
+    The index is reloaded only when its files change on disk, so answering a question costs retrieval plus generation.
+    """
+
+    def __init__(self, context: dict) -> None:
+        self.context = dict(context)
+        self.lock = threading.Lock()
+        self.index_version: list[tuple[str, int]] = []
+        self.reload_index()
+        run_workflow(self.context, [LoadLLM])
+
+    def index_files(self) -> list[Path]:
+        if self.context.get("library"):
+            return [index_path.parent / STORE_FILE for index_path in library_index_paths(self.context["app_dir"])]
+        index_path: Path = self.context["index_path"]
+        return [index_path.parent / STORE_FILE, self.context["faiss_db"]]
+
+    def current_index_version(self) -> list[tuple[str, int]]:
+        return [(path.as_posix(), path.stat().st_mtime_ns) for path in self.index_files() if path.exists()]
+
+    def reload_index(self) -> None:
+        with self.lock:
+            self.index_version = self.current_index_version()
+            run_workflow(self.context, [LoadLibraryIndex if self.context.get("library") else LoadIndex])
+
+    def reload_index_if_changed(self) -> None:
+        if self.current_index_version() != self.index_version:
+            logging.info("🔄 Index changed on disk, reloading")
+            self.reload_index()
+
+    def ask(self, question: str, on_token: Callable[[str], None] | None = None) -> dict:
+        self.reload_index_if_changed()
+        context = {**self.context, "input_question": question, "on_token": on_token}
+        run_workflow(context, [AskQuestion])
+        return context
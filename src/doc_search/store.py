@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Iterator, Mapping, Sequence
+
+import faiss  # type: ignore
+import numpy as np
+from langchain.docstore.base import AddableMixin, Docstore
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.faiss import FAISS
+
+STORE_FORMAT = 1
+STORE_FILE = "store.json"
+DOCSTORE_DATA_FILE = "docstore.data"
+DOCSTORE_OFFSETS_FILE = "docstore.offsets.npy"
+CHECKPOINT_FILE = "checkpoint.json"
+# IO_FLAG_MMAP_IFC maps the vectors of every index type, FAISS before 1.11 can only map IVF inverted lists
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
+
+def write_atomically(path: Path, write: Callable[[Path], Any]) -> None:
+    """
+    Write to a temporary file next to path and rename it, so readers never see a half written file
+    """
+    temp_path = path.with_name(f"{path.name}.tmp")
+    write(temp_path)
+    os.replace(temp_path, path)
+
+
+class IndexPositions(Mapping[int, str]):
+    """
+    Map FAISS index positions to docstore ids without building a dictionary with an entry per chunk
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+
+    def __getitem__(self, position: int) -> str:
+        if not 0 <= position < self.size:
+            raise KeyError(position)
+        return str(position)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.size))
+
+
+class MmapDocstore(Docstore):
+    """
+    Read only docstore backed by memory mapped files.
+    Documents are stored as JSON records in a single data file and looked up by their position in an offsets table.
+    """
+
+    def __init__(self, index_dir: Path) -> None:
+        self.offsets = np.load(index_dir / DOCSTORE_OFFSETS_FILE, mmap_mode="r")
+        self.data: mmap.mmap | bytes = b""
+        if (index_dir / DOCSTORE_DATA_FILE).stat().st_size > 0:
+            with open(index_dir / DOCSTORE_DATA_FILE, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def record(self, position: int) -> dict:
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return dict(json.loads(self.data[start:end]))
+
+    def records(self) -> Iterator[dict]:
+        for position in range(len(self)):
+            yield self.record(position)
+
+    def search(self, search: str) -> str | Document:
+        if not search.isdigit() or int(search) >= len(self):
+            return f"ID {search} not found."
+        record = self.record(int(search))
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+
+def index_version(paths: Sequence[Path]) -> str:
+    """
+    Changes whenever one of the index files is saved again
+    """
+    stats = [(path.as_posix(), path.stat().st_mtime_ns, path.stat().st_size) for path in paths]
+    return hashlib.sha256(json.dumps(stats).encode("utf-8")).hexdigest()
+
+
+def store_exists(index_path: Path) -> bool:
+    return (index_path.parent / STORE_FILE).exists()
+
+
+def save_store(docsearch: FAISS, index_path: Path, embedding: str) -> None:
+    """
+    Save the FAISS index and a memory mappable docstore next to it.
+    The store file is written last, so an interrupted save leaves the previous store readable.
+    """
+    index_dir = index_path.parent
+    offsets = [0]
+
+    def write_documents(path: Path) -> None:
+        with open(path, "wb") as f:
+            for position in range(docsearch.index.ntotal):
+                _id = docsearch.index_to_docstore_id[position]
+                document = docsearch.docstore.search(_id)
+                if not isinstance(document, Document):
+                    raise ValueError(f"Could not find document for id {_id}, got {document}")
+                record = {"id": _id, "page_content": document.page_content, "metadata": document.metadata}
+                offsets.append(offsets[-1] + f.write(json.dumps(record).encode("utf-8")))
+
+    def write_offsets(path: Path) -> None:
+        with open(path, "wb") as f:
+            np.save(f, np.array(offsets, dtype=np.int64))
+
+    write_atomically(index_dir / DOCSTORE_DATA_FILE, write_documents)
+    write_atomically(index_dir / DOCSTORE_OFFSETS_FILE, write_offsets)
+    write_atomically(index_path, lambda path: faiss.write_index(docsearch.index, path.as_posix()))
+    store = {"format": STORE_FORMAT, "embedding": embedding, "count": docsearch.index.ntotal}
+    write_atomically(index_dir / STORE_FILE, lambda path: path.write_text(json.dumps(store)))
+
+
+def load_store(index_path: Path, embeddings: Embeddings, memory_map: bool = True) -> FAISS:
+    """
+    Load the store saved by save_store.
+    With memory_map the index and documents are paged in from disk on demand and shared between processes,
+    otherwise they are read into memory so that more documents can be added.
+    """
+    docstore = MmapDocstore(index_path.parent)
+    if memory_map:
+        index = faiss.read_index(index_path.as_posix(), MMAP_FLAGS)
+        # Documents are saved in index order, so their position is their id
+        return FAISS(embeddings.embed_query, index, docstore, IndexPositions(len(docstore)))  # type: ignore
+
+    index = faiss.read_index(index_path.as_posix())
+    ids = []
+    documents = {}
+    for record in docstore.records():
+        ids.append(record["id"])
+        documents[record["id"]] = Document(page_content=record["page_content"], metadata=record["metadata"])
+    return FAISS(embeddings.embed_query, index, InMemoryDocstore(documents), dict(enumerate(ids)))
+
+
+def search_by_vectors(docsearch: FAISS, query_vectors: np.ndarray, k: int = 4) -> list[list[tuple[Document, float]]]:
+    """
+    Closest documents and their distances for every query vector with a single index search
+    """
+    distances, positions = docsearch.index.search(np.asarray(query_vectors, dtype=np.float32), k)
+    results = []
+    for query_distances, query_positions in zip(distances, positions):
+        documents = [
+            (docsearch.docstore.search(docsearch.index_to_docstore_id[position]), float(distance))
+            for distance, position in zip(query_distances, query_positions)
+            if position != -1
+        ]
+        results.append([(document, distance) for document, distance in documents if isinstance(document, Document)])
+    return results
+
+
+def load_pickled_store(index_path: Path, faiss_db: Path) -> FAISS:
+    index = faiss.read_index(index_path.as_posix())
+    with open(faiss_db, "rb") as f:
+        docsearch: FAISS = pickle.load(f)  # nosec
+
+    docsearch.index = index
+    return docsearch
+
+
+def empty_faiss_store(embeddings: Embeddings, dimension: int) -> FAISS:
+    return FAISS(embeddings.embed_query, faiss.IndexFlatL2(dimension), InMemoryDocstore({}), {})
+
+
+def add_embeddings_to_store(
+    docsearch: FAISS, texts: Sequence[str], vectors: Sequence[Sequence[float]], metadatas: Sequence[dict] | None = None
+) -> list[str]:
+    """
+    Same as FAISS.add_texts but with vectors which are already embedded
+    """
+    if not isinstance(docsearch.docstore, AddableMixin):
+        raise ValueError(f"Unable to add documents to {docsearch.docstore}")
+    starting_len = len(docsearch.index_to_docstore_id)
+    docsearch.index.add(np.array(vectors, dtype=np.float32))
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docsearch.docstore.add(
+        {
+            _id: Document(page_content=text, metadata=metadatas[i] if metadatas else {})
+            for i, (_id, text) in enumerate(zip(ids, texts))
+        }
+    )
+    docsearch.index_to_docstore_id.update({starting_len + i: _id for i, _id in enumerate(ids)})
+    return ids
+
+
+def shift_ivf_labels(index: Any, removed: np.ndarray) -> None:
+    """
+    Flat indexes shift the remaining vectors down when vectors are removed, but IVF indexes keep their labels.
+    Shift the labels of IVF indexes down as well, so labels stay the positions of the documents in the store
+    and vectors which are added later don't reuse labels which are still taken.
+    """
+    ivf: Any = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return
+    removed = np.sort(removed)
+    for list_no in range(ivf.nlist):
+        size = ivf.invlists.list_size(list_no)
+        if size == 0:
+            continue
+        labels = faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size).copy()
+        labels -= np.searchsorted(removed, labels)
+        ivf.invlists.update_entries(list_no, 0, size, faiss.swig_ptr(labels), ivf.invlists.get_codes(list_no))
+
+
+def remove_from_store(docsearch: FAISS, ids: set[str]) -> None:
+    if not ids:
+        return
+    positions = np.array(
+        [position for position, _id in docsearch.index_to_docstore_id.items() if _id in ids], dtype=np.int64
+    )
+    docsearch.index.remove_ids(positions)
+    shift_ivf_labels(docsearch.index, positions)
+    # The remaining vectors are shifted down, so the positions have to be renumbered
+    kept_ids = [_id for _, _id in sorted(docsearch.index_to_docstore_id.items()) if _id not in ids]
+    docsearch.index_to_docstore_id = dict(enumerate(kept_ids))
+    kept_documents = {_id: docsearch.docstore.search(_id) for _id in kept_ids}
+    docsearch.docstore = InMemoryDocstore(
+        {_id: document for _id, document in kept_documents.items() if isinstance(document, Document)}
+    )
+
+
+def save_checkpoint(checkpoint_dir: Path, docsearch: FAISS, embedding: str, state: dict) -> None:
+    """
+    Save a partially built store with the state needed to continue building it.
+    The checkpoint is written to a temporary directory which then replaces the previous checkpoint,
+    so an interrupted save always leaves a complete checkpoint behind.
+    """
+    temp_dir = checkpoint_dir.with_name(f"{checkpoint_dir.name}.tmp")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    temp_dir.mkdir(parents=True)
+    save_store(docsearch, temp_dir / "docsearch.index", embedding)
+    (temp_dir / CHECKPOINT_FILE).write_text(json.dumps(state))
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    os.replace(temp_dir, checkpoint_dir)
+
+
+def load_checkpoint(checkpoint_dir: Path, embeddings: Embeddings) -> tuple[FAISS, dict] | None:
+    temp_dir = checkpoint_dir.with_name(f"{checkpoint_dir.name}.tmp")
+    # The temporary directory is complete once its state is written, in case the save stopped before renaming it
+    for directory in [checkpoint_dir, temp_dir]:
+        if (directory / CHECKPOINT_FILE).exists():
+            state = json.loads((directory / CHECKPOINT_FILE).read_text())
+            return load_store(directory / "docsearch.index", embeddings, memory_map=False), state
+    return None
+
+
+def remove_checkpoint(checkpoint_dir: Path) -> None:
+    shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    shutil.rmtree(checkpoint_dir.with_name(f"{checkpoint_dir.name}.tmp"), ignore_errors=True)
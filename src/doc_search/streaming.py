@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import threading
+from typing import Iterator
+
+from langchain import OpenAI
+from langchain.llms.base import BaseLLM
+from langchain.llms.huggingface_pipeline import HuggingFacePipeline
+
+
+def stream_huggingface_tokens(llm: HuggingFacePipeline, prompt: str) -> Iterator[str]:
+    from transformers import TextIteratorStreamer  # type: ignore
+
+    streamer = TextIteratorStreamer(llm.pipeline.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors = []
+
+    def generate() -> None:
+        try:
+            llm.pipeline(prompt, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            # Unblock the consumer, which would otherwise wait for tokens forever
+            streamer.end()
+
+    thread = threading.Thread(target=generate, daemon=True)
+    thread.start()
+    yield from streamer
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def stream_tokens(llm: BaseLLM, prompt: str) -> Iterator[str]:
+    """
+    Tokens of the completion as they are generated.
+    LLMs without streaming support return the whole completion as a single token.
+    """
+    if isinstance(llm, OpenAI):
+        for response in llm.stream(prompt):
+            yield response["choices"][0]["text"]
+    elif isinstance(llm, HuggingFacePipeline):
+        yield from stream_huggingface_tokens(llm, prompt)
+    else:
+        yield llm(prompt)
@@ -1,10 +1,18 @@
+from __future__ import annotations
+
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Any
 
 import panel
 import panel as pn
-from py_executable_checklist.workflow import run_workflow
+from tornado.web import RequestHandler
 
+from doc_search.instrumentation import instrumentation, run_workflow
+from doc_search.service import InferenceService
 from doc_search.workflow import (
     inference_workflow_steps,
     pdf_name_from,
@@ -15,46 +23,105 @@ from doc_search.workflow import (
 
 pn.extension(loading_spinner="dots", loading_color="#00aa41")
 
-txt_input = pn.widgets.TextInput(value="", placeholder="Enter text here...", sizing_mode="stretch_width")
-btn_ask = pn.widgets.Button(name="Ask me something!", width=100)
-panel_conversations = []  # store all panel objects in a list
-global_context = {}  # store workflow context
+archive_lock = threading.Lock()  # sessions append to the same chat archive
 
 
-def add_qa_to_panel(question: str, answer: str) -> str:
-    qa_block = f"""
+def qa_block_from(question: str, answer: str) -> str:
+    return f"""
 🙂    **{question}**
 
 📖    {answer}
     """
-    panel_conversations.append(
-        pn.Row(
-            pn.pane.Markdown(
-                qa_block,
-                width=600,
-                style={
-                    "background-color": "#F6F6F6",
-                    "line-height": "1.5",
-                },
-            ),
-        )
+
+
+def qa_markdown(qa_block: str) -> pn.pane.Markdown:
+    return pn.pane.Markdown(
+        qa_block,
+        width=600,
+        style={
+            "background-color": "#F6F6F6",
+            "line-height": "1.5",
+        },
     )
-    return qa_block
-
-
-def get_conversations(_: Any) -> pn.Column:
-    prompt = txt_input.value_input
-    logging.info("Getting conversation for prompt: %s for input %s", prompt, txt_input)
-    if prompt != "":
-        input_question = global_context["input_question"] = prompt
-        run_workflow(global_context, inference_workflow_steps())
-        openai_answer = global_context["output"]
-        logging.info("Answer: %s", openai_answer)
-        qa_block = add_qa_to_panel(input_question, openai_answer)
-        with open(global_context["archive_file"], "a") as f:
+
+
+def append_to_archive(archive_file: Path, qa_block: str) -> None:
+    with archive_lock:
+        with open(archive_file, "a") as f:
             f.write(qa_block)
-    txt_input.value_input = ""
-    return pn.Column(*(reversed(panel_conversations)))
+
+
+class ChatSession:
+    """
+    Widgets and conversation of a single browser session.
+    Questions are answered in a thread pool, so a slow answer doesn't block the other sessions.
+    """
+
+    def __init__(
+        self, service: InferenceService, executor: ThreadPoolExecutor, archive_file: Path, greeting: str, summary: str
+    ) -> None:
+        self.service = service
+        self.executor = executor
+        self.archive_file = archive_file
+        self.txt_input = pn.widgets.TextInput(value="", placeholder="Enter text here...", sizing_mode="stretch_width")
+        self.btn_ask = pn.widgets.Button(name="Ask me something!", width=100)
+        self.btn_ask.on_click(self.ask)  # type: ignore[arg-type] # panel schedules coroutines on the event loop
+        self.conversations = pn.Column(
+            pn.Row(qa_markdown(qa_block_from("*Here is the book summary*", summary))),
+            pn.pane.Markdown(greeting, width=600, style={"background-color": "#F6F6F6"}),
+            height=500,
+            scroll=True,
+            style={"border-radius": "5px", "border": "1px black solid"},
+        )
+
+    async def ask(self, _: Any) -> None:
+        question = self.txt_input.value_input or ""
+        logging.info("Getting conversation for prompt: %s", question)
+        if question == "":
+            return
+
+        self.txt_input.value_input = ""
+        self.btn_ask.disabled = True
+        markdown = qa_markdown(qa_block_from(question, ""))
+        self.conversations.insert(0, pn.Row(markdown))
+        try:
+            answer = await self.stream_answer(question, markdown)
+        finally:
+            self.btn_ask.disabled = False
+
+        logging.info("Answer: %s", answer)
+        qa_block = qa_block_from(question, answer)
+        markdown.object = qa_block
+        await asyncio.get_running_loop().run_in_executor(self.executor, append_to_archive, self.archive_file, qa_block)
+
+    async def stream_answer(self, question: str, markdown: pn.pane.Markdown) -> str:
+        """
+        Answer in the thread pool and render the tokens on the event loop as they arrive
+        """
+        loop = asyncio.get_running_loop()
+        tokens: asyncio.Queue[str | None] = asyncio.Queue()
+
+        def on_token(token: str) -> None:
+            loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+        answer_future = loop.run_in_executor(self.executor, self.service.ask, question, on_token)
+        # Runs after the tokens queued by the answering thread, as both are scheduled in order on the loop
+        answer_future.add_done_callback(lambda _: tokens.put_nowait(None))
+        answer = ""
+        while (token := await tokens.get()) is not None:
+            answer += token
+            markdown.object = qa_block_from(question, answer)
+        result = await answer_future
+        return str(result["output"])
+
+    def view(self) -> pn.Column:
+        return pn.Column(pn.Row(self.txt_input, self.btn_ask), self.conversations)
+
+
+class MetricsHandler(RequestHandler):
+    def get(self) -> None:
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(instrumentation.prometheus_metrics())
 
 
 def run_inference_workflow(context: dict) -> None:
@@ -62,28 +129,17 @@ def run_inference_workflow(context: dict) -> None:
 
 
 def run_web(context: dict) -> None:
-    global global_context
     context["index_path"] = pdf_to_index_path(context["app_dir"], context["input_pdf_path"])
     context["faiss_db"] = pdf_to_faiss_db_path(context["app_dir"], context["input_pdf_path"])
-    context["archive_file"] = pdf_to_chat_archive_path(context["app_dir"], context["input_pdf_path"])
-    global_context = context
-    interactive_conversation = pn.bind(get_conversations, btn_ask)
+    archive_file = pdf_to_chat_archive_path(context["app_dir"], context["input_pdf_path"])
 
-    pdf_name = pdf_name_from(context["input_pdf_path"])
-    panel_conversations.append(
-        pn.pane.Markdown(f"📖 Ask me something about {pdf_name}", width=600, style={"background-color": "#F6F6F6"}),
-    )
+    inference_service = InferenceService(context)
+    summary: str = inference_service.ask(context["input_question"])["output"]
+    greeting = f"📖 Ask me something about {pdf_name_from(context['input_pdf_path'])}"
+    executor = ThreadPoolExecutor(max_workers=context["web_workers"], thread_name_prefix="ask")
 
-    run_workflow(global_context, inference_workflow_steps())
-    add_qa_to_panel("*Here is the book summary*", global_context["output"])
+    def new_session() -> pn.Column:
+        return ChatSession(inference_service, executor, archive_file, greeting, summary).view()
 
-    dashboard = pn.Column(
-        pn.Row(txt_input, btn_ask),
-        pn.panel(
-            interactive_conversation,
-            loading_indicator=True,
-            height=500,
-            style={"border-radius": "5px", "border": "1px black solid"},
-        ),
-    )
-    panel.serve(dashboard, port=5006, show=True)
+    extra_patterns = [("/metrics", MetricsHandler)] if context["prometheus"] else []
+    panel.serve(new_session, port=5006, show=True, extra_patterns=extra_patterns)
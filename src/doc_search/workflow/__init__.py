@@ -1,38 +1,111 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import os
 import pickle
 import platform
 import shutil
+import subprocess  # nosec
+import sys
+import threading
+import time
+import uuid
 import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from typing import Any
+from queue import Empty, Queue
+from typing import Any, Callable, Iterable, Sequence, TypeVar
 
 import faiss  # type: ignore
+import numpy as np
 import openai
-import torch
 from langchain import OpenAI, VectorDBQA
+from langchain.docstore.base import AddableMixin
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
 from langchain.embeddings import HuggingFaceEmbeddings, HuggingFaceHubEmbeddings
 from langchain.embeddings.base import Embeddings
 from langchain.embeddings.cohere import CohereEmbeddings
-from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.llms.base import BaseLLM
 from langchain.llms.huggingface_pipeline import HuggingFacePipeline
 from langchain.prompts import PromptTemplate
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.vectorstores.faiss import FAISS
 from py_executable_checklist.workflow import WorkflowBase, run_command
 from pypdf import PdfReader
 from rich import print
+from rich.progress import Progress, track
 from slug import slug  # type: ignore
-from transformers import pipeline  # type: ignore
 
-from doc_search import retry
+from doc_search import RateLimitGate, retry, retry_after, shared_pool
+from doc_search.answer_cache import AnswerCache, answer_namespace
+from doc_search.bm25 import (
+    Bm25Index,
+    bm25_exists,
+    reciprocal_rank_fusion,
+    save_bm25_index,
+)
+from doc_search.chunker import chunk_pages, chunk_tokens, read_pages, tokenizer_for
+from doc_search.context_builder import context_tokens, pack_context, token_counter
+from doc_search.embeddings import (
+    AdaptiveBatchSize,
+    CachedEmbeddings,
+    EmbeddingCache,
+    OpenAIBatchEmbeddings,
+    embedding_batch_size,
+)
+from doc_search.faiss_index import (
+    build_index,
+    index_description,
+    index_vectors,
+    print_recall_report,
+    recall_report,
+    tune_index,
+)
+from doc_search.instrumentation import count, in_current_step, timed_command
+from doc_search.library import LibrarySearch, library_index_paths
+from doc_search.local_embeddings import (
+    LocalEmbeddings,
+    benchmark_local_embeddings,
+    print_embedding_benchmark,
+)
+from doc_search.store import (
+    STORE_FILE,
+    MmapDocstore,
+    add_embeddings_to_store,
+    empty_faiss_store,
+    index_version,
+    load_checkpoint,
+    load_pickled_store,
+    load_store,
+    remove_checkpoint,
+    remove_from_store,
+    save_checkpoint,
+    save_store,
+    search_by_vectors,
+    store_exists,
+    write_atomically,
+)
+from doc_search.streaming import stream_tokens
 
 warnings.filterwarnings("ignore", category=FutureWarning, module="transformers")
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+# Rough upper bound of memory used by a single tesseract process on a 150 dpi page
+TESSERACT_JOB_MEMORY = 512 * 1024 * 1024
+MEMINFO = Path("/proc/meminfo")
+OCR_ATTEMPTS = 3
+# Rate limited embedding requests are retried with exponential back off unless the provider says how long to wait
+EMBEDDING_ATTEMPTS = 6
+EMBEDDING_RETRY_DELAY = 2
+EMBEDDING_MAX_RETRY_DELAY = 120
+# Pages with less text than this are most likely scanned images, maybe with a page number or a header
+MIN_TEXT_LAYER_CHARS = 100
+MIN_TEXT_LAYER_QUALITY = 0.9
+
+T = TypeVar("T")
+
 
 def slugify_pdf_name(input_pdf_path: Path) -> str:
     return str(slug(input_pdf_path.stem))
@@ -69,12 +142,350 @@ def pdf_to_index_path(app_dir: Path, input_pdf_path: Path) -> Path:
     return output_dir / "docsearch.index"
 
 
+def pdf_to_index_checkpoint_path(app_dir: Path, input_pdf_path: Path) -> Path:
+    return output_directory_for_pdf(app_dir, input_pdf_path) / "index" / "checkpoint"
+
+
 def pdf_to_chat_archive_path(app_dir: Path, input_pdf_path: Path) -> Path:
     output_dir = output_directory_for_pdf(app_dir, input_pdf_path) / "chat"
     output_dir.mkdir(parents=True, exist_ok=True)
     return output_dir / "archive.md"
 
 
+def embedding_cache_path(app_dir: Path) -> Path:
+    return app_dir / "OutputDir/dr-doc-search/cache/embeddings.sqlite"
+
+
+def metrics_report_path(app_dir: Path) -> Path:
+    return app_dir / f"OutputDir/dr-doc-search/metrics/run-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+
+
+def ingest_state_path(app_dir: Path) -> Path:
+    return app_dir / "OutputDir/dr-doc-search/ingest/jobs.json"
+
+
+def answer_cache_path(app_dir: Path) -> Path:
+    return app_dir / "OutputDir/dr-doc-search/cache/answers.sqlite"
+
+
+def scored_search(search_index: Any, query_vectors: np.ndarray, k: int) -> list[list[tuple[Document, float]]]:
+    """
+    Closest chunks and their distances for every query vector, in a single PDF or across the library
+    """
+    if isinstance(search_index, LibrarySearch):
+        return search_index.similarity_search_by_vectors(query_vectors, k)
+    return search_by_vectors(search_index, query_vectors, k)
+
+
+def lexical_search(
+    search_index: Any, lexical_index: Bm25Index | None, question: str, k: int
+) -> list[tuple[Document, float]]:
+    """
+    Best BM25 matches for the question, in a single PDF or across the library
+    """
+    if isinstance(search_index, LibrarySearch):
+        return search_index.lexical_search(question, k)
+    if lexical_index is None:
+        logging.warning("No inverted index found, train the PDF again to use hybrid retrieval")
+        return []
+    matches = [
+        (search_index.docstore.search(search_index.index_to_docstore_id[position]), score)
+        for position, score in lexical_index.search(question, k)
+    ]
+    return [(document, score) for document, score in matches if isinstance(document, Document)]
+
+
+def fuse_candidates(
+    vector_candidates: Sequence[tuple[Document, float | None]], lexical_candidates: Sequence[tuple[Document, float]]
+) -> list[tuple[Document, float | None]]:
+    """
+    Candidates ranked by reciprocal rank fusion of the vector and BM25 rankings,
+    with the vector distance of the ones found by vector search
+    """
+    documents: dict[tuple[str, str], Document] = {}
+    distances: dict[tuple[str, str], float | None] = {}
+    rankings = []
+    for candidates, has_distance in [(vector_candidates, True), (lexical_candidates, False)]:
+        ranking = []
+        for document, score in candidates:
+            key = (str(document.metadata.get("source", "")), document.page_content)
+            documents.setdefault(key, document)
+            if has_distance:
+                distances[key] = score
+            ranking.append(key)
+        rankings.append(ranking)
+    return [(documents[key], distances.get(key)) for key in reciprocal_rank_fusion(rankings)]
+
+
+def sources_from(documents: list[Document]) -> list[str]:
+    """
+    PDF and page of every document used to answer a question, without duplicates
+    """
+    sources = []
+    for document in documents:
+        page = document.metadata.get("page")
+        source = " ".join(
+            part
+            for part in [document.metadata.get("source", ""), f"page {page + 1}" if page is not None else ""]
+            if part
+        )
+        if source and source not in sources:
+            sources.append(source)
+    return sources
+
+
+def page_number_from(page_path: Path) -> int:
+    return int(page_path.stem.rsplit("-", 1)[-1])
+
+
+def available_memory() -> int | None:
+    """
+    Memory which can be used without swapping, including the page cache which the kernel can reclaim.
+    Other systems only report the free memory.
+    """
+    if MEMINFO.exists():
+        for line in MEMINFO.read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def ocr_workers(requested_workers: int) -> int:
+    """
+    Limit the number of parallel OCR jobs by core count and available memory
+    """
+    workers = min(requested_workers, os.cpu_count() or 1)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, memory // TESSERACT_JOB_MEMORY)
+    return max(workers, 1)
+
+
+def convert_page_command(convert_command: str, input_pdf_path: Path, page: int, image_path: Path | str) -> str:
+    return f"""{convert_command} -density 150 -trim -background white -alpha remove -quality 100 -sharpen 0x1.0 {input_pdf_path}[{page}] -quality 100 {image_path}"""
+
+
+def tesseract_command(image_path: Path | str, text_path: Path) -> str:
+    return f"tesseract {image_path} {text_path} --oem 1 -l eng"
+
+
+def run_external(command: str) -> str:
+    with timed_command(command):
+        return run_command(command)
+
+
+def run_binary_command(command: str, input_bytes: bytes | None = None) -> bytes:
+    logging.info("⚡ %s", command)
+    with timed_command(command):
+        return subprocess.run(  # nosec
+            command, shell=True, input=input_bytes, stdout=subprocess.PIPE, check=True
+        ).stdout
+
+
+def run_with_retries(func: Callable[[], T], attempts: int, description: str) -> T:
+    for attempt in range(1, attempts):
+        try:
+            return func()
+        except Exception as e:
+            logging.warning("🚨 %s failed (attempt %s/%s): %s", description, attempt, attempts, repr(e))
+            count("retries")
+    return func()
+
+
+def usable_text_layer(text: str) -> bool:
+    """
+    Check if the text extracted from a page can be used instead of running OCR on it.
+    Broken font encodings produce mostly symbols or replacement characters rather than words.
+    """
+    stripped = "".join(text.split())
+    if len(stripped) < MIN_TEXT_LAYER_CHARS:
+        return False
+    readable = sum(1 for c in stripped if c.isalnum() or c in ".,;:!?'\"()-")
+    return readable / len(stripped) >= MIN_TEXT_LAYER_QUALITY
+
+
+def limit_ocr_threads(workers: int) -> None:
+    if workers > 1:
+        # Each tesseract process would otherwise start one OpenMP thread per core
+        os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def report_throughput(action: str, pages: int, failures: Iterable[int], elapsed: float, workers: int) -> None:
+    failed_pages = sorted(failures)
+    processed = pages - len(failed_pages)
+    count("pages", processed)
+    count("failed_pages", len(failed_pages))
+    if pages:
+        print(
+            f"[bold]{action}[/bold] {processed} pages in {elapsed:.1f}s "
+            f"({processed / max(elapsed, 1e-6):.2f} pages/sec) using {workers} workers"
+        )
+    if failed_pages:
+        print(f"[red]Failed to process {len(failed_pages)} pages: {failed_pages}[/red]")
+
+
+def run_in_pool(
+    func: Callable[[int], Any], pages: Iterable[int], workers: int, description: str = "Processing pages"
+) -> dict[int, Exception]:
+    """
+    Run func for every page on a bounded thread pool.
+    Pages are scheduled in the given order and failures are collected per page
+    instead of aborting the remaining pages.
+    """
+    failures: dict[int, Exception] = {}
+
+    @in_current_step
+    def run_page(page: int) -> Any:
+        with shared_pool.slot():
+            return func(page)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(run_page, page): page for page in pages}
+        for future in track(
+            as_completed(futures), total=len(futures), description=description, disable=shared_pool.active
+        ):
+            page = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning("🚨 Failed to process page %s: %s", page, repr(e))
+                failures[page] = e
+    return failures
+
+
+class PagePipeline:
+    """
+    Run two page stages concurrently, handing each page from the first stage to the second through a bounded queue.
+    Failures are collected per page instead of aborting the remaining pages.
+    """
+
+    def __init__(self, produce: Callable[[int], Any], consume: Callable[[int, Any], None]) -> None:
+        self.produce = produce
+        self.consume = consume
+        self.pending: Queue[int] = Queue()
+        self.produced: Queue[tuple[int, Any] | None] = Queue()
+        self.failures: dict[int, Exception] = {}
+        self.failures_lock = threading.Lock()
+        self.progress = Progress(disable=shared_pool.active)
+        self.task = self.progress.add_task("Processing pages")
+
+    def record_failure(self, page: int, e: Exception) -> None:
+        logging.warning("🚨 Failed to process page %s: %s", page, e)
+        with self.failures_lock:
+            self.failures[page] = e
+        self.progress.advance(self.task)
+
+    def run_producer(self) -> None:
+        while True:
+            try:
+                page = self.pending.get_nowait()
+            except Empty:
+                return
+            try:
+                with shared_pool.slot():
+                    result = self.produce(page)
+            except Exception as e:
+                self.record_failure(page, e)
+                continue
+            # Wait for a consumer without holding a slot, which the consumer may need
+            self.produced.put((page, result))
+
+    def run_consumer(self) -> None:
+        while (item := self.produced.get()) is not None:
+            page, result = item
+            try:
+                with shared_pool.slot():
+                    self.consume(page, result)
+                self.progress.advance(self.task)
+            except Exception as e:
+                self.record_failure(page, e)
+
+    def run(self, pages: Iterable[int], producers: int, consumers: int, description: str) -> dict[int, Exception]:
+        for page in pages:
+            self.pending.put(page)
+        # Bounded so that the first stage can't run ahead and pile up results on disk or in memory
+        self.produced = Queue(maxsize=consumers * 2)
+        self.progress.update(self.task, description=description, total=self.pending.qsize())
+
+        with self.progress, ThreadPoolExecutor(max_workers=producers + consumers) as executor:
+            running_consumers = [executor.submit(in_current_step(self.run_consumer)) for _ in range(consumers)]
+            wait([executor.submit(in_current_step(self.run_producer)) for _ in range(producers)])
+            for _ in running_consumers:
+                self.produced.put(None)
+            wait(running_consumers)
+
+        return self.failures
+
+
+def pdf_to_index_manifest_path(app_dir: Path, input_pdf_path: Path) -> Path:
+    output_dir = output_directory_for_pdf(app_dir, input_pdf_path) / "index"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return output_dir / "manifest.json"
+
+
+def chunks_by_page(texts: list[str], metadatas: list[dict]) -> dict[int, list[str]]:
+    pages: dict[int, list[str]] = {}
+    for text, metadata in zip(texts, metadatas):
+        pages.setdefault(metadata["page"], []).append(text)
+    return pages
+
+
+def page_hash(texts: list[str]) -> str:
+    return hashlib.sha256("\n".join(texts).encode("utf-8")).hexdigest()
+
+
+def embedding_from_selection(
+    embedding: str, batch_size: int | None = None, threads: int = 0, quantize: bool = False
+) -> Embeddings:
+    if embedding == "local":
+        return LocalEmbeddings(batch_size=batch_size, threads=threads, quantize=quantize)
+    elif embedding == "huggingface":
+        return HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+    elif embedding == "huggingface-hub":
+        return HuggingFaceHubEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+    elif embedding == "cohere":
+        return CohereEmbeddings()
+    else:
+        return OpenAIBatchEmbeddings()
+
+
+def llm_from_selection(llm: str) -> BaseLLM:
+    if llm == "huggingface":
+        # torch and transformers take seconds to import, so they are only loaded for HuggingFace models
+        import torch
+        from transformers import pipeline  # type: ignore
+
+        pipe = pipeline(
+            "text2text-generation",
+            model="pszemraj/long-t5-tglobal-base-16384-book-summary",
+            device=0 if torch.cuda.is_available() else -1,
+        )
+        return HuggingFacePipeline(pipeline=pipe)
+    else:
+        return OpenAI(temperature=0)
+
+
+def question_prompt() -> PromptTemplate:
+    template = """
+Instructions:
+- Provide keywords and summary which should be relevant to answer the question.
+- Provide detailed responses that relate to the humans prompt.
+- If there is a code block in the answer then wrap it in triple backticks.
+- Also tag the code block with the language name.
+
+{context}
+
+- Human:
+${question}
+
+- You:"""
+
+    return PromptTemplate(input_variables=["context", "question"], template=template)
+
+
 class VerifyInputFile(WorkflowBase):
     """
     Verify input file and return pdf stats
@@ -100,6 +511,42 @@ class VerifyInputFile(WorkflowBase):
         }
 
 
+class ExtractTextLayer(WorkflowBase):
+    """
+    Extract text directly from pages with a usable text layer so that only image pages go through OCR
+    """
+
+    input_pdf_path: Path
+    app_dir: Path
+    start_page: int
+    end_page: int
+    force_ocr: bool
+
+    def execute(self) -> dict:
+        output_dir = output_directory_for_pdf(self.app_dir, self.input_pdf_path) / "scanned"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        if self.force_ocr:
+            return {"pages_text_path": output_dir, "text_layer_pages": []}
+
+        reader = PdfReader(self.input_pdf_path)
+        text_layer_pages = []
+        for i in range(self.start_page, self.end_page):
+            text_path = output_dir / f"output-{i}.txt"
+            if text_path.exists():
+                continue
+            text = reader.pages[i].extract_text()
+            if usable_text_layer(text):
+                text_path.write_text(text)
+                text_layer_pages.append(i)
+
+        count("pages", len(text_layer_pages))
+        print(
+            f"[bold]Extracted[/bold] text layer from {len(text_layer_pages)} pages, "
+            f"{self.end_page - self.start_page - len(text_layer_pages)} pages left for OCR"
+        )
+        return {"pages_text_path": output_dir, "text_layer_pages": text_layer_pages}
+
+
 class ImageMagickCommand(WorkflowBase):
     """
     Use command based on OS
@@ -128,20 +575,34 @@ class ConvertPDFToImages(WorkflowBase):
     app_dir: Path
     start_page: int
     end_page: int
+    workers: int
+
+    def convert_page(self, output_dir: Path, page: int) -> None:
+        image_path = output_dir / f"output-{page}.png"
+        try:
+            run_external(convert_page_command(self.convert_command, self.input_pdf_path, page, image_path))
+        except Exception:
+            # Don't leave a partial image behind, otherwise the next run would skip this page
+            image_path.unlink(missing_ok=True)
+            raise
 
     def execute(self) -> dict:
         output_dir = output_directory_for_pdf(self.app_dir, self.input_pdf_path) / "images"
         output_dir.mkdir(parents=True, exist_ok=True)
+        scanned_dir = output_directory_for_pdf(self.app_dir, self.input_pdf_path) / "scanned"
 
-        for i in range(self.start_page, self.end_page):
-            input_file_page = f"{self.input_pdf_path}[{i}]"
-            image_path = output_dir / f"output-{i}.png"
-            if image_path.exists():
-                continue
-            convert_command = f"""{self.convert_command} -density 150 -trim -background white -alpha remove -quality 100 -sharpen 0x1.0 {input_file_page} -quality 100 {image_path}"""
-            run_command(convert_command)
+        pages = [
+            i
+            for i in range(self.start_page, self.end_page)
+            if not (output_dir / f"output-{i}.png").exists() and not (scanned_dir / f"output-{i}.txt").exists()
+        ]
+        started = time.perf_counter()
+        failures = run_in_pool(
+            lambda page: self.convert_page(output_dir, page), pages, self.workers, "🖼️ Converting pages"
+        )
+        report_throughput("Converted", len(pages), failures, time.perf_counter() - started, self.workers)
 
-        return {"pdf_images_path": output_dir}
+        return {"pdf_images_path": output_dir, "failed_pages": sorted(failures)}
 
 
 class ConvertImagesToText(WorkflowBase):
@@ -152,93 +613,458 @@ class ConvertImagesToText(WorkflowBase):
     pdf_images_path: Path
     input_pdf_path: Path
     app_dir: Path
+    workers: int
+
+    def ocr_page(self, image_path: Path, text_path: Path) -> None:
+        run_with_retries(
+            lambda: run_external(tesseract_command(image_path, text_path)), OCR_ATTEMPTS, f"OCR {image_path}"
+        )
 
     def execute(self) -> dict:
         output_dir = output_directory_for_pdf(self.app_dir, self.input_pdf_path) / "scanned"
         output_dir.mkdir(parents=True, exist_ok=True)
 
-        for image_path in self.pdf_images_path.glob("*.png"):
-            image_name = image_path.stem
-            text_path = output_dir / f"{image_name}"
-            if text_path.with_suffix(".txt").exists():
-                continue
+        images = {page_number_from(image_path): image_path for image_path in self.pdf_images_path.glob("*.png")}
+        pages = [page for page in sorted(images) if not (output_dir / f"{images[page].stem}.txt").exists()]
 
-            tesseract_command = f"tesseract {image_path} {text_path} --oem 1 -l eng"
-            run_command(tesseract_command)
+        workers = ocr_workers(self.workers)
+        limit_ocr_threads(workers)
 
-        return {"pages_text_path": output_dir}
+        started = time.perf_counter()
+        failures = run_in_pool(
+            lambda page: self.ocr_page(images[page], output_dir / images[page].stem), pages, workers, "🔍 OCR pages"
+        )
+        report_throughput("Scanned", len(pages), failures, time.perf_counter() - started, workers)
 
+        return {"pages_text_path": output_dir, "failed_ocr_pages": sorted(failures)}
 
-class CombineAllText(WorkflowBase):
+
+class ConvertPDFToText(WorkflowBase):
     """
-    Combine all text files in the pages_text_path directory into one large text file and chunk it using Splitter
+    Convert PDF to text by streaming each page from ImageMagick straight into tessaract OCR
     """
 
-    pages_text_path: Path
+    convert_command: str
+    input_pdf_path: Path
+    app_dir: Path
+    start_page: int
+    end_page: int
+    workers: int
+    image_mode: str
+
+    def rasterize_page(self, images_dir: Path, page: int) -> Path | bytes:
+        if self.image_mode == "memory":
+            return run_binary_command(convert_page_command(self.convert_command, self.input_pdf_path, page, "png:-"))
+
+        image_path = images_dir / f"output-{page}.png"
+        if not image_path.exists():
+            try:
+                run_external(convert_page_command(self.convert_command, self.input_pdf_path, page, image_path))
+            except Exception:
+                image_path.unlink(missing_ok=True)
+                raise
+        return image_path
+
+    def scan_page(self, image: Path | bytes, text_path: Path) -> None:
+        if isinstance(image, bytes):
+            run_with_retries(
+                lambda: run_binary_command(tesseract_command("stdin", text_path), input_bytes=image),
+                OCR_ATTEMPTS,
+                f"OCR {text_path.name}",
+            )
+            return
+
+        run_with_retries(lambda: run_external(tesseract_command(image, text_path)), OCR_ATTEMPTS, f"OCR {image}")
+        if self.image_mode == "delete":
+            image.unlink(missing_ok=True)
 
     def execute(self) -> dict:
-        text = ""
-        for file in self.pages_text_path.glob("*.txt"):
-            text += file.read_text()
+        output_dir = output_directory_for_pdf(self.app_dir, self.input_pdf_path)
+        images_dir = output_dir / "images"
+        scanned_dir = output_dir / "scanned"
+        images_dir.mkdir(parents=True, exist_ok=True)
+        scanned_dir.mkdir(parents=True, exist_ok=True)
+
+        pages = [i for i in range(self.start_page, self.end_page) if not (scanned_dir / f"output-{i}.txt").exists()]
+        ocr_threads = ocr_workers(self.workers)
+        limit_ocr_threads(ocr_threads)
+        # OCR is the slower stage, so it gets most of the threads
+        convert_threads = max(ocr_threads // 2, 1)
 
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-        texts = text_splitter.split_text(text)
+        started = time.perf_counter()
+        failures = PagePipeline(
+            lambda page: self.rasterize_page(images_dir, page),
+            lambda page, image: self.scan_page(image, scanned_dir / f"output-{page}"),
+        ).run(pages, convert_threads, ocr_threads, "📜 Converting pages to text")
 
+        report_throughput("Converted", len(pages), failures, time.perf_counter() - started, ocr_threads)
+        return {"pdf_images_path": images_dir, "pages_text_path": scanned_dir, "failed_pages": sorted(failures)}
+
+
+class CombineAllText(WorkflowBase):
+    """
+    Chunk the text files in the pages_text_path directory in page order by tokens of the embedding model
+    and keep the page of every chunk
+    """
+
+    pages_text_path: Path
+    embedding: str
+    chunk_size: int | None
+    chunk_overlap: int
+
+    def execute(self) -> dict:
+        page_files = sorted(self.pages_text_path.glob("*.txt"), key=page_number_from)
+        size = chunk_tokens(self.embedding, self.chunk_size)
+        texts = []
+        metadatas = []
+        for text, metadata in chunk_pages(
+            read_pages(page_files, page_number_from), tokenizer_for(self.embedding), size, self.chunk_overlap
+        ):
+            texts.append(text)
+            metadatas.append(metadata)
+
+        logging.info("Split %s pages into %s chunks of up to %s tokens", len(page_files), len(texts), size)
+        count("pages", len(page_files))
+        count("chunks", len(texts))
         return {
-            "chunked_text_list": [t for t in texts if t],
+            "chunked_text_list": texts,
+            "chunk_metadatas": metadatas,
         }
 
 
+class IndexCheckpoint:
+    """
+    Save the partially embedded index every few chunks or seconds with the manifest of the pages which are
+    completely embedded, so that an interrupted run doesn't lose the embeddings which were already paid for
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: Path,
+        embedding: str,
+        manifest: dict,
+        pages: dict[int, list[str]],
+        new_index: bool,
+        every_chunks: int,
+        every_seconds: float,
+    ) -> None:
+        self.checkpoint_dir = checkpoint_dir
+        self.embedding = embedding
+        self.manifest = manifest
+        self.pages = pages
+        self.new_index = new_index
+        self.every_chunks = every_chunks
+        self.every_seconds = every_seconds
+        self.saved_chunks = 0
+        self.saved_at = time.monotonic()
+
+    def save_if_due(self, docsearch: FAISS, ids: list[str]) -> None:
+        due_by_chunks = self.every_chunks > 0 and len(ids) - self.saved_chunks >= self.every_chunks
+        due_by_time = self.every_seconds > 0 and time.monotonic() - self.saved_at >= self.every_seconds
+        if due_by_chunks or due_by_time:
+            self.save(docsearch, ids)
+
+    def save(self, docsearch: FAISS, ids: list[str]) -> None:
+        manifest = {**self.manifest, "pages": dict(self.manifest["pages"])}
+        position = 0
+        for page, chunks in self.pages.items():
+            end = position + len(chunks)
+            if end > len(ids):
+                break
+            manifest["pages"][str(page)] = {"hash": page_hash(chunks), "ids": ids[position:end]}
+            position = end
+        save_checkpoint(
+            self.checkpoint_dir, docsearch, self.embedding, {"manifest": manifest, "new_index": self.new_index}
+        )
+        self.saved_chunks = len(ids)
+        self.saved_at = time.monotonic()
+        logging.info("💾 Saved checkpoint of %s chunks to %s", len(ids), self.checkpoint_dir)
+
+
 class CreateIndex(WorkflowBase):
     """
-    Create index for embedding search
+    Create index for embedding search or add the pages which are new or changed since the index was created
     """
 
     input_pdf_path: Path
     app_dir: Path
     overwrite_index: bool
     chunked_text_list: list[str]
+    chunk_metadatas: list[dict]
     embedding: str
+    embedding_batch_size: int | None
+    embedding_cache_size: int
+    embedding_threads: int
+    quantize_embeddings: bool
+    index_type: str
+    nlist: int
+    pq_m: int
+    hnsw_m: int
+    vector_storage: str
+    pca_dims: int
+    index_report: bool
+    checkpoint_chunks: int
+    checkpoint_seconds: float
+
+    def embed_batch(self, embeddings: Embeddings, texts: Sequence[str]) -> list[list[float]]:
+        with shared_pool.slot():
+            return embeddings.embed_documents(list(texts))
+
+    def back_off(self, e: Exception, attempt: int, batch_size: AdaptiveBatchSize) -> None:
+        wait = retry_after(e)
+        if wait is None:
+            wait = min(EMBEDDING_RETRY_DELAY * 2 ** (attempt - 1), EMBEDDING_MAX_RETRY_DELAY)
+        batch_size.rate_limited()
+        logging.warning(
+            "⌛ Rate limited by %s, retrying in %.0f seconds with batches of %s chunks: %s",
+            self.embedding,
+            wait,
+            batch_size.size,
+            e,
+        )
+        count("retries")
+        count("retry_wait_seconds", wait)
+        time.sleep(wait)
+
+    def embed_next_batch(
+        self, embeddings: Embeddings, texts: list[str], start: int, batch_size: AdaptiveBatchSize
+    ) -> list[list[float]]:
+        """
+        Embed the next batch of chunks, retrying with smaller batches while the provider rate limits the requests
+        """
+        for attempt in range(1, EMBEDDING_ATTEMPTS):
+            end = start + batch_size.size
+            try:
+                vectors = self.embed_batch(embeddings, texts[start:end])
+            except openai.error.RateLimitError as e:
+                self.back_off(e, attempt, batch_size)
+                continue
+            batch_size.succeeded()
+            return vectors
+
+        end = start + batch_size.size
+        vectors = self.embed_batch(embeddings, texts[start:end])
+        batch_size.succeeded()
+        return vectors
+
+    def embed_chunks(
+        self,
+        embeddings: Embeddings,
+        docsearch: FAISS | None,
+        texts: list[str],
+        metadatas: list[dict],
+        checkpoint: IndexCheckpoint | None = None,
+    ) -> tuple[FAISS | None, list[str]]:
+        cached_embeddings: Embeddings = embeddings
+        if self.embedding_cache_size > 0:
+            cache = EmbeddingCache(embedding_cache_path(self.app_dir), self.embedding_cache_size * 1024 * 1024)
+            cached_embeddings = CachedEmbeddings(embeddings, cache, self.embedding)
+        batch_size = AdaptiveBatchSize(embedding_batch_size(self.embedding, self.embedding_batch_size))
+        ids: list[str] = []
+        with Progress(disable=shared_pool.active) as progress:
+            task = progress.add_task(
+                f"🧮 Embedding {len(texts)} chunks in batches of {batch_size.maximum}", total=len(texts)
+            )
+            try:
+                while len(ids) < len(texts):
+                    start = len(ids)
+                    vectors = self.embed_next_batch(cached_embeddings, texts, start, batch_size)
+                    end = start + len(vectors)
+                    if docsearch is None:
+                        docsearch = empty_faiss_store(embeddings, len(vectors[0]))
+                    ids.extend(add_embeddings_to_store(docsearch, texts[start:end], vectors, metadatas[start:end]))
+                    progress.advance(task, len(vectors))
+                    if checkpoint is not None:
+                        checkpoint.save_if_due(docsearch, ids)
+            except BaseException:
+                if checkpoint is not None and docsearch is not None and ids:
+                    checkpoint.save(docsearch, ids)
+                raise
+
+        count("chunks", len(texts))
+        if isinstance(cached_embeddings, CachedEmbeddings):
+            count("embedding_cache_hits", cached_embeddings.hits)
+            logging.info("Embedding cache hits: %s, misses: %s", cached_embeddings.hits, cached_embeddings.misses)
+            print(
+                f"[bold]Embedding cache[/bold] {cached_embeddings.hits} hits, "
+                f"{cached_embeddings.misses} chunks sent to {self.embedding}"
+            )
+        return docsearch, ids
+
+    def build_index(self, docsearch: FAISS) -> list[dict]:
+        """
+        Replace the exact index, which the chunks were added to, by the selected index type
+        """
+        exact_index = self.index_type == "flat" and self.vector_storage == "float32" and not self.pca_dims
+        if exact_index and not self.index_report:
+            return []
+
+        vectors = index_vectors(docsearch.index)
+        docsearch.index = build_index(
+            self.index_type, vectors, self.nlist, self.pq_m, self.hnsw_m, self.vector_storage, self.pca_dims
+        )
+        if not self.index_report:
+            return []
+
+        report = recall_report(docsearch.index, vectors)
+        print_recall_report(index_description(self.index_type, self.vector_storage, self.pca_dims), report)
+        return report
+
+    def index_layout(self) -> dict:
+        return {
+            "embedding": self.embedding,
+            "index_type": self.index_type,
+            "vector_storage": self.vector_storage,
+            "pca_dims": self.pca_dims,
+        }
 
-    @retry(exceptions=openai.error.RateLimitError, tries=2, delay=60, back_off=2)
-    def append_to_index(self, docsearch: FAISS, text: str) -> None:
-        docsearch.add_texts([text])
-
-    def embedding_from_selection(self) -> Embeddings:
-        if self.embedding == "huggingface":
-            return HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-        elif self.embedding == "huggingface-hub":
-            return HuggingFaceHubEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-        elif self.embedding == "cohere":
-            return CohereEmbeddings()
-        else:
-            return OpenAIEmbeddings()
+    def same_layout(self, manifest: dict) -> bool:
+        """
+        Check if the index of the manifest was built with the same embedding and index settings,
+        defaulting to the settings of indexes created before they were recorded
+        """
+        defaults = {"index_type": "flat", "vector_storage": "float32", "pca_dims": 0}
+        return all(manifest.get(key, defaults.get(key)) == value for key, value in self.index_layout().items())
+
+    def existing_index(
+        self, embeddings: Embeddings, index_path: Path, faiss_db: Path, manifest_path: Path
+    ) -> tuple[FAISS | None, dict | None]:
+        index_exists = store_exists(index_path) or faiss_db.exists()
+        if self.overwrite_index or not index_exists:
+            logging.info(
+                "Creating index at %s either because overwrite_index == %s or index file exists == %s",
+                index_path,
+                self.overwrite_index,
+                index_exists,
+            )
+            return None, {**self.index_layout(), "pages": {}}
+
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+        if not self.same_layout(manifest):
+            # Can't tell which pages are already embedded, or they were embedded with a different model
+            logging.info("Index already exists at %s, use --overwrite-index to recreate it", index_path)
+            return None, None
+        if store_exists(index_path):
+            return load_store(index_path, embeddings, memory_map=False), manifest
+        return load_pickled_store(index_path, faiss_db), manifest
+
+    def checkpoint(
+        self, checkpoint_dir: Path, manifest: dict, changed_pages: dict[int, list[str]], new_index: bool
+    ) -> IndexCheckpoint | None:
+        if self.checkpoint_chunks <= 0 and self.checkpoint_seconds <= 0:
+            return None
+        return IndexCheckpoint(
+            checkpoint_dir,
+            self.embedding,
+            manifest,
+            changed_pages,
+            new_index,
+            self.checkpoint_chunks,
+            self.checkpoint_seconds,
+        )
+
+    def resume_from_checkpoint(self, embeddings: Embeddings, checkpoint_dir: Path) -> tuple[FAISS, dict, bool] | None:
+        if self.overwrite_index:
+            remove_checkpoint(checkpoint_dir)
+            return None
+        checkpoint = load_checkpoint(checkpoint_dir, embeddings)
+        if checkpoint is None:
+            return None
+
+        docsearch, state = checkpoint
+        manifest = state["manifest"]
+        if not self.same_layout(manifest):
+            logging.info("Ignoring checkpoint at %s created with different embedding or index settings", checkpoint_dir)
+            remove_checkpoint(checkpoint_dir)
+            return None
+
+        # Chunks of the page which was being embedded when the checkpoint was saved are embedded again
+        embedded_ids = {_id for page in manifest["pages"].values() for _id in page["ids"]}
+        try:
+            remove_from_store(docsearch, set(docsearch.index_to_docstore_id.values()) - embedded_ids)
+        except RuntimeError as e:
+            logging.info(
+                "Ignoring checkpoint at %s as vectors can't be removed from its index: %s", checkpoint_dir, repr(e)
+            )
+            remove_checkpoint(checkpoint_dir)
+            return None
+        print(
+            f"[bold]Resuming[/bold] from checkpoint with {docsearch.index.ntotal} chunks "
+            f"of {len(manifest['pages'])} pages already embedded"
+        )
+        return docsearch, manifest, state["new_index"]
+
+    @staticmethod
+    def save_lexical_index(index_path: Path, rebuild: bool) -> None:
+        """
+        BM25 index of the saved chunks, in the same order as the vectors
+        """
+        if store_exists(index_path) and (rebuild or not bm25_exists(index_path.parent)):
+            records = MmapDocstore(index_path.parent).records()
+            save_bm25_index(index_path.parent, (record["page_content"] for record in records))
 
     def execute(self) -> dict:
         faiss_db = pdf_to_faiss_db_path(self.app_dir, self.input_pdf_path)
         index_path = pdf_to_index_path(self.app_dir, self.input_pdf_path)
+        manifest_path = pdf_to_index_manifest_path(self.app_dir, self.input_pdf_path)
 
-        if not self.overwrite_index and faiss_db.exists():
-            logging.info("Index already exists at %s", faiss_db)
+        embeddings = embedding_from_selection(
+            self.embedding, self.embedding_batch_size, self.embedding_threads, self.quantize_embeddings
+        )
+        docsearch, manifest = self.existing_index(embeddings, index_path, faiss_db, manifest_path)
+        if manifest is None:
             return {"index_path": index_path, "faiss_db": faiss_db}
-        else:
-            logging.info(
-                "Creating index at %s either because overwrite_index == %s or index file exists == %s",
-                faiss_db,
-                self.overwrite_index,
-                faiss_db.exists(),
-            )
 
-        embeddings = self.embedding_from_selection()
-        docsearch: FAISS = FAISS.from_texts(self.chunked_text_list[:2], embeddings)
-        for text in self.chunked_text_list[2:]:
-            self.append_to_index(docsearch, text)
-
-        faiss.write_index(docsearch.index, index_path.as_posix())
-        with open(faiss_db, "wb") as f:
-            pickle.dump(docsearch, f)
+        checkpoint_dir = pdf_to_index_checkpoint_path(self.app_dir, self.input_pdf_path)
+        new_index = False
+        resumed = self.resume_from_checkpoint(embeddings, checkpoint_dir)
+        if resumed is not None:
+            docsearch, manifest, new_index = resumed
+
+        pages = chunks_by_page(self.chunked_text_list, self.chunk_metadatas)
+        changed_pages = {
+            page: chunks
+            for page, chunks in pages.items()
+            if manifest["pages"].get(str(page), {}).get("hash") != page_hash(chunks)
+        }
+        if docsearch is not None and not changed_pages and resumed is None:
+            logging.info("Index at %s is up to date", index_path)
+            self.save_lexical_index(index_path, rebuild=False)
+            return {"index_path": index_path, "faiss_db": faiss_db}
 
-        return {"index_path": index_path, "faiss_db": faiss_db}
+        stale_ids = {_id for page in changed_pages for _id in manifest["pages"].get(str(page), {}).get("ids", [])}
+        if docsearch is not None:
+            print(f"[bold]Updating[/bold] {len(changed_pages)} new or changed pages in {index_path}")
+            try:
+                remove_from_store(docsearch, stale_ids)
+            except RuntimeError as e:
+                logging.info("Recreating %s index as vectors can't be removed from it: %s", self.index_type, repr(e))
+                docsearch, manifest["pages"], changed_pages = None, {}, pages
+        # The vectors of changed pages are gone until they are embedded again
+        for page in changed_pages:
+            manifest["pages"].pop(str(page), None)
+
+        texts = [text for chunks in changed_pages.values() for text in chunks]
+        metadatas = [{"page": page} for page, chunks in changed_pages.items() for _ in chunks]
+        new_index = new_index or docsearch is None
+        checkpoint = self.checkpoint(checkpoint_dir, manifest, changed_pages, new_index)
+        docsearch, ids = self.embed_chunks(embeddings, docsearch, texts, metadatas, checkpoint)
+        if docsearch is None:
+            raise ValueError(f"No text found to index for {self.input_pdf_path}")
+        index_report = self.build_index(docsearch) if new_index else []
+
+        new_ids = iter(ids)
+        for page, chunks in changed_pages.items():
+            manifest["pages"][str(page)] = {"hash": page_hash(chunks), "ids": [next(new_ids) for _ in chunks]}
+
+        save_store(docsearch, index_path, self.embedding)
+        self.save_lexical_index(index_path, rebuild=True)
+        write_atomically(manifest_path, lambda path: path.write_text(json.dumps(manifest)))
+        remove_checkpoint(checkpoint_dir)
+        # The pickled store of older versions would otherwise keep a second, outdated copy of every vector
+        faiss_db.unlink(missing_ok=True)
+
+        return {"index_path": index_path, "faiss_db": faiss_db, "index_report": index_report}
 
 
 class LoadIndex(WorkflowBase):
@@ -248,18 +1074,86 @@ class LoadIndex(WorkflowBase):
 
     index_path: Path
     faiss_db: Path
+    embedding: str
+    embedding_threads: int
+    quantize_embeddings: bool
+    nprobe: int
+    ef_search: int
 
     def execute(self) -> dict:
-        if not self.faiss_db.exists():
+        # Questions are embedded with the same model as the chunks, quantized if the chunks were
+        embeddings = embedding_from_selection(
+            self.embedding, threads=self.embedding_threads, quantize=self.quantize_embeddings
+        )
+        if store_exists(self.index_path):
+            print(f"[bold]Loading[/bold] index from {self.index_path}")
+            search_index = load_store(self.index_path, embeddings)
+            version = index_version([self.index_path.parent / STORE_FILE])
+        elif self.faiss_db.exists():
+            print(f"[bold]Loading[/bold] index from {self.faiss_db}")
+            search_index = load_pickled_store(self.index_path, self.faiss_db)
+            version = index_version([self.faiss_db])
+        else:
             raise FileNotFoundError(f"FAISS DB file not found: {self.faiss_db}")
 
-        print(f"[bold]Loading[/bold] index from {self.faiss_db}")
-        index = faiss.read_index(self.index_path.as_posix())
-        with open(self.faiss_db, "rb") as f:
-            search_index = pickle.load(f)
+        tune_index(search_index.index, self.nprobe, self.ef_search)
+        lexical_index = Bm25Index(self.index_path.parent) if bm25_exists(self.index_path.parent) else None
+        return {
+            "search_index": search_index,
+            "index_version": version,
+            "embeddings": embeddings,
+            "lexical_index": lexical_index,
+        }
+
+
+class LoadLibraryIndex(WorkflowBase):
+    """
+    Load the indexes of all PDFs in the library for embedding search across them
+    """
 
-        search_index.index = index
-        return {"search_index": search_index}
+    app_dir: Path
+    embedding: str
+    embedding_threads: int
+    quantize_embeddings: bool
+    nprobe: int
+    ef_search: int
+    max_loaded_indexes: int
+
+    def execute(self) -> dict:
+        index_paths = library_index_paths(self.app_dir)
+        if not index_paths:
+            raise FileNotFoundError(f"No indexed PDFs found in {self.app_dir}")
+
+        print(f"[bold]Searching[/bold] {len(index_paths)} indexed PDFs")
+        embeddings = embedding_from_selection(
+            self.embedding, threads=self.embedding_threads, quantize=self.quantize_embeddings
+        )
+        search_index = LibrarySearch(
+            index_paths,
+            embeddings,
+            self.embedding,
+            self.max_loaded_indexes,
+            self.nprobe,
+            self.ef_search,
+        )
+        version = index_version([index_path.parent / STORE_FILE for index_path in search_index.index_paths])
+        return {
+            "search_index": search_index,
+            "index_version": version,
+            "embeddings": embeddings,
+            "lexical_index": None,
+        }
+
+
+class LoadLLM(WorkflowBase):
+    """
+    Load the LLM used to answer questions
+    """
+
+    llm: str
+
+    def execute(self) -> dict:
+        return {"llm_model": llm_from_selection(self.llm)}
 
 
 class AskQuestion(WorkflowBase):
@@ -269,62 +1163,244 @@ class AskQuestion(WorkflowBase):
 
     input_question: str
     search_index: Any
+    llm_model: BaseLLM
+    app_dir: Path
+    index_version: str
+    answer_cache_size: int
+    answer_cache_ttl: float
+    answer_cache_similarity: float
     llm: str
+    context_tokens: int | None
+    retrieve_k: int
+    min_similarity: float
+    retrieval: str
+    lexical_index: Any
 
     def prompt_from_question(self) -> PromptTemplate:
-        template = """
-Instructions:
-- Provide keywords and summary which should be relevant to answer the question.
-- Provide detailed responses that relate to the humans prompt.
-- If there is a code block in the answer then wrap it in triple backticks.
-- Also tag the code block with the language name.
+        return question_prompt()
 
-{context}
+    def execute(self) -> dict:
+        prompt = self.prompt_from_question()
+        # Streaming is optional, so callers which only want the final answer don't have to provide a callback
+        on_token = self.context.get("on_token")
+        if self.answer_cache_size <= 0:
+            return self.answer(prompt, on_token)
+
+        cache = AnswerCache(answer_cache_path(self.app_dir), self.answer_cache_size, self.answer_cache_ttl * 3600)
+        namespace = answer_namespace(
+            self.index_version, self.llm_model._llm_type, self.llm_model._identifying_params, prompt.template
+        )
+        vector = self.search_index.embedding_function(self.input_question) if self.answer_cache_similarity else None
+        cached = cache.get(namespace, self.input_question, vector, self.answer_cache_similarity)
+        if cached is not None:
+            logging.info("⚡ Found answer in cache")
+            if on_token is not None:
+                on_token(cached["output"])
+            return cached
+
+        answer = self.answer(prompt, on_token, vector)
+        cache.put(namespace, self.input_question, answer["output"], answer["sources"], vector)
+        return answer
+
+    def answer(
+        self, prompt: PromptTemplate, on_token: Callable[[str], None] | None, vector: list[float] | None = None
+    ) -> dict:
+        qa = VectorDBQA.from_llm(llm=self.llm_model, prompt=prompt, vectorstore=self.search_index)
+        query_vectors = np.array([vector or self.search_index.embedding_function(self.input_question)])
+        candidates: list[tuple[Document, float | None]] = []
+        candidates.extend(scored_search(self.search_index, query_vectors, self.retrieve_k)[0])
+        if self.retrieval == "hybrid":
+            lexical = lexical_search(self.search_index, self.lexical_index, self.input_question, self.retrieve_k)
+            candidates = fuse_candidates(candidates, lexical)
+        documents = pack_context(
+            candidates,
+            token_counter(self.llm_model),
+            context_tokens(self.llm, self.context_tokens),
+            self.min_similarity,
+        )
+        if on_token is None:
+            output = self.send_prompt(qa, documents, self.input_question)
+        else:
+            output = self.stream_prompt(qa, documents, self.input_question, on_token)
+        return {"output": output, "sources": sources_from(documents)}
 
-- Human:
-${question}
+    @retry(exceptions=openai.error.RateLimitError, tries=2, delay=60, back_off=2)
+    def send_prompt(self, qa: VectorDBQA, documents: list[Document], input_question: str) -> Any:
+        answer, _ = qa.combine_documents_chain.combine_docs(documents, question=input_question)
+        return answer
 
-- You:"""
+    @retry(exceptions=openai.error.RateLimitError, tries=2, delay=60, back_off=2)
+    def stream_prompt(
+        self, qa: VectorDBQA, documents: list[Document], input_question: str, on_token: Callable[[str], None]
+    ) -> str:
+        chain = qa.combine_documents_chain
+        inputs = chain._get_inputs(documents, question=input_question)  # type: ignore
+        prompt = chain.llm_chain.prompt.format(**inputs)  # type: ignore
+        started = time.perf_counter()
+        tokens: list[str] = []
+        for token in stream_tokens(self.llm_model, prompt):
+            if not tokens:
+                logging.info("⏱️ First token after %.2f seconds", time.perf_counter() - started)
+            tokens.append(token)
+            on_token(token)
+        count("answer_tokens", len(tokens))
+        logging.info("⏱️ Answer streamed in %.2f seconds", time.perf_counter() - started)
+        return "".join(tokens)
+
+
+class ReadQuestions(WorkflowBase):
+    """
+    Read the questions to answer in batch, one per line, from a file or stdin
+    """
 
-        return PromptTemplate(input_variables=["context", "question"], template=template)
+    questions_file: Path
 
-    def llm_provider(self) -> BaseLLM:
-        if self.llm == "huggingface":
-            pipe = pipeline(
-                "text2text-generation",
-                model="pszemraj/long-t5-tglobal-base-16384-book-summary",
-                device=0 if torch.cuda.is_available() else -1,
-            )
-            return HuggingFacePipeline(pipeline=pipe)
+    def execute(self) -> dict:
+        if self.questions_file == Path("-"):
+            lines = sys.stdin.read().splitlines()
         else:
-            return OpenAI(temperature=0)
+            lines = self.questions_file.read_text().splitlines()
+        questions = [line.strip() for line in lines if line.strip()]
+        print(f"[bold]Answering[/bold] {len(questions)} questions")
+        count("questions", len(questions))
+        return {"questions": questions}
+
+
+class AskQuestions(WorkflowBase):
+    """
+    Answer a batch of questions, retrieving the context of all of them with a single index search
+    and sending the prompts to the LLM concurrently
+    """
+
+    questions: list[str]
+    search_index: Any
+    embeddings: Embeddings
+    embedding: str
+    llm_model: BaseLLM
+    concurrency: int
+    llm: str
+    context_tokens: int | None
+    retrieve_k: int
+    min_similarity: float
+    retrieval: str
+    lexical_index: Any
+
+    def embed_questions(self) -> np.ndarray:
+        batch_size = embedding_batch_size(self.embedding)
+        vectors = []
+        for start in range(0, len(self.questions), batch_size):
+            end = start + batch_size
+            vectors.extend(self.embeddings.embed_documents(self.questions[start:end]))
+        return np.array(vectors, dtype=np.float32)
+
+    def retrieve(self) -> list[list[Document]]:
+        if not self.questions:
+            return []
+        count_tokens = token_counter(self.llm_model)
+        budget = context_tokens(self.llm, self.context_tokens)
+        all_candidates: list[list[tuple[Document, float | None]]] = [
+            list(candidates) for candidates in scored_search(self.search_index, self.embed_questions(), self.retrieve_k)
+        ]
+        if self.retrieval == "hybrid":
+            all_candidates = [
+                fuse_candidates(
+                    candidates, lexical_search(self.search_index, self.lexical_index, question, self.retrieve_k)
+                )
+                for question, candidates in zip(self.questions, all_candidates)
+            ]
+        return [pack_context(candidates, count_tokens, budget, self.min_similarity) for candidates in all_candidates]
 
     def execute(self) -> dict:
-        llm = self.llm_provider()
-        prompt = self.prompt_from_question()
-        qa = VectorDBQA.from_llm(llm=llm, prompt=prompt, vectorstore=self.search_index)
-        output = self.send_prompt(qa, self.input_question)
-        return {"output": output}
+        qa = VectorDBQA.from_llm(llm=self.llm_model, prompt=question_prompt(), vectorstore=self.search_index)
+        all_documents = self.retrieve()
+
+        # One rate limited request pauses all the others instead of every thread hammering the API
+        gate = RateLimitGate()
+
+        @in_current_step
+        @retry(exceptions=openai.error.RateLimitError, tries=4, delay=10, back_off=2, gate=gate)
+        def send_prompt(documents: list[Document], question: str) -> str:
+            answer, _ = qa.combine_documents_chain.combine_docs(documents, question=question)
+            return str(answer)
+
+        answers = []
+        with ThreadPoolExecutor(max_workers=max(self.concurrency, 1)) as executor:
+            futures = [
+                executor.submit(send_prompt, documents, question)
+                for documents, question in zip(all_documents, self.questions)
+            ]
+            for question, documents, future in track(
+                zip(self.questions, all_documents, futures), total=len(futures), description="Answering questions"
+            ):
+                answer = {"question": question, "answer": None, "sources": sources_from(documents)}
+                try:
+                    answer["answer"] = future.result()
+                except Exception as e:
+                    logging.error("🚨 Unable to answer %s: %s", question, repr(e))
+                    answer["error"] = str(e)
+                answers.append(answer)
+        return {"answers": answers}
+
+
+class WriteAnswers(WorkflowBase):
+    """
+    Write the answers as JSON lines to a file or stdout
+    """
 
-    @retry(exceptions=openai.error.RateLimitError, tries=2, delay=60, back_off=2)
-    def send_prompt(self, qa: VectorDBQA, input_question: str) -> Any:
-        return qa.run(query=input_question)
+    answers: list[dict]
+    answers_file: Path
 
+    def execute(self) -> None:
+        lines = "".join(json.dumps(answer) + "\n" for answer in self.answers)
+        if self.answers_file == Path("-"):
+            sys.stdout.write(lines)
+        else:
+            self.answers_file.write_text(lines)
+            print(f"[bold]Saved[/bold] {len(self.answers)} answers to {self.answers_file}")
 
-def training_workflow_steps() -> list:
-    return [
-        VerifyInputFile,
-        ImageMagickCommand,
-        ConvertPDFToImages,
-        ConvertImagesToText,
+
+class BenchmarkEmbeddings(WorkflowBase):
+    """
+    Compare the throughput and retrieval agreement of the local embedding with and without quantization
+    """
+
+    chunked_text_list: list[str]
+    embedding_batch_size: int | None
+    embedding_threads: int
+
+    def execute(self) -> None:
+        print(f"[bold]Benchmarking[/bold] local embedding with {len(self.chunked_text_list)} chunks")
+        report = benchmark_local_embeddings(
+            self.chunked_text_list, batch_size=self.embedding_batch_size, threads=self.embedding_threads
+        )
+        print_embedding_benchmark(report)
+
+
+def embedding_benchmark_workflow_steps(pipeline: bool = False) -> list:
+    return pre_process_workflow_steps(pipeline) + [
+        CombineAllText,
+        BenchmarkEmbeddings,
+    ]
+
+
+def training_workflow_steps(pipeline: bool = False) -> list:
+    return pre_process_workflow_steps(pipeline) + [
         CombineAllText,
         CreateIndex,
     ]
 
 
-def pre_process_workflow_steps() -> list:
+def pre_process_workflow_steps(pipeline: bool = False) -> list:
+    if pipeline:
+        return [
+            VerifyInputFile,
+            ExtractTextLayer,
+            ImageMagickCommand,
+            ConvertPDFToText,
+        ]
     return [
         VerifyInputFile,
+        ExtractTextLayer,
         ImageMagickCommand,
         ConvertPDFToImages,
         ConvertImagesToText,
@@ -334,9 +1410,28 @@ def pre_process_workflow_steps() -> list:
 def inference_workflow_steps() -> list:
     return [
         LoadIndex,
+        LoadLLM,
+        AskQuestion,
+    ]
+
+
+def library_inference_workflow_steps() -> list:
+    return [
+        LoadLibraryIndex,
+        LoadLLM,
         AskQuestion,
     ]
 
 
-def workflow_steps() -> list:
-    return training_workflow_steps() + inference_workflow_steps()
+def batch_workflow_steps(library: bool = False) -> list:
+    return [
+        LoadLibraryIndex if library else LoadIndex,
+        LoadLLM,
+        ReadQuestions,
+        AskQuestions,
+        WriteAnswers,
+    ]
+
+
+def workflow_steps(pipeline: bool = False) -> list:
+    return training_workflow_steps(pipeline) + inference_workflow_steps()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Any
+
+from doc_search import workflow
+from doc_search.answer_cache import AnswerCache
+from doc_search.service import InferenceService
+from tests.create_index_test import FakeEmbeddings
+from tests.service_test import FakeLLM, service_context
+
+
+def test_find_answer_of_same_question(tmp_path: Path) -> None:
+    cache = AnswerCache(tmp_path / "answers.sqlite", 10, 60)
+    cache.put("index-1", "What is money?", "An IOU", ["page 1"])
+
+    assert cache.get("index-1", "  what is   MONEY? ") == {"output": "An IOU", "sources": ["page 1"]}
+    assert cache.get("index-2", "What is money?") is None
+    assert cache.get("index-1", "What is debt?") is None
+
+
+def test_find_answer_of_similar_question(tmp_path: Path) -> None:
+    cache = AnswerCache(tmp_path / "answers.sqlite", 10, 60)
+    cache.put("index", "What is money?", "An IOU", [], [1.0, 0.0, 1.0])
+
+    assert cache.get("index", "What's money?", [1.0, 0.1, 1.0], similarity=0.99) is not None
+    assert cache.get("index", "What is debt?", [0.0, 1.0, 0.0], similarity=0.99) is None
+    assert cache.get("index", "What's money?", [1.0, 0.1, 1.0]) is None
+
+
+def test_expire_and_evict_least_recently_used_answers(tmp_path: Path) -> None:
+    cache = AnswerCache(tmp_path / "answers.sqlite", 2, 60)
+    cache.put("index", "first", "1", [])
+    cache.put("index", "second", "2", [])
+    cache.get("index", "first")
+    cache.put("index", "third", "3", [])
+
+    assert cache.get("index", "second") is None
+    assert cache.get("index", "first") is not None
+
+    cache.ttl_seconds = 0
+    time.sleep(0.01)
+    assert cache.get("index", "third") is None
+
+
+def test_answer_from_cache_without_calling_llm(tmp_path: Path, monkeypatch: Any) -> None:
+    llm = FakeLLM()
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_, **__: FakeEmbeddings())
+    monkeypatch.setattr(workflow, "llm_from_selection", lambda _: llm)
+    service = InferenceService(service_context(tmp_path, answer_cache_size=10, answer_cache_similarity=0.99))
+
+    first = service.ask("first")
+    tokens: list[str] = []
+    again = service.ask("First ", tokens.append)
+    similar = service.ask("third")
+
+    assert llm.calls == 1
+    assert (again["output"], again["sources"]) == (first["output"], first["sources"])
+    assert similar["output"] == first["output"]
+    assert tokens == [first["output"]]
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+import sys
+
+import pytest
+
+from doc_search.app import parse_args
+
+
+def test_only_ask_questions_across_the_library_without_pdf(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "argv", ["dr-doc-search", "--library", "--questions-file", "questions.txt"])
+    assert parse_args().library
+
+    for mode in ["--web-app", "--train", "--pre-process", "--embedding-benchmark"]:
+        monkeypatch.setattr(sys, "argv", ["dr-doc-search", "--library", mode])
+        with pytest.raises(SystemExit):
+            parse_args()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import json
+import time
+from pathlib import Path
+from typing import Any, List, Optional
+
+import openai
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search import RateLimitGate, retry, workflow
+from doc_search.workflow import batch_workflow_steps
+from tests.create_index_test import FakeEmbeddings
+from tests.service_test import FakeLLM, service_context
+
+
+class EchoLLM(FakeLLM):
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        question = prompt.split("- Human:\n$")[1].split("\n")[0]
+        if question == "fail":
+            raise ValueError("LLM failed")
+        return f"answer to {question}"
+
+
+def test_answer_questions_from_file_as_json_lines(tmp_path: Path, monkeypatch: Any) -> None:
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_, **__: embeddings)
+    monkeypatch.setattr(workflow, "llm_from_selection", lambda _: EchoLLM())
+    questions_file = tmp_path / "questions.txt"
+    questions_file.write_text("first\n\nthird\nfail\n")
+    context = {
+        **service_context(tmp_path),
+        "library": False,
+        "questions_file": questions_file,
+        "answers_file": tmp_path / "answers.jsonl",
+        "concurrency": 2,
+    }
+
+    run_workflow(context, batch_workflow_steps())
+
+    answers = [json.loads(line) for line in (tmp_path / "answers.jsonl").read_text().splitlines()]
+    assert [(a["question"], a["answer"]) for a in answers] == [
+        ("first", "answer to first"),
+        ("third", "answer to third"),
+        ("fail", None),
+    ]
+    assert answers[0]["sources"] == ["page 3", "page 1", "page 2"]
+    assert answers[2]["error"] == "LLM failed"
+    # All questions are embedded together instead of one query at a time
+    assert embeddings.batches == [["first", "third", "fail"]]
+
+
+def test_share_rate_limit_back_off() -> None:
+    gate = RateLimitGate()
+    calls = []
+
+    @retry(exceptions=openai.error.RateLimitError, tries=3, delay=1, gate=gate)
+    def call_api() -> str:
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise openai.error.RateLimitError("slow down")
+        return "done"
+
+    assert call_api() == "done"
+    assert calls[1] - calls[0] >= 1
+    assert gate.resume_at <= time.monotonic()
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from benchmarks.run_benchmarks import headline_metrics, run_benchmarks
+from benchmarks.synthetic import page_lines, write_image_pdf, write_text_pdf
+from pypdf import PdfReader
+
+from doc_search import workflow
+
+
+def test_generate_synthetic_pdfs(tmp_path: Path) -> None:
+    text_pdf = PdfReader(write_text_pdf(tmp_path / "text.pdf", 3))
+    image_pdf = PdfReader(write_image_pdf(tmp_path / "image.pdf", 2))
+
+    assert len(text_pdf.pages) == 3
+    assert page_lines(2)[0] in text_pdf.pages[2].extract_text()
+    assert len(image_pdf.pages) == 2
+    assert image_pdf.pages[0].extract_text() == ""
+
+
+def test_benchmark_ingest_and_queries_offline(tmp_path: Path) -> None:
+    embedding_from_selection = workflow.embedding_from_selection
+
+    results = run_benchmarks(tmp_path, pages=4, image_pages=0, queries=4, index_loads=2)
+
+    assert results["text_pdf"]["ExtractTextLayer"]["pages"] == 4
+    assert results["text_pdf"]["CreateIndex"]["chunks"] > 0
+    assert results["image_pdf"] == {"skipped": "no image pages"}
+    assert set(results["queries"]) == {"vector", "hybrid"}
+    assert results["queries"]["hybrid"]["queries"] == 4
+    assert headline_metrics(results)["CreateIndex chunks/sec"] > 0
+    assert workflow.embedding_from_selection is embedding_from_selection
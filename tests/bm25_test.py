@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search import workflow
+from doc_search.bm25 import Bm25Index, reciprocal_rank_fusion, save_bm25_index, tokenize
+from doc_search.service import InferenceService
+from doc_search.workflow import CreateIndex
+from tests.create_index_test import FakeEmbeddings, index_context
+from tests.service_test import FakeLLM, service_context
+
+
+def test_keep_codes_and_their_parts() -> None:
+    assert tokenize("Replace part AB-1234 on error E.101") == [
+        "replace",
+        "part",
+        "ab-1234",
+        "ab",
+        "1234",
+        "on",
+        "error",
+        "e.101",
+        "e",
+        "101",
+    ]
+
+
+def test_rank_texts_with_rare_terms_first(tmp_path: Path) -> None:
+    save_bm25_index(
+        tmp_path,
+        ["the pump is broken", "replace the pump seal AB-1234", "the the the pump", "nothing relevant"],
+    )
+    lexical_index = Bm25Index(tmp_path)
+
+    assert lexical_index.terms is None
+    assert [position for position, _ in lexical_index.search("pump AB-1234", k=2)] == [1, 0]
+    assert lexical_index.search("missing", k=2) == []
+
+
+def test_fuse_rankings() -> None:
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["c", "b"]]) == ["c", "b", "a"]
+
+
+def test_create_inverted_index_with_vector_index(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_, **__: FakeEmbeddings())
+    context = index_context(tmp_path, ["page 0", "error E42 on page 1"])
+
+    run_workflow(context, [CreateIndex])
+
+    assert [position for position, _ in Bm25Index(context["index_path"].parent).search("E42")] == [1]
+
+
+def test_hybrid_retrieval_finds_exact_codes(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_, **__: FakeEmbeddings())
+    monkeypatch.setattr(workflow, "llm_from_selection", lambda _: FakeLLM())
+    context = service_context(tmp_path)
+    save_bm25_index(tmp_path, ["first chunk", "second chunk with ümlauts", "third"])
+    context.update(retrieve_k=1, retrieval="hybrid")
+
+    answer = InferenceService(context).ask("ümlauts")
+
+    assert answer["sources"] == ["page 3", "page 2"]
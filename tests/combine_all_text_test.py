@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+import tiktoken
+from py_executable_checklist.workflow import run_workflow
+from transformers import BertTokenizerFast  # type: ignore
+
+from doc_search import chunker
+from doc_search.chunker import (
+    chunk_pages,
+    huggingface_offsets,
+    tiktoken_offsets,
+    word_offsets,
+)
+from doc_search.workflow import CombineAllText
+
+
+def test_chunk_pages_in_page_order(tmp_path: Path) -> None:
+    for page in [10, 2, 1]:
+        (tmp_path / f"output-{page}.txt").write_text(f"Text of page {page}")
+    context: dict[str, Any] = {
+        "pages_text_path": tmp_path,
+        "embedding": "cohere",
+        "chunk_size": None,
+        "chunk_overlap": 32,
+    }
+
+    run_workflow(context, [CombineAllText])
+
+    assert context["chunked_text_list"] == ["Text of page 1", "Text of page 2", "Text of page 10"]
+    assert context["chunk_metadatas"] == [{"page": 1}, {"page": 2}, {"page": 10}]
+
+
+def test_chunk_by_tokens_with_overlap_within_pages() -> None:
+    pages = [(1, "one two  three\nfour five six seven"), (2, "eight nine"), (3, "   ")]
+
+    chunks = list(chunk_pages(pages, word_offsets, size=3, overlap=1))
+
+    assert chunks == [
+        ("one two  three", {"page": 1}),
+        ("three\nfour five", {"page": 1}),
+        ("five six seven", {"page": 1}),
+        ("eight nine", {"page": 2}),
+    ]
+
+
+def test_chunk_by_tiktoken_tokens(monkeypatch: pytest.MonkeyPatch) -> None:
+    # Byte level encoding with just enough merges for the text, so that the test doesn't download the real one
+    merges = [b"he", b"ll", b"llo", b"hello", b" w", b"or", b"ld", b" wor", b" world"]
+    ranks = {bytes([i]): i for i in range(256)}
+    ranks.update({merge: 256 + i for i, merge in enumerate(merges)})
+    encoding = tiktoken.Encoding(name="tiny", pat_str=r" ?\p{L}+|\s+", mergeable_ranks=ranks, special_tokens={})
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda _: encoding)
+
+    offsets = tiktoken_offsets()
+
+    assert offsets("hello world") == [(0, 5), (5, 11)]
+    assert list(chunk_pages([(1, "hello world hello")], offsets, size=2, overlap=0)) == [
+        ("hello world", {"page": 1}),
+        ("hello", {"page": 1}),
+    ]
+
+
+def test_chunk_by_huggingface_tokens(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    vocab_file = tmp_path / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "money", "debt", "##s"]))
+    BertTokenizerFast(vocab_file.as_posix()).save_pretrained(tmp_path)
+    monkeypatch.setattr(chunker, "HUGGINGFACE_TOKENIZER", tmp_path.as_posix())
+
+    offsets = huggingface_offsets()
+
+    assert offsets("money debts") == [(0, 5), (6, 10), (10, 11)]
+    assert list(chunk_pages([(1, "money debts")], offsets, size=2, overlap=0)) == [
+        ("money debt", {"page": 1}),
+        ("s", {"page": 1}),
+    ]
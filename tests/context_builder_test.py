@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import pytest
+import tiktoken
+from langchain.docstore.document import Document
+from langchain.llms.openai import OpenAI
+
+from doc_search.context_builder import context_tokens, pack_context, token_counter
+from tests.service_test import FakeLLM
+
+
+def word_count(text: str) -> int:
+    return len(text.split())
+
+
+def candidate(text: str, distance: float) -> tuple[Document, float]:
+    return Document(page_content=text, metadata={}), distance
+
+
+def test_pack_closest_chunks_into_token_budget() -> None:
+    candidates = [
+        candidate("closest chunk", 0.1),
+        candidate("second best paragraph which is too long to fit", 0.2),
+        candidate("another text of five words", 0.3),
+        candidate("last one", 0.4),
+    ]
+
+    packed = pack_context(candidates, word_count, budget=10)
+
+    assert [document.page_content for document in packed] == [
+        "closest chunk",
+        "another text of five words",
+        "last one",
+    ]
+
+
+def test_skip_dissimilar_and_duplicate_chunks() -> None:
+    candidates = [
+        candidate("money is a debt of the issuer", 0.2),
+        candidate("money is a debt of the issuer and more", 0.3),
+        candidate("unrelated chunk", 1.5),
+        candidate("employment fell when spending fell", 0.5),
+    ]
+
+    packed = pack_context(candidates, word_count, budget=100, min_similarity=0.5)
+
+    assert [document.page_content for document in packed] == [
+        "money is a debt of the issuer",
+        "employment fell when spending fell",
+    ]
+
+
+def test_token_budget_depends_on_llm() -> None:
+    assert context_tokens("openai") == 3000
+    assert context_tokens("huggingface") == 8192
+    assert context_tokens("openai", 500) == 500
+
+
+def test_count_tokens_with_the_llm() -> None:
+    count_tokens = token_counter(FakeLLM())
+
+    assert count_tokens("money is a debt of the issuer") == 7
+
+
+def test_count_openai_tokens_with_one_encoding(monkeypatch: pytest.MonkeyPatch) -> None:
+    ranks = {bytes([i]): i for i in range(256)}
+    ranks.update({b"mo": 256, b"ney": 257, b"money": 258})
+    encoding = tiktoken.Encoding(name="tiny", pat_str=r" ?\p{L}+|\s+", mergeable_ranks=ranks, special_tokens={})
+    loaded: list[str] = []
+
+    def encoding_for_model(model: str) -> tiktoken.Encoding:
+        loaded.append(model)
+        return encoding
+
+    monkeypatch.setattr(tiktoken, "encoding_for_model", encoding_for_model)
+
+    count_tokens = token_counter(OpenAI(openai_api_key="test"))
+
+    assert [count_tokens(text) for text in ["money", "money", "mo"]] == [1, 1, 1]
+    assert count_tokens("debt") == 4
+    assert loaded == ["text-davinci-003"]
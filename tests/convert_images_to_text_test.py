@@ -6,7 +6,8 @@ from typing import Any
 import pytest
 from py_executable_checklist.workflow import run_workflow
 
-from doc_search.workflow import ConvertImagesToText
+from doc_search import workflow
+from doc_search.workflow import ConvertImagesToText, ocr_workers
 
 
 @pytest.mark.skip(reason="Need to mock run_workflow")
@@ -15,6 +16,7 @@ def test_images_to_text() -> None:
         "input_pdf_path": Path("tests/data/input.pdf"),
         "pdf_images_path": Path("tests/data/images/"),
         "app_dir": Path(".") / "tests",
+        "workers": 1,
     }
     expected_output_path = Path("tests/OutputDir/dr-doc-search/input/scanned")
 
@@ -22,3 +24,54 @@ def test_images_to_text() -> None:
 
     assert context["pages_text_path"] == expected_output_path
     assert len(list(expected_output_path.glob("*.txt"))) == 2
+
+
+def test_ocr_pages_in_page_order_and_retry_failures(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    for page in [10, 2, 1]:
+        (images_path / f"output-{page}.png").touch()
+    scanned_pages: list[str] = []
+    failed_once: set[str] = set()
+
+    def fake_run_command(command: str) -> str:
+        image_name = Path(command.split()[1]).stem
+        if image_name == "output-2" and image_name not in failed_once:
+            failed_once.add(image_name)
+            raise RuntimeError("tesseract failed")
+        scanned_pages.append(image_name)
+        Path(command.split()[2] + ".txt").write_text(image_name)
+        return ""
+
+    monkeypatch.setattr(workflow, "run_command", fake_run_command)
+    context: dict[str, Any] = {
+        "input_pdf_path": Path("tests/data/input.pdf"),
+        "pdf_images_path": images_path,
+        "app_dir": tmp_path,
+        "workers": 1,
+    }
+
+    run_workflow(context, [ConvertImagesToText])
+
+    assert scanned_pages == ["output-1", "output-2", "output-10"]
+    assert context["failed_ocr_pages"] == []
+    assert len(list(context["pages_text_path"].glob("*.txt"))) == 3
+
+
+def test_limit_ocr_workers_by_cores_and_memory(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(workflow.os, "cpu_count", lambda: 8)
+    monkeypatch.setattr(workflow, "available_memory", lambda: 3 * workflow.TESSERACT_JOB_MEMORY)
+
+    assert ocr_workers(32) == 3
+    assert ocr_workers(2) == 2
+
+    monkeypatch.setattr(workflow, "available_memory", lambda: 0)
+    assert ocr_workers(32) == 1
+
+
+def test_count_reclaimable_page_cache_as_available_memory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text("MemTotal:       16000000 kB\nMemFree:         1500000 kB\nMemAvailable:    5500000 kB\n")
+    monkeypatch.setattr(workflow, "MEMINFO", meminfo)
+
+    assert workflow.available_memory() == 5500000 * 1024
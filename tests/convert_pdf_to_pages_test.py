@@ -6,6 +6,7 @@ from typing import Any
 import pytest
 from py_executable_checklist.workflow import run_workflow
 
+from doc_search import workflow
 from doc_search.workflow import ConvertPDFToImages
 
 
@@ -16,6 +17,7 @@ def test_convert_pdf_to_pages() -> None:
         "start_page": 1,
         "end_page": 2,
         "app_dir": Path(".") / "tests",
+        "workers": 1,
     }
     expected_output_path = Path("tests/OutputDir/dr-doc-search/input/images")
 
@@ -23,3 +25,39 @@ def test_convert_pdf_to_pages() -> None:
 
     assert context["pdf_images_path"] == expected_output_path
     assert len(list(expected_output_path.glob("*.png"))) == 2
+
+
+def test_convert_pages_in_parallel_and_collect_failures(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    commands: list[str] = []
+
+    def fake_run_command(command: str) -> str:
+        commands.append(command)
+        if "[3]" in command:
+            raise RuntimeError("convert failed")
+        Path(command.split()[-1]).touch()
+        return ""
+
+    monkeypatch.setattr(workflow, "run_command", fake_run_command)
+    context: dict[str, Any] = {
+        "convert_command": "convert",
+        "input_pdf_path": Path("tests/data/input.pdf"),
+        "start_page": 0,
+        "end_page": 5,
+        "app_dir": tmp_path,
+        "workers": 3,
+    }
+    images_path = tmp_path / "OutputDir/dr-doc-search/input/images"
+    images_path.mkdir(parents=True)
+    (images_path / "output-0.png").touch()
+
+    run_workflow(context, [ConvertPDFToImages])
+
+    assert context["pdf_images_path"] == images_path
+    assert context["failed_pages"] == [3]
+    assert len(commands) == 4
+    assert sorted(p.name for p in images_path.glob("*.png")) == [
+        "output-0.png",
+        "output-1.png",
+        "output-2.png",
+        "output-4.png",
+    ]
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search import workflow
+from doc_search.workflow import ConvertPDFToText, pre_process_workflow_steps
+
+
+def pipeline_context(tmp_path: Path, image_mode: str) -> dict[str, Any]:
+    return {
+        "convert_command": "convert",
+        "input_pdf_path": Path("tests/data/input.pdf"),
+        "app_dir": tmp_path,
+        "start_page": 0,
+        "end_page": 4,
+        "workers": 2,
+        "image_mode": image_mode,
+    }
+
+
+def fake_tesseract(command: str) -> None:
+    Path(command.split()[2] + ".txt").write_text(command)
+
+
+@pytest.mark.parametrize("image_mode, expected_images", [("keep", 4), ("delete", 0)])
+def test_stream_pages_from_images_to_text(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, image_mode: str, expected_images: int
+) -> None:
+    def fake_run_command(command: str) -> str:
+        if command.startswith("tesseract"):
+            fake_tesseract(command)
+        else:
+            Path(command.split()[-1]).touch()
+        return ""
+
+    monkeypatch.setattr(workflow, "run_command", fake_run_command)
+    context = pipeline_context(tmp_path, image_mode)
+
+    run_workflow(context, [ConvertPDFToText])
+
+    assert context["failed_pages"] == []
+    assert len(list(context["pages_text_path"].glob("*.txt"))) == 4
+    assert len(list(context["pdf_images_path"].glob("*.png"))) == expected_images
+
+
+def test_keep_page_images_in_memory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    def fake_run_binary_command(command: str, input_bytes: bytes | None = None) -> bytes:
+        if command.startswith("tesseract"):
+            assert input_bytes == b"png"
+            fake_tesseract(command)
+            return b""
+        if "[2]" in command:
+            raise RuntimeError("convert failed")
+        return b"png"
+
+    monkeypatch.setattr(workflow, "run_binary_command", fake_run_binary_command)
+    context = pipeline_context(tmp_path, "memory")
+
+    run_workflow(context, [ConvertPDFToText])
+
+    assert context["failed_pages"] == [2]
+    assert sorted(p.name for p in context["pages_text_path"].glob("*.txt")) == [
+        "output-0.txt",
+        "output-1.txt",
+        "output-3.txt",
+    ]
+    assert list(context["pdf_images_path"].glob("*.png")) == []
+
+
+def test_pipeline_replaces_separate_conversion_steps() -> None:
+    assert pre_process_workflow_steps(pipeline=True)[-1] == ConvertPDFToText
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, List
+
+import openai
+import pytest
+from langchain.embeddings.base import Embeddings
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search import retry_after, workflow
+from doc_search.store import load_store
+from doc_search.workflow import CreateIndex, pdf_to_index_checkpoint_path
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self) -> None:
+        self.batches: list[list[str]] = []
+        # Error raised by each call, if any
+        self.failures: list[Exception | None] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        failure = self.failures.pop(0) if self.failures else None
+        if failure is not None:
+            raise failure
+        self.batches.append(texts)
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text)), float(text.count("a")), 1.0]
+
+
+def index_context(
+    tmp_path: Path, chunks: list[str], batch_size: int | None = None, cache_size: int = 0
+) -> dict[str, Any]:
+    return {
+        "input_pdf_path": Path("tests/data/input.pdf"),
+        "app_dir": tmp_path,
+        "overwrite_index": False,
+        "chunked_text_list": chunks,
+        "chunk_metadatas": [{"page": i // 3} for i in range(len(chunks))],
+        "embedding": "huggingface",
+        "embedding_batch_size": batch_size,
+        "embedding_cache_size": cache_size,
+        "embedding_threads": 0,
+        "quantize_embeddings": False,
+        "index_type": "flat",
+        "nlist": 0,
+        "pq_m": 0,
+        "hnsw_m": 32,
+        "vector_storage": "float32",
+        "pca_dims": 0,
+        "index_report": False,
+        "checkpoint_chunks": 0,
+        "checkpoint_seconds": 0,
+    }
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch: pytest.MonkeyPatch) -> FakeEmbeddings:
+    embeddings = FakeEmbeddings()
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_: embeddings)
+    return embeddings
+
+
+def test_embed_chunks_in_batches(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    chunks = [f"chunk {i} " + "a" * i for i in range(10)]
+    context = index_context(tmp_path, chunks, batch_size=4)
+
+    run_workflow(context, [CreateIndex])
+
+    assert [len(batch) for batch in fake_embeddings.batches] == [4, 4, 2]
+    assert context["index_path"].exists()
+    assert not context["faiss_db"].exists()
+
+
+def test_use_default_batch_size_for_embedding(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    chunks = [f"chunk {i}" for i in range(40)]
+    context = index_context(tmp_path, chunks)
+
+    run_workflow(context, [CreateIndex])
+
+    assert [len(batch) for batch in fake_embeddings.batches] == [32, 8]
+
+
+def test_only_embed_chunks_missing_from_cache(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    run_workflow(index_context(tmp_path, ["first", "second"], cache_size=1), [CreateIndex])
+    fake_embeddings.batches.clear()
+
+    context = index_context(tmp_path, ["first", "second", "third"], cache_size=1)
+    context["overwrite_index"] = True
+    run_workflow(context, [CreateIndex])
+
+    assert fake_embeddings.batches == [["third"]]
+
+
+def test_only_embed_new_or_changed_pages(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    run_workflow(index_context(tmp_path, ["page 0", "page 0 again", "page 0 more", "page 1"]), [CreateIndex])
+    fake_embeddings.batches.clear()
+
+    context = index_context(tmp_path, ["page 0", "page 0 again", "page 0 more", "page 1 fixed", "page 2 new"])
+    context["chunk_metadatas"][-1] = {"page": 2}
+    run_workflow(context, [CreateIndex])
+
+    assert fake_embeddings.batches == [["page 1 fixed", "page 2 new"]]
+    docsearch = load_store(context["index_path"], fake_embeddings)
+    assert docsearch.index.ntotal == 5
+    assert {doc.page_content for doc in docsearch.similarity_search("page 1 fixed", k=5)} == {
+        "page 0",
+        "page 0 again",
+        "page 0 more",
+        "page 1 fixed",
+        "page 2 new",
+    }
+
+
+def test_skip_index_when_pages_did_not_change(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    run_workflow(index_context(tmp_path, ["page 0", "page 1"]), [CreateIndex])
+    fake_embeddings.batches.clear()
+
+    run_workflow(index_context(tmp_path, ["page 0", "page 1"]), [CreateIndex])
+
+    assert fake_embeddings.batches == []
+
+
+def test_build_selected_index_type_with_report(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    context = index_context(tmp_path, [f"chunk {i} " + "a" * i for i in range(50)])
+    context["index_type"] = "ivf-flat"
+    context["index_report"] = True
+
+    run_workflow(context, [CreateIndex])
+
+    assert load_store(context["index_path"], fake_embeddings).index.nlist == 28
+    assert [row["nprobe"] for row in context["index_report"]] == [1, 2, 4, 8, 16]
+
+
+def test_recreate_index_which_does_not_support_removing_vectors(
+    tmp_path: Path, fake_embeddings: FakeEmbeddings
+) -> None:
+    context = index_context(tmp_path, ["page 0", "page 1"])
+    context["index_type"] = "hnsw"
+    run_workflow(context, [CreateIndex])
+    fake_embeddings.batches.clear()
+
+    context = index_context(tmp_path, ["page 0", "page 1 fixed"])
+    context["index_type"] = "hnsw"
+    run_workflow(context, [CreateIndex])
+
+    assert fake_embeddings.batches == [["page 0", "page 1 fixed"]]
+    assert load_store(context["index_path"], fake_embeddings).index.ntotal == 2
+
+
+def test_update_pages_of_ivf_index(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    chunks = [f"chunk {i} " + "a" * i for i in range(60)]
+    context = index_context(tmp_path, chunks)
+    context["index_type"] = "ivf-flat"
+    run_workflow(context, [CreateIndex])
+    fake_embeddings.batches.clear()
+
+    # Page 1 changed and page 20 is new
+    chunks[3:6] = [f"changed {i} " + "a" * (i + 100) for i in range(3)]
+    context = index_context(tmp_path, chunks + ["new page " + "a" * 200])
+    context["chunk_metadatas"][-1] = {"page": 20}
+    context["index_type"] = "ivf-flat"
+    run_workflow(context, [CreateIndex])
+
+    assert fake_embeddings.batches == [chunks[3:6] + ["new page " + "a" * 200]]
+    docsearch = load_store(context["index_path"], fake_embeddings)
+    assert docsearch.index.ntotal == 61
+    for chunk in context["chunked_text_list"]:
+        assert docsearch.similarity_search(chunk, k=1)[0].page_content == chunk
+
+
+def test_resume_from_checkpoint_after_failure(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    chunks = [f"chunk {i}" for i in range(9)]
+    context = index_context(tmp_path, chunks, batch_size=2)
+    context["checkpoint_chunks"] = 2
+    fake_embeddings.failures = [None, None, RuntimeError("connection lost")]
+
+    with pytest.raises(RuntimeError):
+        run_workflow(context, [CreateIndex])
+    assert pdf_to_index_checkpoint_path(tmp_path, context["input_pdf_path"]).exists()
+    fake_embeddings.batches.clear()
+
+    context = index_context(tmp_path, chunks, batch_size=2)
+    run_workflow(context, [CreateIndex])
+
+    # Page 0 (chunks 0-2) was embedded before the failure, chunk 3 of page 1 is embedded again
+    assert [text for batch in fake_embeddings.batches for text in batch] == chunks[3:]
+    assert load_store(context["index_path"], fake_embeddings).index.ntotal == 9
+    assert not pdf_to_index_checkpoint_path(tmp_path, context["input_pdf_path"]).exists()
+
+
+def test_ignore_checkpoint_when_overwriting_index(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    chunks = [f"chunk {i}" for i in range(9)]
+    context = index_context(tmp_path, chunks, batch_size=2)
+    context["checkpoint_chunks"] = 2
+    fake_embeddings.failures = [None, None, RuntimeError("connection lost")]
+    with pytest.raises(RuntimeError):
+        run_workflow(context, [CreateIndex])
+    fake_embeddings.batches.clear()
+
+    context = index_context(tmp_path, chunks, batch_size=2)
+    context["overwrite_index"] = True
+    run_workflow(context, [CreateIndex])
+
+    assert [text for batch in fake_embeddings.batches for text in batch] == chunks
+    assert load_store(context["index_path"], fake_embeddings).index.ntotal == 9
+
+
+def test_discard_checkpoint_of_index_which_does_not_support_removing_vectors(
+    tmp_path: Path, fake_embeddings: FakeEmbeddings
+) -> None:
+    context = index_context(tmp_path, ["page 0"])
+    context["index_type"] = "hnsw"
+    run_workflow(context, [CreateIndex])
+
+    # Page 1 is added to the HNSW index and the checkpoint is saved in the middle of it
+    chunks = ["page 0", "page 1", "page 1 again", "page 1 more"]
+    context = index_context(tmp_path, chunks, batch_size=2)
+    context.update(index_type="hnsw", checkpoint_chunks=2)
+    context["chunk_metadatas"] = [{"page": 0}] + [{"page": 1}] * 3
+    fake_embeddings.failures = [None, RuntimeError("connection lost")]
+    with pytest.raises(RuntimeError):
+        run_workflow(context, [CreateIndex])
+    assert pdf_to_index_checkpoint_path(tmp_path, context["input_pdf_path"]).exists()
+    fake_embeddings.batches.clear()
+
+    context = index_context(tmp_path, chunks, batch_size=2)
+    context["index_type"] = "hnsw"
+    context["chunk_metadatas"] = [{"page": 0}] + [{"page": 1}] * 3
+    run_workflow(context, [CreateIndex])
+
+    assert [text for batch in fake_embeddings.batches for text in batch] == chunks[1:]
+    assert load_store(context["index_path"], fake_embeddings).index.ntotal == 4
+    assert not pdf_to_index_checkpoint_path(tmp_path, context["input_pdf_path"]).exists()
+
+
+def test_shrink_batches_when_rate_limited(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    fake_embeddings.failures = [openai.error.RateLimitError("slow down", headers={"Retry-After": "0"})]
+    context = index_context(tmp_path, [f"chunk {i}" for i in range(12)], batch_size=4)
+
+    run_workflow(context, [CreateIndex])
+
+    assert [len(batch) for batch in fake_embeddings.batches] == [2, 3, 4, 3]
+
+
+def test_read_retry_after_header() -> None:
+    assert retry_after(openai.error.RateLimitError("slow down", headers={"retry-after": "7"})) == 7
+    assert retry_after(openai.error.RateLimitError("slow down", headers={"Retry-After": "soon"})) is None
+    assert retry_after(openai.error.RateLimitError("slow down")) is None
+    in_the_past = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert retry_after(openai.error.RateLimitError("slow down", headers={"Retry-After": in_the_past})) == 0
+
+
+def test_store_compact_vectors_and_keep_them_when_updating(tmp_path: Path, fake_embeddings: FakeEmbeddings) -> None:
+    context = index_context(tmp_path, [f"chunk {i} " + "a" * i for i in range(20)])
+    context.update(vector_storage="int8", pca_dims=2, index_report=True)
+    run_workflow(context, [CreateIndex])
+
+    assert context["index_report"][0]["bytes_per_vector"] > 0
+    assert load_store(context["index_path"], fake_embeddings).index.d == 3
+
+    context = index_context(tmp_path, [f"chunk {i} " + "a" * i for i in range(20)] + ["new page"])
+    context["chunk_metadatas"][-1] = {"page": 7}
+    context.update(vector_storage="int8", pca_dims=2)
+    fake_embeddings.batches.clear()
+    run_workflow(context, [CreateIndex])
+
+    assert fake_embeddings.batches == [["new page"]]
+    assert load_store(context["index_path"], fake_embeddings).index.ntotal == 21
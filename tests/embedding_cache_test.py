@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from doc_search.embeddings import EmbeddingCache
+
+
+def test_return_cached_embeddings_by_namespace(tmp_path: Path) -> None:
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite", max_bytes=1024)
+
+    cache.put_many("openai:ada", ["one", "two"], [[1.0, 2.0], [3.0, 4.0]])
+
+    assert cache.get_many("openai:ada", ["two", "three"]) == {EmbeddingCache.text_hash("two"): [3.0, 4.0]}
+    assert cache.get_many("cohere:large", ["two"]) == {}
+
+
+def test_evict_least_recently_used_embeddings(tmp_path: Path) -> None:
+    # Each embedding takes 8 bytes, so only two of them fit
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite", max_bytes=16)
+    cache.put_many("ns", ["one"], [[1.0, 1.0]])
+    cache.put_many("ns", ["two"], [[2.0, 2.0]])
+    cache.get_many("ns", ["one"])
+
+    cache.put_many("ns", ["three"], [[3.0, 3.0]])
+
+    assert sorted(cache.get_many("ns", ["one", "two", "three"]).values()) == [[1.0, 1.0], [3.0, 3.0]]
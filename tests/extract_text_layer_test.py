@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search.workflow import ExtractTextLayer, usable_text_layer
+
+
+def text_layer_context(tmp_path: Path, force_ocr: bool) -> dict[str, Any]:
+    return {
+        "input_pdf_path": Path("tests/data/input.pdf"),
+        "app_dir": tmp_path,
+        "start_page": 0,
+        "end_page": 2,
+        "force_ocr": force_ocr,
+    }
+
+
+def test_extract_text_from_pages_with_text_layer(tmp_path: Path) -> None:
+    context = text_layer_context(tmp_path, force_ocr=False)
+
+    run_workflow(context, [ExtractTextLayer])
+
+    assert context["text_layer_pages"] == [0, 1]
+    assert "A Simple PDF File" in (context["pages_text_path"] / "output-0.txt").read_text()
+
+
+def test_skip_text_layer_when_forcing_ocr(tmp_path: Path) -> None:
+    context = text_layer_context(tmp_path, force_ocr=True)
+
+    run_workflow(context, [ExtractTextLayer])
+
+    assert context["text_layer_pages"] == []
+    assert list(context["pages_text_path"].glob("*.txt")) == []
+
+
+def test_detect_usable_text_layer() -> None:
+    assert usable_text_layer("And more text. " * 10)
+    assert not usable_text_layer("Page 12")
+    assert not usable_text_layer("��# ~~ " * 30)
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from doc_search.faiss_index import (
+    base_index,
+    build_index,
+    default_pq_m,
+    index_description,
+    recall_report,
+    tune_index,
+)
+
+vectors = np.random.default_rng(0).random((300, 16), dtype=np.float32)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf-flat", "ivf-pq", "hnsw"])
+def test_build_index_of_type(index_type: str) -> None:
+    index = build_index(index_type, vectors)
+    tune_index(index, nprobe=1000, ef_search=256)
+
+    _, found = index.search(vectors[:5], 1)
+
+    assert index.ntotal == 300
+    assert list(found[:, 0]) == [0, 1, 2, 3, 4]
+
+
+def test_report_recall_for_each_query_setting() -> None:
+    index = build_index("ivf-flat", vectors, nlist=4)
+
+    report = recall_report(index, vectors, k=5, queries=20)
+
+    assert [row["nprobe"] for row in report] == [1, 2, 4]
+    assert report[-1]["recall"] == 1.0
+    assert all(row["latency_ms"] >= 0 for row in report)
+
+
+def test_choose_sub_quantizers_dividing_dimension() -> None:
+    assert default_pq_m(1536) == 384
+    assert default_pq_m(768) == 192
+    assert default_pq_m(3) == 1
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf-flat", "hnsw"])
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_store_compact_vectors(index_type: str, storage: str) -> None:
+    index = build_index(index_type, vectors, storage=storage)
+    tune_index(index, nprobe=1000, ef_search=256)
+
+    report = recall_report(index, vectors, k=5, queries=20)
+
+    assert report[-1]["recall"] >= 0.9
+    full_size = recall_report(build_index(index_type, vectors), vectors, k=5, queries=20)[0]["bytes_per_vector"]
+    assert report[-1]["bytes_per_vector"] < full_size
+
+
+def test_reduce_dimensions_with_pca() -> None:
+    index = build_index("flat", vectors, storage="int8", pca_dims=8)
+
+    _, found = index.search(vectors[:5], 1)
+
+    assert base_index(index).d == 8
+    assert list(found[:, 0]) == [0, 1, 2, 3, 4]
+    assert index_description("flat", "int8", 8) == "flat int8 PCA 8"
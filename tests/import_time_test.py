@@ -0,0 +1,29 @@
+from __future__ import annotations
+
+import json
+import subprocess  # nosec
+import sys
+
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers", "panel", "bokeh"]
+
+
+def heavy_modules_imported_by(module: str) -> list[str]:
+    """
+    Import the module in a fresh interpreter and return the heavy modules it loaded
+    """
+    code = f"""
+import json, sys
+import {module}
+print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))
+"""
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout  # nosec
+    loaded: list[str] = json.loads(output.splitlines()[-1])
+    return loaded
+
+
+def test_cli_does_not_import_heavy_modules() -> None:
+    assert heavy_modules_imported_by("doc_search.app") == []
+
+
+def test_inference_service_does_not_import_heavy_modules() -> None:
+    assert heavy_modules_imported_by("doc_search.service") == []
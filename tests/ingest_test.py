@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+from py_executable_checklist.workflow import WorkflowBase
+
+from doc_search import ingest, shared_pool
+from doc_search.ingest import IngestJobs, find_pdfs, run_ingest
+from doc_search.workflow import ingest_state_path, run_in_pool
+
+ingested: list[str] = []
+
+
+class RecordPdf(WorkflowBase):
+    """
+    Record the content of the ingested PDF instead of training it
+    """
+
+    input_pdf_path: Path
+
+    def execute(self) -> dict:
+        content = self.input_pdf_path.read_text()
+        if content == "broken":
+            raise ValueError("Could not read PDF")
+        ingested.append(content)
+        return {}
+
+
+@pytest.fixture(autouse=True)
+def record_ingested(monkeypatch: pytest.MonkeyPatch) -> None:
+    ingested.clear()
+    monkeypatch.setattr(ingest, "training_workflow_steps", lambda _: [RecordPdf])
+
+
+def ingest_context(tmp_path: Path, source: str) -> dict[str, Any]:
+    return {
+        "app_dir": tmp_path,
+        "ingest": source,
+        "watch": False,
+        "watch_interval": 0,
+        "ingest_concurrency": 2,
+        "workers": 2,
+        "pipeline": False,
+    }
+
+
+def test_ingest_documents_once_by_content(tmp_path: Path) -> None:
+    inbox = tmp_path / "inbox"
+    (inbox / "nested").mkdir(parents=True)
+    (inbox / "first.pdf").write_bytes(b"first")
+    (inbox / "nested" / "second.PDF").write_bytes(b"second")
+    (inbox / "copy-of-first.pdf").write_bytes(b"first")
+    (inbox / "notes.txt").write_bytes(b"notes")
+
+    run_ingest(ingest_context(tmp_path, str(inbox)))
+    # Documents are found in path order, so the copy is queued before the original
+    assert sorted(ingested) == ["first", "second"]
+
+    ingested.clear()
+    (inbox / "renamed.pdf").write_bytes(b"second")
+    run_ingest(ingest_context(tmp_path, str(inbox)))
+    assert ingested == []
+
+    state = json.loads(ingest_state_path(tmp_path).read_text())
+    assert [job["status"] for job in state["jobs"].values()] == ["done", "done"]
+    assert not shared_pool.active
+
+
+def test_retry_failed_and_interrupted_documents_in_next_run(tmp_path: Path) -> None:
+    (tmp_path / "broken.pdf").write_bytes(b"broken")
+    (tmp_path / "interrupted.pdf").write_bytes(b"interrupted")
+    jobs = IngestJobs(ingest_state_path(tmp_path))
+    jobs.add(tmp_path / "interrupted.pdf")
+    jobs.update(jobs.pending()[0], "running")
+
+    run_ingest(ingest_context(tmp_path, str(tmp_path / "*.pdf")))
+
+    assert ingested == ["interrupted"]
+    statuses = {Path(job["path"]).name: job for job in IngestJobs(ingest_state_path(tmp_path)).jobs.values()}
+    assert statuses["interrupted.pdf"]["status"] == "done"
+    # Loading the state again queues the failed document for another attempt
+    assert statuses["broken.pdf"]["status"] == "pending"
+    assert json.loads(ingest_state_path(tmp_path).read_text())["jobs"]
+
+
+def test_keep_output_of_documents_with_the_same_name_apart(tmp_path: Path) -> None:
+    inbox = tmp_path / "inbox"
+    for folder, content in [("2022", b"first"), ("2023", b"second")]:
+        (inbox / folder).mkdir(parents=True)
+        (inbox / folder / "report.pdf").write_bytes(content)
+
+    run_ingest(ingest_context(tmp_path, str(inbox)))
+    assert sorted(ingested) == ["first", "second"]
+
+    ingested.clear()
+    (inbox / "2023" / "report.pdf").write_bytes(b"revised")
+    run_ingest(ingest_context(tmp_path, str(inbox)))
+    assert ingested == ["revised"]
+
+    copies = tmp_path.glob("OutputDir/dr-doc-search/report-*/report-*.pdf")
+    assert sorted(copy.read_text() for copy in copies) == ["first", "revised", "second"]
+
+
+def test_find_pdfs_matching_glob(tmp_path: Path) -> None:
+    for name in ["a.pdf", "b.pdf", "c.txt"]:
+        (tmp_path / name).write_bytes(name.encode())
+
+    assert find_pdfs(str(tmp_path / "*.pdf")) == [tmp_path / "a.pdf", tmp_path / "b.pdf"]
+
+
+def test_bound_page_work_of_all_documents_by_shared_pool() -> None:
+    running = 0
+    most_running = 0
+    lock = threading.Lock()
+
+    def process_page(_: int) -> None:
+        nonlocal running, most_running
+        with lock:
+            running += 1
+            most_running = max(most_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+
+    shared_pool.limit(3)
+    try:
+        documents = [threading.Thread(target=run_in_pool, args=(process_page, range(10), 4)) for _ in range(3)]
+        for document in documents:
+            document.start()
+        for document in documents:
+            document.join()
+    finally:
+        shared_pool.limit(None)
+
+    assert most_running == 3
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import json
+import sys
+import threading
+from pathlib import Path
+from typing import Any
+
+from py_executable_checklist.workflow import WorkflowBase, run_command
+
+from doc_search.instrumentation import (
+    count,
+    instrumentation,
+    run_workflow,
+    timed_command,
+)
+from doc_search.workflow import run_in_pool
+
+
+class ProcessItems(WorkflowBase):
+    """
+    Process some items with an external command
+    """
+
+    items: list
+
+    def execute(self) -> dict:
+        with timed_command(f"{sys.executable} -c pass"):
+            run_command(f"{sys.executable} -c pass")
+        count("items", len(self.items))
+        return {"processed": len(self.items)}
+
+
+def test_measure_every_step(tmp_path: Path) -> None:
+    instrumentation.reset()
+    context: dict[str, Any] = {"items": [1, 2, 3]}
+
+    run_workflow(context, [ProcessItems, ProcessItems])
+
+    assert context["processed"] == 3
+    steps = instrumentation.report()["steps"]
+    assert [step["step"] for step in steps] == ["ProcessItems", "ProcessItems"]
+    assert steps[0]["counts"] == {"items": 3}
+    assert steps[0]["commands"][Path(sys.executable).name]["runs"] == 1
+    assert steps[0]["wall_seconds"] > 0
+    assert steps[0]["children_cpu_seconds"] >= 0
+    assert steps[0]["process_peak_rss_bytes"] > 0
+
+    report_file = tmp_path / "metrics" / "run.json"
+    instrumentation.write_report(report_file)
+    assert json.loads(report_file.read_text())["steps"][1]["counts"] == {"items": 3}
+
+
+def test_export_totals_as_prometheus_metrics() -> None:
+    run_workflow({"items": [1, 2]}, [ProcessItems])
+
+    metrics = instrumentation.prometheus_metrics()
+
+    assert 'dr_doc_search_step_runs_total{step="ProcessItems"}' in metrics
+    assert 'dr_doc_search_step_items_total{step="ProcessItems",item="items"}' in metrics
+    assert "# TYPE dr_doc_search_step_seconds_total counter" in metrics
+
+
+def test_ignore_counts_outside_of_steps() -> None:
+    instrumentation.reset()
+
+    count("items")
+
+    assert instrumentation.report()["steps"] == []
+
+
+def test_count_in_the_step_of_the_same_thread_or_its_workers() -> None:
+    instrumentation.reset()
+    both_started = threading.Barrier(2)
+
+    def process_document(name: str, pages: int) -> None:
+        with instrumentation.step(name):
+            # Both steps are running while the pages are counted
+            both_started.wait()
+            run_in_pool(lambda _: count("pages"), range(pages), workers=2)
+
+    documents = [
+        threading.Thread(target=process_document, args=("first", 3)),
+        threading.Thread(target=process_document, args=("second", 5)),
+    ]
+    for document in documents:
+        document.start()
+    for document in documents:
+        document.join()
+
+    counts = {step["step"]: step["counts"] for step in instrumentation.report()["steps"]}
+    assert counts == {"first": {"pages": 3}, "second": {"pages": 5}}
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search import library as library_module
+from doc_search import workflow
+from doc_search.library import LibrarySearch, library_index_paths
+from doc_search.store import (
+    add_embeddings_to_store,
+    empty_faiss_store,
+    load_store,
+    save_store,
+)
+from doc_search.workflow import LoadLibraryIndex, sources_from
+from tests.create_index_test import FakeEmbeddings
+
+
+def indexed_pdf(app_dir: Path, name: str, texts: list[str], embedding: str = "huggingface") -> None:
+    index_path = app_dir / "OutputDir/dr-doc-search" / name / "index/docsearch.index"
+    index_path.parent.mkdir(parents=True)
+    docsearch = empty_faiss_store(FakeEmbeddings(), 3)
+    add_embeddings_to_store(
+        docsearch, texts, FakeEmbeddings().embed_documents(texts), [{"page": i} for i in range(len(texts))]
+    )
+    save_store(docsearch, index_path, embedding)
+
+
+def test_search_across_all_indexed_pdfs(tmp_path: Path) -> None:
+    indexed_pdf(tmp_path, "first", ["a", "bbbbbbbbbb"])
+    indexed_pdf(tmp_path, "second", ["aa", "cccccccccccccccccccc"])
+
+    library = LibrarySearch(library_index_paths(tmp_path), FakeEmbeddings(), "huggingface")
+    documents = library.similarity_search("aa", k=2)
+
+    assert [(d.page_content, d.metadata["source"]) for d in documents] == [("aa", "second"), ("a", "first")]
+    assert sources_from(documents) == ["second page 1", "first page 1"]
+
+
+def test_keep_least_recently_used_indexes_loaded(tmp_path: Path) -> None:
+    indexed_pdf(tmp_path, "first", ["a"])
+    indexed_pdf(tmp_path, "second", ["b"])
+
+    library = LibrarySearch(library_index_paths(tmp_path), FakeEmbeddings(), "huggingface", max_loaded=1)
+    library.similarity_search("a", k=1)
+
+    assert len(library.loaded) == 1
+
+
+def test_only_load_indexes_which_are_not_loaded(tmp_path: Path, monkeypatch: Any) -> None:
+    loaded: list[str] = []
+
+    def load_counted_store(index_path: Path, *args: Any) -> Any:
+        loaded.append(index_path.parent.parent.name)
+        return load_store(index_path, *args)
+
+    monkeypatch.setattr(library_module, "load_store", load_counted_store)
+    for name in ["first", "second", "third", "fourth", "fifth"]:
+        indexed_pdf(tmp_path, name, [name])
+
+    library = LibrarySearch(library_index_paths(tmp_path), FakeEmbeddings(), "huggingface", max_loaded=3)
+    loads = []
+    for _ in range(3):
+        documents = library.similarity_search("first", k=2)
+        loads.append(len(loaded))
+
+    assert loads == [5, 7, 9]
+    assert [d.page_content for d in documents] == ["fifth", "first"]
+    evicted = next(index_path for index_path in library.index_paths if index_path not in library.loaded)
+    assert library.document(evicted, 0).page_content == LibrarySearch.source_from(evicted)
+    assert len(loaded) == 9
+
+
+def test_skip_indexes_with_other_embedding(tmp_path: Path, monkeypatch: Any) -> None:
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_, **__: FakeEmbeddings())
+    indexed_pdf(tmp_path, "first", ["a"])
+    indexed_pdf(tmp_path, "second", ["b"], embedding="openai")
+
+    context: dict[str, Any] = {
+        "app_dir": tmp_path,
+        "embedding": "huggingface",
+        "embedding_threads": 0,
+        "quantize_embeddings": False,
+        "nprobe": 8,
+        "ef_search": 64,
+        "max_loaded_indexes": 4,
+    }
+    run_workflow(context, [LoadLibraryIndex])
+
+    assert [path.parent.parent.name for path in context["search_index"].index_paths] == ["first"]
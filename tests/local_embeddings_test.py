@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from transformers import BertConfig, BertModel, BertTokenizerFast  # type: ignore
+
+from doc_search.local_embeddings import LocalEmbeddings, benchmark_local_embeddings
+
+WORDS = ["money", "debt", "bank", "loan", "interest", "employment", "spending", "economy"]
+
+
+@pytest.fixture(scope="module")
+def tiny_model(tmp_path_factory: pytest.TempPathFactory) -> str:
+    """
+    Small randomly initialised model, so that the tests don't download the real one
+    """
+    model_dir = tmp_path_factory.mktemp("model")
+    vocab_file = model_dir / "vocab.txt"
+    vocab_file.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]))
+    BertTokenizerFast(vocab_file.as_posix()).save_pretrained(model_dir)
+    config = BertConfig(
+        vocab_size=len(WORDS) + 5, hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64
+    )
+    BertModel(config).save_pretrained(model_dir)
+    return Path(model_dir).as_posix()
+
+
+def test_embed_in_length_buckets_keeping_order(tiny_model: str) -> None:
+    embeddings = LocalEmbeddings(tiny_model, batch_size=2, threads=1)
+    texts = ["money debt bank loan", "money", "interest spending", "economy"]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert len(vectors) == 4
+    assert vectors[1] == pytest.approx(embeddings.embed_query("money"), abs=1e-5)
+    assert vectors[0] == pytest.approx(embeddings.embed_query("money debt bank loan"), abs=1e-5)
+
+
+def test_benchmark_quantized_against_original_model(tiny_model: str) -> None:
+    texts = [" ".join(WORDS[i:] + WORDS[:i]) for i in range(len(WORDS))]
+
+    report = benchmark_local_embeddings(texts, tiny_model, batch_size=4)
+
+    assert [row["model"] for row in report] == [tiny_model, f"{tiny_model}:int8"]
+    assert report[0]["agreement"] == 1.0
+    assert 0 <= report[1]["agreement"] <= 1
+    assert all(row["chunks_per_second"] > 0 for row in report)
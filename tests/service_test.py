@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Any, List, Optional
+
+from langchain.llms.base import LLM
+
+from doc_search import workflow
+from doc_search.service import InferenceService
+from tests.create_index_test import FakeEmbeddings
+from tests.store_test import saved_store
+
+
+class FakeLLM(LLM):
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        self.calls += 1
+        return "answer"
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+
+
+def service_context(tmp_path: Path, answer_cache_size: int = 0, answer_cache_similarity: float = 0) -> dict:
+    index_path = tmp_path / "docsearch.index"
+    saved_store(index_path)
+    return {
+        "app_dir": tmp_path,
+        "index_path": index_path,
+        "faiss_db": tmp_path / "index.pkl",
+        "embedding": "huggingface",
+        "embedding_threads": 0,
+        "quantize_embeddings": False,
+        "llm": "openai",
+        "nprobe": 8,
+        "ef_search": 64,
+        "answer_cache_size": answer_cache_size,
+        "answer_cache_ttl": 1,
+        "answer_cache_similarity": answer_cache_similarity,
+        "context_tokens": None,
+        "retrieve_k": 4,
+        "min_similarity": 0,
+        "retrieval": "vector",
+    }
+
+
+def test_load_index_and_llm_once_for_all_questions(tmp_path: Path, monkeypatch: Any) -> None:
+    loaded_llms = []
+
+    def load_llm(_: str) -> FakeLLM:
+        loaded_llms.append(FakeLLM())
+        return loaded_llms[-1]
+
+    monkeypatch.setattr(workflow, "embedding_from_selection", lambda *_, **__: FakeEmbeddings())
+    monkeypatch.setattr(workflow, "llm_from_selection", load_llm)
+
+    service = InferenceService(service_context(tmp_path))
+    search_index = service.context["search_index"]
+    answers = [service.ask(question) for question in ["first", "third"]]
+
+    assert len(loaded_llms) == 1
+    assert loaded_llms[0].calls == 2
+    assert answers[0]["sources"] == ["page 3", "page 1", "page 2"]
+    assert service.context["search_index"] is search_index
+
+    store_file = tmp_path / "store.json"
+    os.utime(store_file, ns=(store_file.stat().st_atime_ns, store_file.stat().st_mtime_ns + 1_000_000))
+    service.ask("first")
+
+    assert service.context["search_index"] is not search_index
+    assert len(loaded_llms) == 1
+
+    tokens: list[str] = []
+    assert service.ask("first", tokens.append)["output"] == "answer"
+    assert tokens == ["answer"]
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import pickle
+from pathlib import Path
+from typing import Any
+
+import faiss  # type: ignore
+import pytest
+from langchain.docstore.document import Document
+from py_executable_checklist.workflow import run_workflow
+
+from doc_search import workflow
+from doc_search.store import (
+    MmapDocstore,
+    add_embeddings_to_store,
+    empty_faiss_store,
+    load_store,
+    save_store,
+)
+from doc_search.workflow import LoadIndex
+from tests.create_index_test import FakeEmbeddings
+
+
+def saved_store(index_path: Path) -> list[str]:
+    texts = ["first chunk", "second chunk with ümlauts", "third"]
+    docsearch = empty_faiss_store(FakeEmbeddings(), 3)
+    add_embeddings_to_store(
+        docsearch, texts, FakeEmbeddings().embed_documents(texts), [{"page": i} for i in range(len(texts))]
+    )
+    save_store(docsearch, index_path, "huggingface")
+    return texts
+
+
+def test_memory_map_saved_store(tmp_path: Path) -> None:
+    texts = saved_store(tmp_path / "docsearch.index")
+
+    docsearch = load_store(tmp_path / "docsearch.index", FakeEmbeddings())
+
+    assert isinstance(docsearch.docstore, MmapDocstore)
+    assert docsearch.similarity_search("second chunk with ümlauts", k=1) == [
+        Document(page_content=texts[1], metadata={"page": 1})
+    ]
+    assert docsearch.docstore.search("3") == "ID 3 not found."
+
+
+def file_mappings(path: Path) -> list[tuple[int, int]]:
+    mappings = []
+    for line in Path("/proc/self/maps").read_text().splitlines():
+        if line.endswith(path.as_posix()):
+            start, end = line.split()[0].split("-")
+            mappings.append((int(start, 16), int(end, 16)))
+    return mappings
+
+
+@pytest.mark.skipif(
+    not hasattr(faiss, "IO_FLAG_MMAP_IFC") or not Path("/proc/self/maps").exists(),
+    reason="Needs FAISS 1.11 and /proc to map flat indexes",
+)
+def test_memory_map_flat_index_vectors(tmp_path: Path) -> None:
+    saved_store(tmp_path / "docsearch.index")
+
+    docsearch = load_store(tmp_path / "docsearch.index", FakeEmbeddings())
+
+    codes = docsearch.index.codes
+    assert not codes.is_owned
+    assert any(start <= int(codes.c_ptr) < end for start, end in file_mappings(tmp_path / "docsearch.index"))
+
+
+def test_load_saved_store_for_update(tmp_path: Path) -> None:
+    saved_store(tmp_path / "docsearch.index")
+
+    docsearch = load_store(tmp_path / "docsearch.index", FakeEmbeddings(), memory_map=False)
+    add_embeddings_to_store(docsearch, ["fourth"], [[6.0, 0.0, 1.0]])
+
+    assert docsearch.index.ntotal == 4
+    assert len(docsearch.index_to_docstore_id) == 4
+
+
+def test_load_index_from_store_or_legacy_pickle(tmp_path: Path, monkeypatch: Any) -> None:
+    embedding_options: list[dict] = []
+
+    def load_embeddings(_: str, **options: Any) -> FakeEmbeddings:
+        embedding_options.append(options)
+        return FakeEmbeddings()
+
+    monkeypatch.setattr(workflow, "embedding_from_selection", load_embeddings)
+    legacy_dir = tmp_path / "legacy"
+    legacy_dir.mkdir()
+    docsearch = empty_faiss_store(FakeEmbeddings(), 3)
+    add_embeddings_to_store(docsearch, ["legacy"], [[6.0, 1.0, 1.0]])
+    faiss.write_index(docsearch.index, (legacy_dir / "docsearch.index").as_posix())
+    with open(legacy_dir / "index.pkl", "wb") as f:
+        pickle.dump(docsearch, f)
+    saved_store(tmp_path / "docsearch.index")
+
+    for index_dir, expected_count in [(tmp_path, 3), (legacy_dir, 1)]:
+        context: dict[str, Any] = {
+            "index_path": index_dir / "docsearch.index",
+            "faiss_db": index_dir / "index.pkl",
+            "embedding": "huggingface",
+            "embedding_threads": 2,
+            "quantize_embeddings": True,
+            "nprobe": 8,
+            "ef_search": 64,
+        }
+        run_workflow(context, [LoadIndex])
+        assert context["search_index"].index.ntotal == expected_count
+    # Questions are embedded like the chunks were
+    assert embedding_options == [{"threads": 2, "quantize": True}] * 2
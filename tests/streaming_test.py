@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+from typing import Any, Iterator
+
+import pytest
+from langchain import OpenAI
+from langchain.llms.huggingface_pipeline import HuggingFacePipeline
+
+from doc_search.streaming import stream_tokens
+from tests.service_test import FakeLLM
+
+
+class FakePipeline:
+    task = "text2text-generation"
+    tokenizer = None
+
+    def __init__(self, error: Exception | None = None) -> None:
+        self.error = error
+
+    def __call__(self, prompt: str, streamer: Any) -> None:
+        if self.error:
+            raise self.error
+        for word in ["streamed ", "answer"]:
+            streamer.on_finalized_text(word)
+        streamer.end()
+
+
+def test_stream_openai_tokens(monkeypatch: pytest.MonkeyPatch) -> None:
+    def stream(_: OpenAI, prompt: str) -> Iterator[dict]:
+        return iter({"choices": [{"text": token}]} for token in ["streamed ", "answer"])
+
+    monkeypatch.setattr(OpenAI, "stream", stream)
+
+    assert list(stream_tokens(OpenAI(openai_api_key="key"), "prompt")) == ["streamed ", "answer"]
+
+
+def test_stream_huggingface_tokens() -> None:
+    llm = HuggingFacePipeline(pipeline=FakePipeline())
+
+    assert "".join(stream_tokens(llm, "prompt")) == "streamed answer"
+
+
+def test_raise_error_of_huggingface_pipeline() -> None:
+    llm = HuggingFacePipeline(pipeline=FakePipeline(RuntimeError("out of memory")))
+
+    with pytest.raises(RuntimeError, match="out of memory"):
+        list(stream_tokens(llm, "prompt"))
+
+
+def test_return_whole_completion_of_llm_without_streaming() -> None:
+    assert list(stream_tokens(FakeLLM(), "prompt")) == ["answer"]
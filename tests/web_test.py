@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+from doc_search.web import ChatSession
+
+
+class SlowService:
+    def __init__(self) -> None:
+        self.threads: set[str] = set()
+
+    def ask(self, question: str, on_token: Callable[[str], None]) -> dict:
+        self.threads.add(threading.current_thread().name)
+        time.sleep(0.2)
+        for token in ["answer ", "to ", question]:
+            on_token(token)
+        return {"output": f"answer to {question}"}
+
+
+def chat_session(service: Any, executor: ThreadPoolExecutor, archive_file: Path) -> ChatSession:
+    return ChatSession(service, executor, archive_file, "Ask me something", "summary")
+
+
+def test_answer_questions_of_sessions_concurrently(tmp_path: Path) -> None:
+    service = SlowService()
+    archive_file = tmp_path / "archive.md"
+    executor = ThreadPoolExecutor(max_workers=4)
+    sessions = [chat_session(service, executor, archive_file) for _ in range(4)]
+    for i, session in enumerate(sessions):
+        session.txt_input.value_input = f"question {i}"
+
+    async def ask_all() -> None:
+        await asyncio.gather(*(session.ask(None) for session in sessions))
+
+    started = time.perf_counter()
+    asyncio.run(ask_all())
+
+    assert time.perf_counter() - started < 0.6
+    assert len(service.threads) == 4
+    for i, session in enumerate(sessions):
+        assert len(session.conversations) == 3
+        assert f"answer to question {i}" in session.conversations[0][0].object
+        assert session.txt_input.value_input == ""
+        assert not session.btn_ask.disabled
+    archive = archive_file.read_text()
+    assert all(f"answer to question {i}" in archive for i in range(4))
+
+
+def test_ignore_empty_question(tmp_path: Path) -> None:
+    session = chat_session(SlowService(), ThreadPoolExecutor(max_workers=1), tmp_path / "archive.md")
+
+    asyncio.run(session.ask(None))
+
+    assert len(session.conversations) == 2
+    assert not (tmp_path / "archive.md").exists()
@@ -4,8 +4,10 @@ from doc_search.workflow import (
     ConvertImagesToText,
     ConvertPDFToImages,
     CreateIndex,
+    ExtractTextLayer,
     ImageMagickCommand,
     LoadIndex,
+    LoadLLM,
     VerifyInputFile,
     workflow_steps,
 )
@@ -16,11 +18,13 @@ def test_return_expected_workflow() -> None:
 
     assert expected_workflow_steps == [
         VerifyInputFile,
+        ExtractTextLayer,
         ImageMagickCommand,
         ConvertPDFToImages,
         ConvertImagesToText,
         CombineAllText,
         CreateIndex,
         LoadIndex,
+        LoadLLM,
         AskQuestion,
     ]